@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Polygon-targeted alerts.
+
+An alert may carry a GeoJSON Polygon or MultiPolygon (`area`) with its
+bounding box stored in separate columns. Matching works on the geo.py grid:
+
+- a user's own alerts: SQL bounding-box prefilter over active alerts, then an
+  exact point-in-polygon test against edges bucketed by grid row;
+- an alert's audience: the polygon is rasterized into grid cells that are
+  entirely inside (taken straight from the geo_cell index, no per-point test)
+  or crossed by an edge (candidates refined point by point).
+
+Coordinates are treated as planar lat/lng, which is accurate enough for
+district-scale areas and does not support areas crossing the antimeridian.
+
+Benchmark with `python alert_areas.py bench [--users 1000000]`.
+"""
+
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from functools import lru_cache
+
+from sqlalchemy import insert, or_, select
+
+import metrics
+from database import db
+from geo import GEO_CELL_DEG, GRID_COLS, cell_col, cell_id, cell_row
+from models import Alert, User
+
+MAX_AREA_VERTICES = int(os.getenv('ALERT_AREA_MAX_VERTICES', '20000'))
+# Cell ranges per SQL statement when resolving an audience
+_RANGES_PER_QUERY = 200
+
+
+class AreaError(ValueError):
+    """Raised for a missing or malformed GeoJSON area"""
+
+
+def parse_area(value):
+    """Validate a GeoJSON Polygon/MultiPolygon (or Feature); returns (geometry, bbox)"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise AreaError('area must be GeoJSON')
+    if not isinstance(value, dict):
+        raise AreaError('area must be a GeoJSON object')
+    if value.get('type') == 'Feature':
+        value = value.get('geometry') or {}
+
+    geometry_type = value.get('type')
+    coordinates = value.get('coordinates')
+    if geometry_type == 'Polygon':
+        polygons = [coordinates]
+    elif geometry_type == 'MultiPolygon':
+        polygons = coordinates
+    else:
+        raise AreaError('area must be a Polygon or MultiPolygon')
+    if not isinstance(polygons, list) or not polygons:
+        raise AreaError('area has no coordinates')
+
+    normalized = []
+    vertices = 0
+    for polygon in polygons:
+        if not isinstance(polygon, list) or not polygon:
+            raise AreaError('each polygon needs at least an outer ring')
+        rings = []
+        for ring in polygon:
+            try:
+                points = [(float(p[0]), float(p[1])) for p in ring]
+            except (TypeError, ValueError, IndexError):
+                raise AreaError('positions must be [longitude, latitude] pairs')
+            if points and points[0] != points[-1]:
+                points.append(points[0])
+            if len(points) < 4:
+                raise AreaError('each ring needs at least three distinct positions')
+            if not all(-180 <= lng <= 180 and -90 <= lat <= 90 for lng, lat in points):
+                raise AreaError('positions must be within longitude [-180, 180] and latitude [-90, 90]')
+            vertices += len(points)
+            rings.append([[lng, lat] for lng, lat in points])
+        normalized.append(rings)
+    if vertices > MAX_AREA_VERTICES:
+        raise AreaError(f'area has more than {MAX_AREA_VERTICES} positions')
+
+    all_points = [p for polygon in normalized for ring in polygon for p in ring]
+    bbox = (
+        min(p[1] for p in all_points), min(p[0] for p in all_points),
+        max(p[1] for p in all_points), max(p[0] for p in all_points)
+    )
+    if len(normalized) == 1:
+        geometry = {'type': 'Polygon', 'coordinates': normalized[0]}
+    else:
+        geometry = {'type': 'MultiPolygon', 'coordinates': normalized}
+    return geometry, bbox
+
+
+def set_area(alert, value):
+    """Validate and store an area (or clear it with None) on an Alert"""
+    if value is None:
+        alert.area = None
+        alert.bbox_min_lat = alert.bbox_min_lng = alert.bbox_max_lat = alert.bbox_max_lng = None
+        return
+    geometry, bbox = parse_area(value)
+    alert.area = json.dumps(geometry, separators=(',', ':'))
+    alert.bbox_min_lat, alert.bbox_min_lng, alert.bbox_max_lat, alert.bbox_max_lng = bbox
+
+
+class PreparedArea:
+    """Polygon edges bucketed by grid row for fast containment and cell cover"""
+
+    def __init__(self, geometry):
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        self.edges_by_row = {}
+        lats, lngs = [], []
+        for polygon in polygons:
+            for ring in polygon:
+                for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+                    edge = (x1, y1, x2, y2)
+                    for row in range(cell_row(min(y1, y2)), cell_row(max(y1, y2)) + 1):
+                        self.edges_by_row.setdefault(row, []).append(edge)
+                    lats.append(y1)
+                    lngs.append(x1)
+        self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+
+    @staticmethod
+    def _crossings(edges, y):
+        # Even-odd rule: holes and disjoint parts need no special casing
+        return sorted(
+            x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            for x1, y1, x2, y2 in edges if (y1 > y) != (y2 > y)
+        )
+
+    def contains(self, latitude, longitude):
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat <= latitude <= max_lat and min_lng <= longitude <= max_lng):
+            return False
+        crossings = self._crossings(self.edges_by_row.get(cell_row(latitude), ()), latitude)
+        return (len(crossings) - bisect.bisect_right(crossings, longitude)) % 2 == 1
+
+    def cover(self):
+        """(inside, boundary) lists of inclusive cell id ranges"""
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        first_col, last_col = cell_col(min_lng), cell_col(max_lng)
+        inside, boundary = [], []
+
+        for row in range(cell_row(min_lat), cell_row(max_lat) + 1):
+            y0 = -90 + row * GEO_CELL_DEG
+            y1 = y0 + GEO_CELL_DEG
+            edges = self.edges_by_row.get(row, ())
+
+            # Cells crossed by an edge, from each edge clipped to this row's band
+            crossed = []
+            for ex1, ey1, ex2, ey2 in edges:
+                if ey1 == ey2:
+                    xs = (ex1, ex2)
+                else:
+                    xs = [
+                        ex1 + (min(max(y, min(ey1, ey2)), max(ey1, ey2)) - ey1) * (ex2 - ex1) / (ey2 - ey1)
+                        for y in (y0, y1)
+                    ]
+                crossed.append((cell_col(min(xs)), cell_col(max(xs))))
+            crossed.sort()
+            spans = []
+            for a, b in crossed:
+                if spans and a <= spans[-1][1] + 1:
+                    spans[-1][1] = max(spans[-1][1], b)
+                else:
+                    spans.append([a, b])
+
+            # Every other cell lies wholly inside or outside: test its centre
+            crossings = self._crossings(edges, y0 + GEO_CELL_DEG / 2)
+            base = row * GRID_COLS
+            col = first_col
+            run_start = None
+            span_index = 0
+            while col <= last_col:
+                if span_index < len(spans) and spans[span_index][0] <= col:
+                    a, b = spans[span_index]
+                    if run_start is not None:
+                        inside.append((base + run_start, base + col - 1))
+                        run_start = None
+                    boundary.append((base + max(a, first_col), base + min(b, last_col)))
+                    col = b + 1
+                    span_index += 1
+                    continue
+                centre = -180 + (col + 0.5) * GEO_CELL_DEG
+                is_inside = (len(crossings) - bisect.bisect_right(crossings, centre)) % 2 == 1
+                if is_inside and run_start is None:
+                    run_start = col
+                elif not is_inside and run_start is not None:
+                    inside.append((base + run_start, base + col - 1))
+                    run_start = None
+                col += 1
+            if run_start is not None:
+                inside.append((base + run_start, base + last_col))
+        return inside, boundary
+
+
+@lru_cache(maxsize=256)
+def prepare(area):
+    """PreparedArea for a stored area string, cached per process"""
+    return PreparedArea(json.loads(area))
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def resolve_audience(model, area):
+    """Sorted ids of located rows of model (User or Community) inside a stored area"""
+    started = time.perf_counter()
+    prepared = prepare(area)
+    inside, boundary = prepared.cover()
+
+    ids = []
+    for chunk in _chunks(inside, _RANGES_PER_QUERY):
+        ids.extend(db.session.scalars(select(model.id).where(or_(*[
+            model.geo_cell.between(first, last) for first, last in chunk
+        ]))))
+    candidates = 0
+    for chunk in _chunks(boundary, _RANGES_PER_QUERY):
+        rows = db.session.execute(select(model.id, model.latitude, model.longitude).where(or_(*[
+            model.geo_cell.between(first, last) for first, last in chunk
+        ])))
+        for row_id, lat, lng in rows:
+            candidates += 1
+            if prepared.contains(lat, lng):
+                ids.append(row_id)
+    ids.sort()
+
+    metrics.incr('alert_areas.audience_resolutions')
+    metrics.incr('alert_areas.point_tests', candidates)
+    metrics.set_gauge('alert_areas.last_resolve_ms', round((time.perf_counter() - started) * 1000, 1))
+    return ids
+
+
+def matching_alert_ids(latitude, longitude, active_filter):
+    """Ids of active polygon alerts containing a point"""
+    rows = db.session.query(Alert.id, Alert.area).filter(
+        active_filter,
+        Alert.area.isnot(None),
+        Alert.bbox_min_lat <= latitude, Alert.bbox_max_lat >= latitude,
+        Alert.bbox_min_lng <= longitude, Alert.bbox_max_lng >= longitude
+    ).all()
+    return [alert_id for alert_id, area in rows if prepare(area).contains(latitude, longitude)]
+
+
+def warm_prepared_areas(active_filter, limit=256):
+    """Prepare the areas of active polygon alerts ahead of the first lookup; returns how many"""
+    areas = db.session.scalars(
+        select(Alert.area).where(active_filter, Alert.area.isnot(None)).order_by(Alert.id.desc()).limit(limit)
+    ).all()
+    for area in areas:
+        prepare(area)
+    return len(areas)
+
+
+def _state_like_polygon(rng, centre_lat, centre_lng, vertices=400):
+    """Irregular closed ring a few hundred km across"""
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = 2.5 + 0.8 * math.sin(3 * angle) + rng.uniform(-0.1, 0.1)
+        ring.append([centre_lng + radius * math.cos(angle), centre_lat + radius * math.sin(angle)])
+    ring.append(ring[0])
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+
+def benchmark(user_count, repeats):
+    """Audience of a state-scale polygon over user_count located users: grid cover vs bbox scan"""
+    rng = random.Random(7)
+    started = time.perf_counter()
+    for start in range(0, user_count, 10000):
+        rows = []
+        for i in range(start, min(user_count, start + 10000)):
+            # Spread over India's bounding box
+            lat, lng = rng.uniform(8, 35), rng.uniform(68, 97)
+            rows.append({
+                'username': f'bench{i}', 'email': f'bench{i}@example.invalid', 'password_hash': '-',
+                'latitude': lat, 'longitude': lng, 'geo_cell': cell_id(lat, lng), 'is_admin': False
+            })
+        db.session.execute(insert(User), rows)
+    db.session.commit()
+    print(f"Inserted {user_count} users in {time.perf_counter() - started:.1f}s")
+
+    geometry, _ = parse_area(_state_like_polygon(rng, 20.5, 77.0))
+    area = json.dumps(geometry)
+
+    timings = []
+    for _ in range(repeats):
+        prepare.cache_clear()
+        started = time.perf_counter()
+        ids = resolve_audience(User, area)
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f" grid: best {min(timings):8.1f} ms  mean {sum(timings) / len(timings):8.1f} ms  ({len(ids)} users)")
+
+    # Baseline: bounding-box scan with a point-in-polygon test per candidate
+    prepared = prepare(area)
+    min_lat, min_lng, max_lat, max_lng = prepared.bbox
+    started = time.perf_counter()
+    naive = sorted(
+        user_id for user_id, lat, lng in db.session.execute(select(User.id, User.latitude, User.longitude).where(
+            User.latitude.between(min_lat, max_lat), User.longitude.between(min_lng, max_lng)
+        )) if prepared.contains(lat, lng)
+    )
+    print(f" bbox: {(time.perf_counter() - started) * 1000:8.1f} ms  ({len(naive)} users)")
+    return naive == ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Polygon alert audience benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench_parser = sub.add_parser('bench')
+    bench_parser.add_argument('--users', type=int, default=1000000)
+    bench_parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    # Never touch the configured database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app
+
+    with app.app_context():
+        try:
+            ok = benchmark(args.users, args.repeats)
+        finally:
+            db.session.remove()
+            os.remove(scratch.name)
+    print('Results match' if ok else 'Results differ')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Who an alert reaches, resolved from an in-memory index instead of the users table.
+
+Each worker keeps a user-location index: state -> city -> sorted NumPy array
+of user ids (city None holds users who gave only a state, state None users
+who gave neither). Every flush that inserts or deletes a User or changes
+their state/city appends a `user_location_events` row with the old and new
+location in the same transaction; before resolving, a worker replays the
+events it has not seen yet, as the leaderboards do (event_cursor.py also
+picks up events that commit out of seq order). The index is built by
+reading users once in (state, city, id) order off ix_users_location; after
+that a state-wide audience is its city arrays merged, with no query at all.
+
+Audiences follow what /alerts shows:
+- community alerts: the community's active members
+- polygon alerts: users inside the area (alert_areas.resolve_audience)
+- city alerts: users in the city, plus users in the state who gave no city
+- state alerts: every user in the state
+- alerts with neither: every user
+Users who gave no state are shown every alert, so they are in every
+state and city audience too.
+
+create_alert and feed ingestion (alert_feeds.py) stage an `alert_audience`
+outbox event; the outbox dispatcher streams the audience to AUDIENCE_SINK as
+arrays of AUDIENCE_CHUNK_SIZE ids, resuming after the last delivered id on
+retry.
+
+Benchmark: python alert_audience.py bench [--users 5000000]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import delete, event, insert, inspect, select
+from sqlalchemy.orm import Session
+
+import alert_areas
+import metrics
+from database import db
+from event_cursor import EventCursor
+from models import Alert, CommunityMember, OutboxEvent, User, UserLocationEvent
+
+AUDIENCE_SINK = os.getenv('AUDIENCE_SINK', 'file:' + os.path.join(os.path.dirname(__file__), 'instance', 'alert_audiences.ndjson'))
+AUDIENCE_CHUNK_SIZE = int(os.getenv('AUDIENCE_CHUNK_SIZE', '10000'))
+# Events older than this are pruned; a worker idle for longer rebuilds instead of replaying
+AUDIENCE_EVENT_RETENTION_HOURS = int(os.getenv('AUDIENCE_EVENT_RETENTION_HOURS', '24'))
+FETCH_SIZE = 100000
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+class LocationIndex:
+    """In-memory user ids by (state, city) for this worker, kept in step with user_location_events"""
+
+    def __init__(self):
+        self._states = {}  # state -> {city: sorted id array}
+        self._cursor = EventCursor(UserLocationEvent.seq, UserLocationEvent.created_at)
+        self._last_sync = 0
+        self._lock = threading.RLock()
+
+    def _rebuild(self):
+        states = {}
+        connection = db.session.connection()
+        # Plain DBAPI tuples: Row objects cost more than the grouping itself at this size
+        raw = connection.connection
+        if connection.dialect.name == 'postgresql':
+            cursor = raw.cursor(name='alert_audience_index')  # server-side, streamed in chunks
+            cursor.itersize = FETCH_SIZE
+        else:
+            cursor = raw.cursor()
+        try:
+            cursor.execute('SELECT state, city, id FROM users ORDER BY state, city, id')
+            pending = {}
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for (state, city), group in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+                    pending.setdefault((state, city), []).append(np.fromiter((row[2] for row in group), dtype=np.int64))
+        finally:
+            cursor.close()
+        for (state, city), parts in pending.items():
+            ids = np.concatenate(parts)
+            # The DBAPI sort order of NULLs and collations may differ from ours; ids must be sorted
+            if len(ids) > 1 and (np.diff(ids) < 0).any():
+                ids = np.sort(ids)
+            states.setdefault(state, {})[city] = ids
+        self._states = states
+        metrics.incr('alert_audience.index_rebuilds')
+        metrics.set_gauge('alert_audience.index_users', self.size())
+
+    def size(self):
+        return sum(len(ids) for cities in self._states.values() for ids in cities.values())
+
+    def _apply(self, events, late_seqs=()):
+        """Move each user from where they were before these events to where they are after them"""
+        before, after = {}, {}
+        # A late event's old/new values may be older than ones already applied:
+        # look for its user everywhere and take their location from users instead
+        late_users = {user_id for seq, user_id, *_ in events if seq in late_seqs}
+        for user_id in late_users:
+            before[user_id] = '?'
+            after[user_id] = None
+        lookup = sorted(late_users)
+        for start in range(0, len(lookup), 500):
+            for user_id, state, city in db.session.query(User.id, User.state, User.city).filter(
+                User.id.in_(lookup[start:start + 500])
+            ):
+                after[user_id] = (state, city)
+
+        for seq, user_id, op, old_known, old_state, old_city, new_state, new_city in events:
+            if user_id in late_users:
+                continue
+            if user_id not in before:
+                if op == 'insert':
+                    before[user_id] = None
+                else:
+                    before[user_id] = (old_state, old_city) if old_known else '?'
+            after[user_id] = None if op == 'delete' else (new_state, new_city)
+
+        removals, additions, unknown = {}, {}, []
+        for user_id, place in before.items():
+            if place == '?':
+                unknown.append(user_id)
+            elif place is not None:
+                removals.setdefault(place, []).append(user_id)
+        for user_id, place in after.items():
+            if place is not None:
+                additions.setdefault(place, []).append(user_id)
+
+        if unknown:
+            # Previous location unknown: look for these users everywhere
+            unknown = np.array(sorted(unknown), dtype=np.int64)
+            for state, cities in self._states.items():
+                for city, ids in cities.items():
+                    cities[city] = ids[~np.isin(ids, unknown, assume_unique=True)]
+        for (state, city), user_ids in removals.items():
+            cities = self._states.get(state, {})
+            if city in cities:
+                cities[city] = np.setdiff1d(cities[city], np.array(user_ids, dtype=np.int64), assume_unique=True)
+        for (state, city), user_ids in additions.items():
+            cities = self._states.setdefault(state, {})
+            cities[city] = np.union1d(cities.get(city, _EMPTY), np.array(user_ids, dtype=np.int64))
+
+        for state in list(self._states):
+            cities = self._states[state]
+            for city in [city for city, ids in cities.items() if not len(ids)]:
+                del cities[city]
+            if not cities:
+                del self._states[state]
+
+    def sync(self):
+        """Apply events committed by any worker since the last sync"""
+        with self._lock:
+            stale = time.monotonic() - self._last_sync > AUDIENCE_EVENT_RETENTION_HOURS * 3600 / 2
+            if self._cursor.last_seq is None or stale:
+                self._cursor.reset()
+                self._rebuild()
+                self._last_sync = time.monotonic()
+                return
+
+            events, late_seqs = self._cursor.fetch(
+                UserLocationEvent.user_id, UserLocationEvent.op, UserLocationEvent.old_known,
+                UserLocationEvent.old_state, UserLocationEvent.old_city,
+                UserLocationEvent.new_state, UserLocationEvent.new_city
+            )
+            self._last_sync = time.monotonic()
+            if not events:
+                return
+
+            # See record_rebuild()
+            if any(user_id is None for _, user_id, *_ in events):
+                self._rebuild()
+                self._cursor.applied(events)
+                return
+            self._apply(events, late_seqs)
+            self._cursor.applied(events)
+            metrics.incr('alert_audience.events_applied', len(events))
+            metrics.set_gauge('alert_audience.index_users', self.size())
+
+    def users_in(self, state=None, city=None, everywhere=False):
+        """
+        Sorted ids of users in a state (or one city of it, with the state's
+        city-less users), plus the users who gave no state
+        """
+        with self._lock:
+            if everywhere:
+                parts = [ids for cities in self._states.values() for ids in cities.values()]
+            elif city is not None:
+                cities = self._states.get(state, {})
+                parts = [cities.get(city, _EMPTY), cities.get(None, _EMPTY)]
+            else:
+                parts = list(self._states.get(state, {}).values())
+            if not everywhere and state is not None:
+                parts += list(self._states.get(None, {}).values())
+        parts = [ids for ids in parts if len(ids)]
+        if not parts:
+            return _EMPTY
+        if len(parts) == 1:
+            return parts[0]
+        # Buckets are disjoint, so sorting the concatenation merges them
+        return np.sort(np.concatenate(parts))
+
+
+index = LocationIndex()
+
+
+def resolve(alert):
+    """Sorted user ids an alert is for, as a NumPy array"""
+    started = time.perf_counter()
+    if alert.community_id is not None:
+        ids = np.fromiter((user_id for user_id, in db.session.query(CommunityMember.user_id).filter_by(
+            community_id=alert.community_id, status='active'
+        ).order_by(CommunityMember.user_id)), dtype=np.int64)
+    elif alert.area:
+        ids = np.array(sorted(alert_areas.resolve_audience(User, alert.area)), dtype=np.int64)
+    else:
+        index.sync()
+        ids = index.users_in(alert.state, alert.city, everywhere=alert.state is None)
+    metrics.set_gauge('alert_audience.last_resolve_ms', round((time.perf_counter() - started) * 1000, 2))
+    metrics.set_gauge('alert_audience.last_size', int(len(ids)))
+    return ids
+
+
+# Delivery through the outbox
+
+def add_delivery_event(alert):
+    """Stage an outbox row that streams alert's audience to the sink (flushed alert; caller commits)"""
+    payload = {
+        'alert_id': alert.id,
+        'title': alert.title,
+        'severity': alert.severity,
+        'alert_type': alert.alert_type,
+    }
+    db.session.add(OutboxEvent(
+        event_type='alert_audience',
+        dedup_key=f'alert:{alert.id}',
+        community_id=alert.community_id,
+        payload=json.dumps(payload)
+    ))
+    metrics.incr('alert_audience.deliveries_enqueued')
+
+
+def deliver(event, payload, sink, chunk_size=AUDIENCE_CHUNK_SIZE):
+    """Send the audience after event.cursor in chunks, committing progress after each; returns ids sent"""
+    alert = db.session.get(Alert, payload['alert_id'])
+    if alert is None:
+        return 0
+    ids = resolve(alert)
+    ids = ids[np.searchsorted(ids, event.cursor or 0, side='right'):]
+    sent = 0
+    for number, start in enumerate(range(0, len(ids), chunk_size)):
+        chunk = ids[start:start + chunk_size]
+        sink.send([{
+            'notification_id': f'{event.id}:{int(chunk[0])}',
+            'user_ids': chunk.tolist(),
+            **payload
+        }])
+        # Advance the cursor after every chunk so a retry skips it
+        event.cursor = int(chunk[-1])
+        event.delivered_count = (event.delivered_count or 0) + len(chunk)
+        event.locked_at = datetime.utcnow()
+        db.session.commit()
+        sent += len(chunk)
+        metrics.incr('alert_audience.chunks_sent')
+    metrics.incr('alert_audience.recipients_sent', sent)
+    return sent
+
+
+# Change tracking
+
+def record_rebuild(session):
+    """Make every worker rebuild its index, after users changed without the ORM (bulk deletes)"""
+    record_location_changes(session, [(None, None, False, None, None, None, None)])
+
+
+def record_location_changes(session, changes):
+    """Append (user_id, op, old_known, old_state, old_city, new_state, new_city) events"""
+    if not changes:
+        return
+    now = datetime.utcnow()
+    session.connection().execute(insert(UserLocationEvent), [
+        {'user_id': user_id, 'op': op, 'old_known': old_known, 'old_state': old_state, 'old_city': old_city,
+         'new_state': new_state, 'new_city': new_city, 'created_at': now}
+        for user_id, op, old_known, old_state, old_city, new_state, new_city in changes
+    ])
+    metrics.incr('alert_audience.events_recorded', len(changes))
+
+
+def _previous(history, current):
+    """(value before this flush, whether it is known)"""
+    if history.deleted:
+        return history.deleted[0], True
+    if history.added:
+        return None, False  # replaced without the old value ever being loaded
+    return current, True
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_location_changes(session, flush_context):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, User):
+            changes.append((obj.id, 'insert', True, None, None, obj.state, obj.city))
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            attrs = inspect(obj).attrs
+            if not (attrs.state.history.has_changes() or attrs.city.history.has_changes()):
+                continue
+            old_state, state_known = _previous(attrs.state.history, obj.state)
+            old_city, city_known = _previous(attrs.city.history, obj.city)
+            changes.append((obj.id, 'update', state_known and city_known, old_state, old_city, obj.state, obj.city))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            loaded = obj.__dict__
+            known = 'state' in loaded and 'city' in loaded
+            changes.append((obj.id, 'delete', known, loaded.get('state'), loaded.get('city'), None, None))
+    record_location_changes(session, changes)
+
+
+def prune_events():
+    """Drop replayed events past the retention window"""
+    cutoff = datetime.utcnow() - timedelta(hours=AUDIENCE_EVENT_RETENTION_HOURS)
+    # Always keep the newest event so max(seq) never goes backwards
+    newest = db.session.query(db.func.max(UserLocationEvent.seq)).scalar()
+    if newest is None:
+        return 0
+    result = db.session.execute(delete(UserLocationEvent).where(
+        UserLocationEvent.created_at < cutoff,
+        UserLocationEvent.seq < newest
+    ))
+    db.session.commit()
+    return result.rowcount
+
+
+# Benchmark
+
+def benchmark(user_count, moves=10000):
+    """Seed user_count users, half of them in one state, and resolve that state from the index and from SQL"""
+    rng = random.Random(11)
+    states = [f'State {s}' for s in range(36)]
+    cities = {state: [f'{state} City {c}' for c in range(40)] for state in states}
+    big = states[0]
+    base = db.session.query(db.func.max(User.id)).scalar() or 0
+
+    started = time.perf_counter()
+    raw = db.session.connection().connection
+    cursor = raw.cursor()
+    for start in range(0, user_count, 200000):
+        rows = []
+        for i in range(start, min(user_count, start + 200000)):
+            state = big if i % 2 == 0 else rng.choice(states)
+            city = rng.choice(cities[state]) if rng.random() > 0.05 else None
+            rows.append((base + i + 1, f'aud{i}', f'aud{i}@example.invalid', '-', state, city))
+        cursor.executemany(
+            'INSERT INTO users (id, username, email, password_hash, state, city) VALUES (?, ?, ?, ?, ?, ?)', rows
+        )
+    raw.commit()
+    print(f"Seeded {user_count} users in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    index.sync()
+    print(f"Index build: {time.perf_counter() - started:.2f}s for {index.size()} users")
+
+    alert = Alert(title='Bench', message='-', alert_type='weather', severity='high', state=big)
+    db.session.add(alert)
+    db.session.commit()
+    started = time.perf_counter()
+    ids = resolve(alert)
+    indexed_s = time.perf_counter() - started
+
+    stmt = select(User.id).where(db.or_(User.state == big, User.state.is_(None))).order_by(User.id)
+    started = time.perf_counter()
+    expected = np.fromiter(db.session.scalars(stmt), dtype=np.int64)
+    sql_s = time.perf_counter() - started
+    plan = db.session.execute(db.text(
+        'EXPLAIN QUERY PLAN ' + str(stmt.compile(compile_kwargs={'literal_binds': True}))
+    )).all() if db.engine.dialect.name == 'sqlite' else []
+    print(f"State-wide audience of {len(ids)}: index {indexed_s * 1000:.0f} ms, "
+          f"SQL {sql_s * 1000:.0f} ms ({'; '.join(row[-1] for row in plan)})")
+
+    # Profile changes through the ORM, replayed from the event log
+    started = time.perf_counter()
+    movers = rng.sample(range(base + 1, base + user_count + 1), moves)
+    for user in User.query.filter(User.id.in_(movers)).all():
+        state = rng.choice(states)
+        user.state, user.city = state, rng.choice(cities[state])
+    db.session.commit()
+    print(f"Moved {moves} users in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    ids = resolve(alert)
+    print(f"Replay and resolve: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    expected = np.fromiter(db.session.scalars(stmt), dtype=np.int64)
+    ok = np.array_equal(ids, expected)
+    print(f"Index matches SQL after moves: {ok}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Alert audience index')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench_parser = sub.add_parser('bench')
+    bench_parser.add_argument('--users', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # Never touch the configured database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app
+
+    with app.app_context():
+        try:
+            ok = benchmark(args.users)
+        finally:
+            db.session.remove()
+            os.remove(scratch.name)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
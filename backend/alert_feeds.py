@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+"""
+Ingestion of official alert feeds (CAP 1.1/1.2 XML, as published by IMD and NDMA).
+
+ALERT_FEEDS lists the feeds as NAME=LOCATION pairs; the name becomes the
+alerts' `source`. A location is one of:
+
+- an http(s) URL of a CAP document (one <alert> or a bulletin of many), or of
+  an RSS/Atom index whose items link to CAP documents;
+- a local directory of *.xml CAP files (or a single file), the stand-in for a
+  real feed in development and tests.
+
+A reader thread fetches and parses documents incrementally (iterparse; each
+<alert> is mapped and dropped before the next is read) and hands mapped
+entries to the writer through a bounded queue: when the writer falls behind,
+the reader blocks instead of buffering a whole national bulletin in memory.
+The writer upserts entries in batches of ALERT_FEED_BATCH_SIZE, each in one
+short transaction that also advances the feed's checkpoint (document and
+entry index), so a restarted run resumes after the last written entry, and
+pauses between batches so API writes are not starved of the database.
+
+Entries are de-duplicated by CAP identifier and version: a thread of messages
+(an Alert and the Updates/Cancels that reference it) is one row keyed by the
+first message's `sender|identifier`, and a message whose `sent` time is not
+newer than the row's is skipped. Polygons and circles become the alert's area
+(see alert_areas.py); otherwise the area description is matched against the
+gazetteer to fill state and city.
+
+A new thread that is active is delivered to its audience like an alert
+created through the API (an `alert_audience` outbox event staged in the
+batch's transaction). Updates and Cancels only change the row /alerts shows:
+the thread was delivered when it first arrived, and is not notified again.
+
+Only one worker ingests a feed at a time (a lease on its checkpoint row).
+Throughput and lag are published as alert_feeds.<name>.* metrics.
+
+CLI:
+    python alert_feeds.py ingest [NAME=LOCATION ...]   # run configured (or given) feeds once
+    python alert_feeds.py bench [--alerts 20000]       # synthetic bulletin on a scratch database
+"""
+
+import argparse
+import logging
+import math
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+import alert_areas
+import alert_audience
+import geo
+import metrics
+import outbox
+from database import db
+from models import Alert, AlertFeedCheckpoint
+
+logger = logging.getLogger('vajra.alert_feeds')
+
+ALERT_FEEDS = os.getenv('ALERT_FEEDS', '')
+ALERT_FEED_INTERVAL = int(os.getenv('ALERT_FEED_INTERVAL', '120'))
+ALERT_FEED_BATCH_SIZE = int(os.getenv('ALERT_FEED_BATCH_SIZE', '200'))
+# Mapped entries buffered between the reader and the writer
+ALERT_FEED_QUEUE_SIZE = int(os.getenv('ALERT_FEED_QUEUE_SIZE', '1000'))
+ALERT_FEED_BATCH_PAUSE_MS = int(os.getenv('ALERT_FEED_BATCH_PAUSE_MS', '20'))
+ALERT_FEED_TIMEOUT = int(os.getenv('ALERT_FEED_TIMEOUT', '20'))
+# A lease not renewed for this long belongs to a worker that died mid-run
+LEASE_SECONDS = 300
+# Flush a partial batch when the reader has produced nothing for this long
+IDLE_FLUSH_SECONDS = 0.5
+
+SEVERITIES = {'extreme': 'critical', 'severe': 'high', 'moderate': 'medium', 'minor': 'low'}
+CATEGORIES = ('earthquake', 'tsunami', 'cyclone', 'flood', 'landslide', 'heatwave', 'heat wave',
+              'cold wave', 'thunderstorm', 'lightning', 'rain', 'fire', 'drought', 'avalanche')
+CIRCLE_SEGMENTS = 32
+
+_DONE = object()
+
+
+class FeedError(Exception):
+    """Raised when a feed cannot be fetched or parsed"""
+
+
+def configured_feeds(spec=None):
+    """[(name, location)] from an ALERT_FEEDS-style spec"""
+    feeds = []
+    for item in (ALERT_FEEDS if spec is None else spec).split(','):
+        name, sep, location = item.strip().partition('=')
+        if item.strip():
+            if not sep:
+                raise ValueError(f'Alert feed must be NAME=LOCATION: {item.strip()}')
+            feeds.append((name.strip(), location.strip()))
+    return feeds
+
+
+# Parsing
+
+def _local(tag):
+    return tag.rpartition('}')[2] if isinstance(tag, str) else ''
+
+
+def _child(element, name):
+    for child in element:
+        if _local(child.tag) == name:
+            return child
+    return None
+
+
+def _children(element, name):
+    return [child for child in element if _local(child.tag) == name]
+
+
+def _text(element, name):
+    child = _child(element, name)
+    return (child.text or '').strip() if child is not None and child.text else ''
+
+
+def _parse_time(value):
+    """CAP/Atom dateTime or RSS date as naive UTC, or None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def iter_document(stream):
+    """
+    Walk an XML document incrementally, yielding ('alert', element) for every
+    CAP <alert> and ('link', published, url) for RSS items / Atom entries that
+    point to one instead of embedding it. Elements are cleared once yielded and
+    detached from the root (open parents stay referenced by the parser), so
+    memory stays flat however long the document is.
+    """
+    context = ET.iterparse(stream, events=('start', 'end'))
+    root = None
+    depth_in_alert = 0
+    embedded = False
+    try:
+        for event, element in context:
+            name = _local(element.tag)
+            if root is None:
+                root = element
+            if event == 'start':
+                if name == 'alert':
+                    depth_in_alert += 1
+                elif name in ('item', 'entry') and not depth_in_alert:
+                    embedded = False
+                continue
+            if name == 'alert':
+                depth_in_alert -= 1
+                if not depth_in_alert:
+                    embedded = True
+                    yield 'alert', element
+                    element.clear()
+                    if root is not element:
+                        root.clear()
+            elif name in ('item', 'entry') and not depth_in_alert:
+                if not embedded:
+                    link = _child(element, 'link')
+                    url = None
+                    if link is not None:
+                        url = link.get('href') or (link.text or '').strip()
+                    published = _parse_time(
+                        _text(element, 'pubDate') or _text(element, 'updated') or _text(element, 'published')
+                    )
+                    if url:
+                        yield 'link', published, url
+                element.clear()
+                if root is not element:
+                    root.clear()
+    except ET.ParseError as e:
+        raise FeedError(f'malformed XML: {e}')
+
+
+def _circle_ring(value):
+    """CAP circle "lat,lon radius_km" as a closed [lng, lat] ring"""
+    centre, _, radius = value.strip().partition(' ')
+    lat, lng = (float(v) for v in centre.split(','))
+    radius_km = float(radius or 0)
+    if radius_km <= 0:
+        return None
+    ring = []
+    for i in range(CIRCLE_SEGMENTS + 1):
+        angle = 2 * math.pi * i / CIRCLE_SEGMENTS
+        dlat = radius_km / geo.KM_PER_DEGREE * math.sin(angle)
+        dlng = radius_km / (geo.KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)) * math.cos(angle)
+        ring.append([lng + dlng, lat + dlat])
+    return ring
+
+
+def _polygon_ring(value):
+    """CAP polygon "lat,lon lat,lon ..." as a [lng, lat] ring"""
+    ring = []
+    for pair in value.split():
+        lat, lng = pair.split(',')
+        ring.append([float(lng), float(lat)])
+    return ring
+
+
+def _info(alert):
+    """The English <info> block, else the first"""
+    infos = _children(alert, 'info')
+    for info in infos:
+        if _text(info, 'language').lower().startswith('en'):
+            return info
+    return infos[0] if infos else None
+
+
+def _category(event, cap_categories):
+    event = event.lower()
+    for keyword in CATEGORIES:
+        if keyword in event:
+            return keyword.replace(' ', '')
+    return cap_categories[0].lower() if cap_categories else None
+
+
+def map_alert(alert, source):
+    """
+    Map a CAP <alert> element to the fields of an Alert row plus its thread
+    keys; returns (entry, None) or (None, reason) for alerts that are skipped.
+    """
+    status = _text(alert, 'status')
+    if status and status != 'Actual':
+        return None, 'not_actual'
+    if (_text(alert, 'scope') or 'Public') != 'Public':
+        return None, 'not_public'
+    identifier, sender = _text(alert, 'identifier'), _text(alert, 'sender')
+    sent = _parse_time(_text(alert, 'sent'))
+    info = _info(alert)
+    if not identifier or sent is None or info is None:
+        return None, 'invalid'
+
+    references = []
+    for reference in _text(alert, 'references').split():
+        parts = reference.split(',')
+        if len(parts) >= 2:
+            references.append(f'{parts[0]}|{parts[1]}'[:255])
+
+    event = _text(info, 'event')
+    headline = _text(info, 'headline') or event or identifier
+    description = '\n\n'.join(part for part in (_text(info, 'description'), _text(info, 'instruction')) if part)
+    cap_categories = [(c.text or '').strip() for c in _children(info, 'category') if c.text]
+
+    polygons, descriptions = [], []
+    for area in _children(info, 'area'):
+        descriptions.append(_text(area, 'areaDesc'))
+        try:
+            for polygon in _children(area, 'polygon'):
+                if polygon.text and polygon.text.strip():
+                    polygons.append([_polygon_ring(polygon.text)])
+            for circle in _children(area, 'circle'):
+                ring = _circle_ring(circle.text) if circle.text else None
+                if ring:
+                    polygons.append([ring])
+        except ValueError:
+            metrics.incr(f'alert_feeds.{source}.invalid_areas')
+    area_desc = '; '.join(d for d in descriptions if d)
+
+    entry = {
+        'external_id': f'{sender}|{identifier}'[:255],
+        'references': references,
+        'msg_type': _text(alert, 'msgType') or 'Alert',
+        'sent': sent,
+        'title': headline[:200],
+        'message': description or headline,
+        'alert_type': 'weather' if 'Met' in cap_categories else 'government',
+        'severity': SEVERITIES.get(_text(info, 'severity').lower(), 'low'),
+        'category': _category(event, cap_categories),
+        'expires_at': _parse_time(_text(info, 'expires')),
+        'source': source[:100],
+        'state': None, 'city': None, 'locality': area_desc[:200] or None, 'area': None,
+    }
+
+    states, places = geo.match_places(area_desc)
+    if len(states) == 1:
+        entry['state'] = next(iter(states))
+        if len(places) == 1:
+            entry['city'] = next(iter(places))[1]
+    elif len(states) > 1 and not polygons:
+        metrics.incr(f'alert_feeds.{source}.multi_state_areas')  # shown to everyone, areaDesc as locality
+    if polygons:
+        try:
+            geometry = {'type': 'MultiPolygon', 'coordinates': polygons}
+            entry['area'] = alert_areas.parse_area(geometry)[0]
+        except alert_areas.AreaError:
+            metrics.incr(f'alert_feeds.{source}.invalid_areas')
+    return entry, None
+
+
+# Sources
+
+def _open_url(url, headers=None):
+    if not url.startswith(('http://', 'https://')):
+        raise FeedError(f'not an http(s) URL: {url}')
+    request = urllib.request.Request(url, headers={'User-Agent': 'vajra-alert-feeds/1.0', **(headers or {})})
+    try:
+        return urllib.request.urlopen(request, timeout=ALERT_FEED_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise FeedError(f'{url}: HTTP {e.code}')
+    except (urllib.error.URLError, socket.timeout) as e:
+        raise FeedError(f'{url}: {e}')
+
+
+def _documents(location, checkpoint):
+    """
+    ([(key, opener)], validators) for the documents of a feed not fully
+    ingested yet, in order. Directory keys sort chronologically; an opener
+    returns a readable stream; validators are the HTTP headers to store for the
+    next conditional fetch.
+    """
+    validators = {}
+    if location.startswith(('http://', 'https://')):
+        headers = {}
+        if checkpoint.etag:
+            headers['If-None-Match'] = checkpoint.etag
+        if checkpoint.last_modified:
+            headers['If-Modified-Since'] = checkpoint.last_modified
+        response = _open_url(location, headers)
+        if response is None:
+            metrics.incr('alert_feeds.not_modified')
+            return [], validators
+        validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        # The document itself is the only key we have; resuming within it needs the same validator
+        key = (validators['etag'] or validators['last_modified'] or datetime.utcnow().isoformat())[:500]
+        return [(key, lambda: response)], validators
+
+    paths = [location] if os.path.isfile(location) else [
+        os.path.join(location, name) for name in os.listdir(location) if name.lower().endswith('.xml')
+    ]
+    documents = []
+    for path in paths:
+        key = f'{os.stat(path).st_mtime_ns:020d}|{os.path.basename(path)}'
+        if checkpoint.document is None or key >= checkpoint.document:
+            documents.append((key, lambda path=path: open(path, 'rb')))
+    documents.sort(key=lambda document: document[0])
+    return documents, validators
+
+
+# Pipeline
+
+class FeedIngestor:
+    """Ingest one feed: a reader thread parses, this thread writes in batches"""
+
+    def __init__(self, name, location, batch_size=ALERT_FEED_BATCH_SIZE, queue_size=ALERT_FEED_QUEUE_SIZE):
+        self.name = name
+        self.location = location
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'[:100]
+        self.stats = {'entries': 0, 'inserted': 0, 'updated': 0, 'cancelled': 0, 'duplicates': 0, 'skipped': 0}
+
+    # Lease
+
+    def _claim(self):
+        if db.session.get(AlertFeedCheckpoint, self.name) is None:
+            try:
+                db.session.add(AlertFeedCheckpoint(source=self.name, entries_total=0))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(AlertFeedCheckpoint)
+            .where(AlertFeedCheckpoint.source == self.name)
+            .where(db.or_(AlertFeedCheckpoint.locked_by.is_(None),
+                          AlertFeedCheckpoint.locked_at < now - timedelta(seconds=LEASE_SECONDS)))
+            .values(locked_by=self.owner, locked_at=now)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _release(self, error=None):
+        db.session.rollback()
+        db.session.execute(
+            update(AlertFeedCheckpoint)
+            .where(AlertFeedCheckpoint.source == self.name, AlertFeedCheckpoint.locked_by == self.owner)
+            .values(locked_by=None, locked_at=None, last_error=str(error)[:1000] if error else None)
+        )
+        db.session.commit()
+
+    # Reader
+
+    def _put(self, item):
+        """Queue an item, blocking while the writer is behind (backpressure)"""
+        if self.queue.full():
+            metrics.incr(f'alert_feeds.{self.name}.reader_waits')
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self, documents, checkpoint_document, checkpoint_entry):
+        try:
+            for key, opener in documents:
+                if self.stop.is_set():
+                    return
+                stream = opener()
+                try:
+                    index = -1
+                    links = []
+                    for item in iter_document(stream):
+                        if item[0] == 'link':
+                            links.append(item)
+                            continue
+                        index += 1
+                        if key == checkpoint_document and checkpoint_entry is not None and index <= checkpoint_entry:
+                            continue  # written by an earlier run
+                        entry, reason = map_alert(item[1], self.name)
+                        if not self._put(('entry', key, index, entry, reason)):
+                            return
+                finally:
+                    stream.close()
+                metrics.incr(f'alert_feeds.{self.name}.documents')
+                if links:
+                    self._read_linked(links, checkpoint_document, checkpoint_entry)
+            self._put((_DONE, None))
+        except Exception as e:
+            self._put((_DONE, e))
+
+    def _read_linked(self, links, checkpoint_document, checkpoint_entry):
+        """CAP documents listed by an RSS/Atom index, oldest first, skipping those already ingested"""
+        keyed = sorted(
+            (f'{(published or datetime.min).isoformat()}|{url}'[:500], url) for _, published, url in links
+        )
+        documents = [
+            (key, lambda url=url: _open_url(url))
+            for key, url in keyed if checkpoint_document is None or key >= checkpoint_document
+        ]
+        for key, opener in documents:
+            if self.stop.is_set():
+                return
+            try:
+                stream = opener()
+            except FeedError as e:
+                metrics.incr(f'alert_feeds.{self.name}.errors')
+                logger.warning('alert_feed_document_failed', extra={'feed': self.name, 'error': str(e)})
+                continue
+            try:
+                for index, (_, element) in enumerate(item for item in iter_document(stream) if item[0] == 'alert'):
+                    if key == checkpoint_document and checkpoint_entry is not None and index <= checkpoint_entry:
+                        continue
+                    entry, reason = map_alert(element, self.name)
+                    if not self._put(('entry', key, index, entry, reason)):
+                        return
+            finally:
+                stream.close()
+            metrics.incr(f'alert_feeds.{self.name}.documents')
+
+    # Writer
+
+    def _write(self, batch, position):
+        """Upsert a batch and advance the checkpoint to position in one transaction"""
+        entries = [entry for entry in batch if entry is not None]
+        keys = {entry['external_id'] for entry in entries}
+        keys.update(reference for entry in entries for reference in entry['references'])
+        rows = {
+            alert.external_id: alert
+            for alert in Alert.query.filter(Alert.external_id.in_(keys)).all()
+        } if keys else {}
+
+        now = datetime.utcnow()
+        new_threads = []
+        for entry in entries:
+            thread = next((rows[r] for r in entry['references'] if r in rows), None) or rows.get(entry['external_id'])
+            if thread is not None and thread.external_version is not None and entry['sent'] <= thread.external_version:
+                self.stats['duplicates'] += 1
+                continue
+            if thread is None:
+                # An Update seen before its original is keyed by the original, which will then be a duplicate
+                key = entry['references'][0] if entry['references'] else entry['external_id']
+                thread = Alert(external_id=key, issued_at=entry['sent'])
+                db.session.add(thread)
+                rows[key] = thread
+                new_threads.append(thread)
+                self.stats['inserted'] += 1
+            else:
+                self.stats['updated'] += 1
+            for field in ('title', 'message', 'alert_type', 'severity', 'category', 'state', 'city',
+                          'locality', 'expires_at', 'source'):
+                setattr(thread, field, entry[field])
+            alert_areas.set_area(thread, entry['area'])
+            thread.external_version = entry['sent']
+            cancelled = entry['msg_type'] == 'Cancel'
+            self.stats['cancelled'] += cancelled
+            thread.is_active = not cancelled and (entry['expires_at'] is None or entry['expires_at'] > now)
+
+        # Delivery to new alerts' audiences is staged in the same transaction
+        deliveries = [thread for thread in new_threads if thread.is_active] if outbox.OUTBOX_ENABLED else []
+        if deliveries:
+            db.session.flush()  # Get the IDs
+            for thread in deliveries:
+                alert_audience.add_delivery_event(thread)
+
+        checkpoint = db.session.get(AlertFeedCheckpoint, self.name)
+        checkpoint.document, checkpoint.entry = position
+        checkpoint.entries_total = (checkpoint.entries_total or 0) + len(batch)
+        checkpoint.locked_at = now  # renew the lease
+        db.session.commit()
+
+        if deliveries:
+            outbox.dispatcher.wake()
+
+    def _flush(self, batch, position):
+        if not batch:
+            return
+        try:
+            self._write(batch, position)
+        except IntegrityError:
+            # Another writer created one of these threads meanwhile; the retry sees its row
+            db.session.rollback()
+            metrics.incr(f'alert_feeds.{self.name}.write_retries')
+            self._write(batch, position)
+        metrics.incr(f'alert_feeds.{self.name}.batches')
+        batch.clear()
+        if ALERT_FEED_BATCH_PAUSE_MS:
+            time.sleep(ALERT_FEED_BATCH_PAUSE_MS / 1000)
+
+    def run(self):
+        """Ingest everything new in the feed; returns the run's counts, or None if another worker holds the feed"""
+        if not self._claim():
+            metrics.incr(f'alert_feeds.{self.name}.skipped_locked')
+            return None
+        started = time.monotonic()
+        error = None
+        reader = None
+        try:
+            checkpoint = db.session.get(AlertFeedCheckpoint, self.name)
+            documents, validators = _documents(self.location, checkpoint)
+            resume = (checkpoint.document, checkpoint.entry)
+            db.session.commit()  # nothing held open while the reader fetches
+
+            reader = threading.Thread(target=self._read, args=(documents, *resume),
+                                      name=f'alert-feed-{self.name}', daemon=True)
+            reader.start()
+            batch, position = [], resume
+            while True:
+                try:
+                    item = self.queue.get(timeout=IDLE_FLUSH_SECONDS)
+                except queue.Empty:
+                    self._flush(batch, position)  # the reader is waiting on the network
+                    continue
+                metrics.set_gauge(f'alert_feeds.{self.name}.queue_depth', self.queue.qsize())
+                if item[0] is _DONE:
+                    if item[1] is not None:
+                        raise item[1]
+                    break
+                _, key, index, entry, reason = item
+                self.stats['entries'] += 1
+                if reason:
+                    self.stats['skipped'] += 1
+                    metrics.incr(f'alert_feeds.{self.name}.skipped.{reason}')
+                batch.append(entry)
+                position = (key, index)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, position)
+            self._flush(batch, position)
+
+            if validators:
+                checkpoint = db.session.get(AlertFeedCheckpoint, self.name)
+                checkpoint.etag, checkpoint.last_modified = validators['etag'], validators['last_modified']
+                db.session.commit()
+        except Exception as e:
+            error = e
+            metrics.incr(f'alert_feeds.{self.name}.errors')
+            logger.exception('alert_feed_failed', extra={'feed': self.name})
+            raise
+        finally:
+            self.stop.set()
+            if reader is not None:
+                reader.join(timeout=5)
+            self._release(error)
+            elapsed = time.monotonic() - started
+            for counter, value in self.stats.items():
+                if value:
+                    metrics.incr(f'alert_feeds.{self.name}.{counter}', value)
+            metrics.set_gauge(f'alert_feeds.{self.name}.last_run_ms', round(elapsed * 1000, 1))
+            if self.stats['entries'] and elapsed > 0:
+                metrics.set_gauge(f'alert_feeds.{self.name}.entries_per_sec', round(self.stats['entries'] / elapsed, 1))
+            newest = db.session.query(db.func.max(Alert.external_version)).filter(Alert.source == self.name).scalar()
+            if newest is not None:
+                metrics.set_gauge(f'alert_feeds.{self.name}.lag_seconds',
+                                  round((datetime.utcnow() - newest).total_seconds(), 1))
+        return dict(self.stats)
+
+
+def ingest_feeds(feeds=None):
+    """Run every configured feed once (the alert_feed_ingest job); failures are logged per feed"""
+    results = {}
+    for name, location in (configured_feeds() if feeds is None else feeds):
+        try:
+            results[name] = FeedIngestor(name, location).run()
+        except Exception as e:
+            db.session.rollback()
+            results[name] = {'error': str(e)}
+    return results
+
+
+# Benchmark
+
+def _bench_bulletin(path, count, start=0, sent='2025-07-01T06:00:00+05:30', msg_type='Alert'):
+    """Write a CAP bulletin of count alerts for gazetteer places"""
+    states, places, _ = geo.load_place_names()
+    cities = sorted(place for candidates in places.values() for place in candidates)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<bulletin>\n')
+        for i in range(start, start + count):
+            state, city = cities[i % len(cities)]
+            references = f'<references>imd@example.invalid,BENCH-{i},{sent}</references>' if msg_type != 'Alert' else ''
+            identifier = f'BENCH-{i}' if msg_type == 'Alert' else f'BENCH-{i}-{msg_type}'
+            f.write(
+                '<alert xmlns="urn:oasis:names:tc:emergency:cap:1.2">'
+                f'<identifier>{identifier}</identifier><sender>imd@example.invalid</sender>'
+                f'<sent>{sent}</sent><status>Actual</status><msgType>{msg_type}</msgType><scope>Public</scope>'
+                f'{references}<info><language>en-IN</language><category>Met</category>'
+                f'<event>Heavy Rain Warning</event><urgency>Expected</urgency><severity>Severe</severity>'
+                f'<certainty>Likely</certainty><expires>2099-01-01T00:00:00+05:30</expires>'
+                f'<headline>Heavy rain likely in {city}</headline>'
+                f'<description>Heavy to very heavy rainfall is likely at isolated places.</description>'
+                f'<area><areaDesc>{city}, {state}</areaDesc></area></info></alert>\n'
+            )
+        f.write('</bulletin>\n')
+
+
+def benchmark(alert_count):
+    directory = tempfile.mkdtemp()
+    try:
+        _bench_bulletin(os.path.join(directory, '001-bulletin.xml'), alert_count)
+        result = FeedIngestor('BENCH', directory).run()
+        print(f"First run: {result} at {metrics.get('alert_feeds.BENCH.entries_per_sec')} entries/s")
+
+        result = FeedIngestor('BENCH', directory).run()
+        print(f"Unchanged directory: {result}")
+
+        _bench_bulletin(os.path.join(directory, '002-update.xml'), alert_count // 10,
+                        sent='2025-07-01T09:00:00+05:30', msg_type='Update')
+        os.utime(os.path.join(directory, '002-update.xml'), ns=(time.time_ns() + 10 ** 9,) * 2)
+        result = FeedIngestor('BENCH', directory).run()
+        print(f"Updates: {result} at {metrics.get('alert_feeds.BENCH.entries_per_sec')} entries/s")
+
+        rows = Alert.query.filter_by(source='BENCH').count()
+        mapped = Alert.query.filter(Alert.source == 'BENCH', Alert.city.isnot(None)).count()
+        print(f"{rows} alert rows, {mapped} mapped to a city")
+        return rows == alert_count
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Official alert feed ingestion')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = sub.add_parser('ingest', help='ingest the configured feeds (or the ones given) once')
+    ingest_parser.add_argument('feeds', nargs='*', help='NAME=LOCATION (URL, directory or file)')
+    bench_parser = sub.add_parser('bench', help='ingest a synthetic bulletin into a scratch database')
+    bench_parser.add_argument('--alerts', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        # Never touch the configured database
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        scratch.close()
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+        # Audience delivery is benchmarked by alert_audience.py; keep the sink untouched
+        os.environ['OUTBOX_ENABLED'] = 'false'
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'bench':
+            try:
+                ok = benchmark(args.alerts)
+            finally:
+                db.session.remove()
+                os.remove(scratch.name)
+            sys.exit(0 if ok else 1)
+
+        feeds = configured_feeds(','.join(args.feeds)) if args.feeds else configured_feeds()
+        if not feeds:
+            print('No feeds: set ALERT_FEEDS or pass NAME=LOCATION')
+            sys.exit(2)
+        failed = False
+        for name, result in ingest_feeds(feeds).items():
+            print(f'{name}: {result if result is not None else "skipped, another worker is ingesting it"}')
+            failed = failed or bool(result and 'error' in result)
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Deactivate expired alerts in bulk.
+
+Runs periodically inside each worker (see scheduler.py) and can also be run
+as a one-off job: `python alert_sweeper.py`. Each batch is a single UPDATE
+over ids picked through the partial index on active alerts, so a sweep never
+holds the write lock for long.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import update
+
+import metrics
+import response_cache
+from database import db
+from models import Alert
+
+ALERT_SWEEP_INTERVAL = int(os.getenv('ALERT_SWEEP_INTERVAL', '60'))
+ALERT_SWEEP_BATCH_SIZE = int(os.getenv('ALERT_SWEEP_BATCH_SIZE', '500'))
+
+
+def active_alert_filter(now=None):
+    """Criteria for alerts that are live right now (used by the read path too)"""
+    now = now or datetime.utcnow()
+    return db.and_(
+        Alert.is_active == True,
+        db.or_(Alert.expires_at.is_(None), Alert.expires_at > now)
+    )
+
+
+def sweep_expired_alerts(batch_size=ALERT_SWEEP_BATCH_SIZE):
+    """Set is_active=False on expired alerts; returns the number deactivated"""
+    started = time.monotonic()
+    now = datetime.utcnow()
+    total = 0
+    batches = 0
+
+    while True:
+        ids = [row[0] for row in db.session.query(Alert.id).filter(
+            Alert.is_active == True,
+            Alert.expires_at <= now
+        ).limit(batch_size).all()]
+
+        if not ids:
+            break
+
+        db.session.execute(
+            update(Alert)
+            .where(Alert.id.in_(ids), Alert.is_active == True)
+            .values(is_active=False)
+        )
+        db.session.commit()
+        # Bulk UPDATE bypasses the flush-time cache tagging
+        response_cache.invalidate(['alerts:*'])
+        total += len(ids)
+        batches += 1
+
+        if len(ids) < batch_size:
+            break
+
+    metrics.incr('alerts.sweep_runs')
+    metrics.incr('alerts.sweep_batches', batches)
+    metrics.incr('alerts.swept', total)
+    metrics.set_gauge('alerts.last_sweep_ms', round((time.monotonic() - started) * 1000, 1))
+    return total
+
+
+def main():
+    from app import app
+
+    with app.app_context():
+        count = sweep_expired_alerts()
+        print(f"Deactivated {count} expired alerts")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 from database import db
+from log_config import configure_logging
+import metrics
+from db_routing import replica_binds, init_db_routing, measure_replica_lag, prune_pins, primary_only, REPLICA_HEARTBEAT_INTERVAL
 
 load_dotenv()
 
@@ -14,6 +17,8 @@ app = Flask(__name__)
 # Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///' + os.path.abspath(os.path.join(os.path.dirname(__file__), 'instance', 'vajra.db')))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Read replicas for GET requests (DATABASE_REPLICA_URLS, see db_routing.py)
+app.config['SQLALCHEMY_BINDS'] = replica_binds()
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
@@ -25,15 +30,18 @@ else:
 
 # Initialize extensions
 db.init_app(app)
+configure_logging(app)
 
 # CORS configuration for production
+# Response headers browser clients need to read (retry hints, request tracing)
+CORS_EXPOSE_HEADERS = ['Retry-After', 'Idempotent-Replayed', 'X-Request-ID', 'X-Cache']
 if os.getenv('FLASK_ENV') == 'production':
     cors = CORS(app, origins=[
         'https://frontend-ashen-eight-66.vercel.app',
         'https://*.vercel.app'
-    ], supports_credentials=True)
+    ], supports_credentials=True, expose_headers=CORS_EXPOSE_HEADERS)
 else:
-    cors = CORS(app, supports_credentials=True)  # Allow all origins in development
+    cors = CORS(app, supports_credentials=True, expose_headers=CORS_EXPOSE_HEADERS)  # Allow all origins in development
 
 jwt = JWTManager(app)
 
@@ -51,7 +59,22 @@ def missing_token_callback(error):
     return jsonify({'msg': 'Authorization token is required'}), 401
 
 # Import models after db initialization
-from models import User, Resource, Quiz, UserProgress, Community, CommunityMember, Message, Alert
+from models import User, Resource, Quiz, UserProgress, Community, CommunityMember, Message, Alert, OutboxEvent, MessageArchiveBlock, CatalogChange, LeaderboardScore, LeaderboardEvent, UserLocationEvent, UserStats, ProvisioningJob, ReplicaHeartbeat, AlertFeedCheckpoint
+from catalog_sync import backfill_changes
+from user_stats import backfill_stats
+from catalog_bundle import init_catalog_bundle
+from leaderboard import prune_events as prune_leaderboard_events
+from alert_audience import index as audience_index, prune_events as prune_location_events
+from outbox import init_outbox
+from group_commit import init_group_commit
+from scheduler import init_scheduler, register_job
+from alert_sweeper import sweep_expired_alerts, ALERT_SWEEP_INTERVAL
+from alert_feeds import configured_feeds, ingest_feeds, ALERT_FEED_INTERVAL
+from message_archive import archive_old_messages, MESSAGE_ARCHIVE_INTERVAL
+from rate_limit import prune_buckets, RATE_LIMIT_PRUNE_INTERVAL
+from idempotency import prune_keys as prune_idempotency_keys
+from response_cache import prune_entries as prune_response_cache
+from warmup import init_warmup, register_warmer, connect_pools, warm_request, is_ready, status as warmup_status
 
 # Create tables and handle schema migrations
 def ensure_database_schema():
@@ -64,7 +87,7 @@ def ensure_database_schema():
         inspector = db.inspect(db.engine)
         if 'users' in inspector.get_table_names():
             columns = [col['name'] for col in inspector.get_columns('users')]
-            required_columns = ['state', 'city', 'locality', 'phone_number', 'is_admin']
+            required_columns = ['state', 'city', 'locality', 'phone_number', 'is_admin', 'latitude', 'longitude', 'geo_cell']
             missing_columns = [col for col in required_columns if col not in columns]
             
             if missing_columns:
@@ -84,12 +107,47 @@ def ensure_database_schema():
                             db.session.execute(text("ALTER TABLE users ADD COLUMN phone_number VARCHAR(15)"))
                         elif column == 'is_admin':
                             db.session.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT FALSE"))
+                        elif column in ('latitude', 'longitude'):
+                            db.session.execute(text(f"ALTER TABLE users ADD COLUMN {column} FLOAT"))
+                        elif column == 'geo_cell':
+                            db.session.execute(text("ALTER TABLE users ADD COLUMN geo_cell INTEGER"))
                         db.session.commit()
                         print(f"Added column: {column}")
                     except Exception as e:
                         print(f"Failed to add column {column}: {e}")
                         db.session.rollback()
         
+        # Columns added to other tables after they were first created
+        added_columns = {
+            'communities': (('latitude', 'FLOAT'), ('longitude', 'FLOAT'), ('geo_cell', 'INTEGER')),
+            'alerts': (('area', 'TEXT'), ('bbox_min_lat', 'FLOAT'), ('bbox_min_lng', 'FLOAT'),
+                       ('bbox_max_lat', 'FLOAT'), ('bbox_max_lng', 'FLOAT'),
+                       ('external_id', 'VARCHAR(255)'), ('external_version', 'TIMESTAMP')),
+        }
+        for table_name, table_columns in added_columns.items():
+            if table_name not in inspector.get_table_names():
+                continue
+            columns = [col['name'] for col in inspector.get_columns(table_name)]
+            for column, column_type in table_columns:
+                if column in columns:
+                    continue
+                try:
+                    db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column} {column_type}"))
+                    db.session.commit()
+                    print(f"Added column: {table_name}.{column}")
+                except Exception as e:
+                    print(f"Failed to add column {table_name}.{column}: {e}")
+                    db.session.rollback()
+        
+        # create_all only builds indexes for new tables; add any that were
+        # introduced after the table already existed
+        for table in (Alert.__table__, Message.__table__, Community.__table__, User.__table__):
+            for index in table.indexes:
+                try:
+                    index.create(bind=db.engine, checkfirst=True)
+                except Exception as e:
+                    print(f"Failed to create index {index.name}: {e}")
+        
         print("Database schema check completed successfully")
         return True
     except Exception as e:
@@ -156,6 +214,57 @@ app.register_blueprint(community_bp, url_prefix='/api')
 app.register_blueprint(message_bp, url_prefix='/api')
 app.register_blueprint(alert_bp, url_prefix='/api')
 
+# Background fan-out of emergency broadcasts
+init_outbox(app)
+init_group_commit(app)
+
+# GET requests read from replicas, pinned to the primary after a write
+init_db_routing(app)
+
+# Offline catalog bundle, rebuilt after catalog changes
+init_catalog_bundle(app)
+
+# Periodic maintenance jobs
+register_job('alert_sweeper', sweep_expired_alerts, ALERT_SWEEP_INTERVAL)
+register_job('message_archiver', archive_old_messages, MESSAGE_ARCHIVE_INTERVAL)
+register_job('leaderboard_event_pruner', prune_leaderboard_events, 3600)
+register_job('user_location_event_pruner', prune_location_events, 3600)
+register_job('rate_limit_pruner', prune_buckets, RATE_LIMIT_PRUNE_INTERVAL)
+register_job('idempotency_pruner', prune_idempotency_keys, 3600)
+register_job('response_cache_pruner', prune_response_cache, 600)
+if configured_feeds():
+    register_job('alert_feed_ingest', ingest_feeds, ALERT_FEED_INTERVAL)
+if replica_binds():
+    register_job('replica_lag_monitor', measure_replica_lag, REPLICA_HEARTBEAT_INTERVAL)
+    register_job('replica_pin_pruner', prune_pins, 3600)
+init_scheduler(app)
+
+# Warm-up run by each worker right after fork (gunicorn.conf.py), before it serves traffic
+def warm_local_stores():
+    from rate_limit import store as rate_limit_store
+    from idempotency import store as idempotency_store
+    from response_cache import store as response_cache_store
+    from db_routing import store as sticky_store
+    for store in (rate_limit_store, idempotency_store, response_cache_store, sticky_store):
+        store.connection()
+
+def warm_alert_areas():
+    from alert_areas import warm_prepared_areas
+    from alert_sweeper import active_alert_filter
+    warm_prepared_areas(active_alert_filter())
+
+def warm_gazetteer():
+    from geo import load_gazetteer
+    load_gazetteer()
+
+register_warmer('database', connect_pools)
+register_warmer('local_stores', warm_local_stores)
+register_warmer('gazetteer', warm_gazetteer)
+register_warmer('alert_areas', warm_alert_areas)
+register_warmer('alert_audience', audience_index.sync)
+register_warmer('resources', warm_request(app, '/api/resources'))
+init_warmup(app)
+
 # Initialize database immediately after app setup (non-blocking)
 def safe_init_database():
     """Initialize database safely without blocking app startup"""
@@ -175,6 +284,21 @@ def safe_init_database():
             seed_initial_data()
         except Exception as seed_error:
             print(f"Data seeding failed (non-critical): {seed_error}")
+        
+        try:
+            backfilled = backfill_changes()
+            if backfilled:
+                print(f"Backfilled {backfilled} catalog sync entries")
+        except Exception as sync_error:
+            print(f"Catalog sync backfill failed (non-critical): {sync_error}")
+        
+        try:
+            seeded = backfill_stats()
+            if seeded:
+                print(f"Backfilled quiz stats for {seeded} users")
+        except Exception as stats_error:
+            db.session.rollback()
+            print(f"Quiz stats backfill failed (non-critical): {stats_error}")
             
         print("Database initialization complete")
         return True
@@ -193,9 +317,30 @@ def home():
 
 @app.route('/health')
 def health_check():
-    return jsonify({"status": "healthy", "timestamp": datetime.utcnow().isoformat()})
+    """Liveness: the worker is up, whether or not it has warmed up"""
+    return jsonify({"status": "healthy", "ready": is_ready(), "timestamp": datetime.utcnow().isoformat()})
+
+@app.route('/health/ready')
+def readiness_check():
+    """Readiness: 503 until this worker has warmed up and can reach the database"""
+    from sqlalchemy import text
+    details = warmup_status()
+    try:
+        db.session.execute(text('SELECT 1'))
+        details['database'] = 'ok'
+    except Exception as e:
+        db.session.rollback()
+        details['database'] = str(e)
+    ready = details['ready'] and details['database'] == 'ok'
+    return jsonify({"status": "ready" if ready else "not_ready", **details}), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics_snapshot():
+    """Per-worker counters and gauges published by the API subsystems"""
+    return jsonify({"pid": os.getpid(), **metrics.snapshot(request.args.get('prefix'))})
 
 @app.route('/init-db')
+@primary_only
 def init_database():
     """Initialize database tables - for manual setup"""
     try:
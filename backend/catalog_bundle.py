@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Prebuilt offline bundle of the learning catalog.
+
+All resources and their answer-free quizzes are rendered into one gzipped
+JSON file named after the SHA-256 of its contents, next to a small manifest
+pointing at the current file. The bundle is rebuilt in the background shortly
+after any commit that changes the catalog (see catalog_sync), and served as
+an immutable static file so the service worker can precache the whole
+catalog in one request that never touches the database.
+
+Run once with `python catalog_bundle.py`.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import metrics
+from database import db
+from fieldsets import quiz_counts
+from models import CatalogChange, Resource, Quiz
+
+logger = logging.getLogger('vajra.catalog_bundle')
+
+BUNDLE_DIR = os.getenv('CATALOG_BUNDLE_DIR', os.path.join(os.path.dirname(__file__), 'instance', 'bundles'))
+MANIFEST_NAME = 'catalog-manifest.json'
+# Wait this long after a change before rebuilding, so bursts collapse into one build
+BUNDLE_REBUILD_DELAY = float(os.getenv('CATALOG_BUNDLE_REBUILD_DELAY', '2'))
+BUNDLES_TO_KEEP = 3
+
+
+def render_catalog():
+    """Catalog as a JSON-serializable dict, deterministic for the same content"""
+    # Read the seq first: a change committed while the rows are read then has a
+    # larger seq, so clients syncing from the manifest fetch it again
+    seq = db.session.query(db.func.max(CatalogChange.seq)).scalar() or 0
+    resources = Resource.query.order_by(Resource.id).all()
+    counts = quiz_counts([r.id for r in resources]) if resources else {}
+
+    quizzes_by_resource = {}
+    for quiz in Quiz.query.order_by(Quiz.resource_id, Quiz.id).all():
+        quizzes_by_resource.setdefault(quiz.resource_id, []).append(quiz.to_dict())
+
+    return {
+        'seq': seq,
+        'resources': [
+            {**r.to_dict(quiz_count=counts.get(r.id, 0)), 'quizzes': quizzes_by_resource.get(r.id, [])}
+            for r in resources
+        ]
+    }
+
+
+def _atomic_write(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_bundle():
+    """Write the bundle and manifest; returns the manifest dict"""
+    started = time.monotonic()
+    catalog = render_catalog()
+    raw = json.dumps(catalog, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    # mtime=0 keeps the gzip bytes (and so the hash) stable for identical content
+    compressed = gzip.compress(raw, compresslevel=9, mtime=0)
+    digest = hashlib.sha256(compressed).hexdigest()
+
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
+    filename = f'catalog-{digest[:16]}.json.gz'
+    path = os.path.join(BUNDLE_DIR, filename)
+    if not os.path.exists(path):
+        _atomic_write(path, compressed)
+
+    manifest = {
+        'file': filename,
+        'sha256': digest,
+        'size': len(compressed),
+        'uncompressed_size': len(raw),
+        'seq': catalog['seq'],
+        'resource_count': len(catalog['resources']),
+    }
+    _atomic_write(os.path.join(BUNDLE_DIR, MANIFEST_NAME), json.dumps(manifest).encode('utf-8'))
+    _prune_old_bundles(keep=filename)
+
+    metrics.incr('catalog_bundle.builds')
+    metrics.set_gauge('catalog_bundle.size_bytes', len(compressed))
+    metrics.set_gauge('catalog_bundle.last_build_ms', round((time.monotonic() - started) * 1000, 1))
+    return manifest
+
+
+def _prune_old_bundles(keep):
+    # Keep a few previous bundles for clients that fetched an older manifest
+    bundles = sorted(
+        (f for f in os.listdir(BUNDLE_DIR) if f.startswith('catalog-') and f.endswith('.json.gz')),
+        key=lambda f: os.path.getmtime(os.path.join(BUNDLE_DIR, f)),
+        reverse=True
+    )
+    for name in [f for f in bundles if f != keep][BUNDLES_TO_KEEP - 1:]:
+        try:
+            os.remove(os.path.join(BUNDLE_DIR, name))
+        except OSError:
+            pass
+
+
+def read_manifest():
+    """Current manifest from disk, or None if no bundle was built yet"""
+    try:
+        with open(os.path.join(BUNDLE_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class BundleRebuilder:
+    """Debounced background rebuild triggered by catalog commits"""
+
+    def __init__(self):
+        self.app = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def request_rebuild(self):
+        if self.app is None:
+            return
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Timer(BUNDLE_REBUILD_DELAY, self._rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _rebuild(self):
+        with self._lock:
+            self._timer = None
+        try:
+            with self.app.app_context():
+                build_bundle()
+        except Exception:
+            metrics.incr('catalog_bundle.errors')
+            logger.exception('catalog_bundle_build_failed')
+
+
+rebuilder = BundleRebuilder()
+
+
+@event.listens_for(Session, 'after_commit')
+def _rebuild_after_catalog_commit(session):
+    if session.info.pop('catalog_changed', False):
+        rebuilder.request_rebuild()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_catalog_flag(session):
+    session.info.pop('catalog_changed', None)
+
+
+def init_catalog_bundle(app):
+    rebuilder.init_app(app)
+
+
+def main():
+    from app import app
+
+    with app.app_context():
+        manifest = build_bundle()
+        print(f"Built {manifest['file']} ({manifest['size']} bytes, {manifest['resource_count']} resources)")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Streaming export and bulk import of the learning catalog (resources + quizzes).
+
+Exports iterate a server-side cursor in chunks and yield NDJSON or CSV lines,
+so memory stays constant regardless of catalog size. Imports parse the input
+incrementally, validate each row, and insert valid rows in batched
+transactions, returning a per-row error report.
+
+NDJSON rows carry a `type` of `resource` or `quiz`. A quiz whose resource_id
+matches the `id` of a resource imported earlier in the same file is linked to
+the newly created resource; otherwise resource_id must name an existing one.
+
+CLI:
+    python catalog_io.py export [--format ndjson|csv] [--type all|resources|quizzes] > catalog.ndjson
+    python catalog_io.py import catalog.ndjson [--format ndjson|csv] [--type resources|quizzes] [--dry-run]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+
+from sqlalchemy import insert, select
+
+import catalog_sync
+import metrics
+from database import db
+from models import Resource, Quiz
+
+EXPORT_CHUNK_SIZE = int(os.getenv('CATALOG_EXPORT_CHUNK_SIZE', '1000'))
+IMPORT_BATCH_SIZE = int(os.getenv('CATALOG_IMPORT_BATCH_SIZE', '1000'))
+# Cap on per-row errors echoed back; the total is always reported
+MAX_REPORTED_ERRORS = 1000
+
+RESOURCE_COLUMNS = ('id', 'title', 'description', 'content_url', 'content_type', 'category', 'created_at')
+QUIZ_COLUMNS = ('id', 'resource_id', 'question', 'options', 'correct_answer', 'created_at')
+CONTENT_TYPES = ('article', 'video', 'infographic')
+FORMATS = ('ndjson', 'csv')
+EXPORT_TYPES = ('all', 'resources', 'quizzes')
+
+
+class ImportFormatError(ValueError):
+    """Raised for an unsupported format/type combination"""
+
+
+# Export
+
+def _stream_rows(model, columns):
+    """Yield dicts for every row of model, fetched in server-side chunks"""
+    stmt = select(*[getattr(model, c) for c in columns]).order_by(model.id)
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE))
+    for partition in result.partitions():
+        for row in partition:
+            item = dict(zip(columns, row))
+            if item.get('created_at') is not None:
+                item['created_at'] = item['created_at'].isoformat()
+            yield item
+
+
+def export_ndjson(kind='all'):
+    """Yield the catalog as NDJSON lines (resources before quizzes)"""
+    if kind not in EXPORT_TYPES:
+        raise ImportFormatError(f"type must be one of {', '.join(EXPORT_TYPES)}")
+    return _ndjson_lines(kind)
+
+
+def _ndjson_lines(kind):
+    if kind in ('all', 'resources'):
+        for row in _stream_rows(Resource, RESOURCE_COLUMNS):
+            yield json.dumps({'type': 'resource', **row}) + '\n'
+    if kind in ('all', 'quizzes'):
+        for row in _stream_rows(Quiz, QUIZ_COLUMNS):
+            row['options'] = json.loads(row['options'])
+            yield json.dumps({'type': 'quiz', **row}) + '\n'
+
+
+def export_csv(kind):
+    """Yield one table of the catalog as CSV (quiz options as a JSON array)"""
+    if kind not in ('resources', 'quizzes'):
+        raise ImportFormatError('CSV export needs type=resources or type=quizzes')
+    model, columns = (Resource, RESOURCE_COLUMNS) if kind == 'resources' else (Quiz, QUIZ_COLUMNS)
+    return _csv_chunks(model, columns)
+
+
+def _csv_chunks(model, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in _stream_rows(model, columns):
+        writer.writerow([row[c] for c in columns])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Import
+
+def _validate_resource(row):
+    title = (row.get('title') or '').strip()
+    description = (row.get('description') or '').strip()
+    category = (row.get('category') or '').strip()
+    if not title or not description or not category:
+        raise ValueError('title, description, and category are required')
+    if len(title) > 200:
+        raise ValueError('title must be at most 200 characters')
+    content_type = row.get('content_type') or 'article'
+    if content_type not in CONTENT_TYPES:
+        raise ValueError(f"content_type must be one of {', '.join(CONTENT_TYPES)}")
+    return {
+        'title': title,
+        'description': description,
+        'content_url': row.get('content_url') or None,
+        'content_type': content_type,
+        'category': category,
+    }
+
+
+def _validate_quiz(row, resource_ids):
+    question = (row.get('question') or '').strip()
+    if not question:
+        raise ValueError('question is required')
+
+    options = row.get('options')
+    if isinstance(options, str):
+        try:
+            options = json.loads(options)
+        except ValueError:
+            raise ValueError('options must be a JSON array')
+    if not isinstance(options, list) or len(options) < 2 or not all(isinstance(o, str) and o for o in options):
+        raise ValueError('options must be a list of at least two non-empty strings')
+
+    try:
+        correct_answer = int(row.get('correct_answer'))
+    except (TypeError, ValueError):
+        raise ValueError('correct_answer must be an integer')
+    if not 0 <= correct_answer < len(options):
+        raise ValueError('correct_answer must index into options')
+
+    try:
+        resource_id = int(row.get('resource_id'))
+    except (TypeError, ValueError):
+        raise ValueError('resource_id must be an integer')
+    resource_id = resource_ids(resource_id)
+    if resource_id is None:
+        raise ValueError('resource_id does not match an existing or imported resource')
+
+    return {
+        'resource_id': resource_id,
+        'question': question,
+        'options': json.dumps(options),
+        'correct_answer': correct_answer,
+    }
+
+
+def _decoded(lines):
+    """Decode a binary stream line by line, so a bad byte is pinned to its line"""
+    for line in lines:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def _parse(stream, fmt, kind):
+    """Yield (line_number, type, row dict or parse error) from a binary or text stream"""
+    if fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            try:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                yield line_number, None, ValueError('line is not valid UTF-8')
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('expected a JSON object')
+            except ValueError as e:
+                yield line_number, None, ValueError(f'invalid JSON: {e}')
+                continue
+            row_type = row.get('type') or {'resources': 'resource', 'quizzes': 'quiz'}.get(kind)
+            yield line_number, row_type, row
+    elif fmt == 'csv':
+        if kind not in ('resources', 'quizzes'):
+            raise ImportFormatError('CSV import needs type=resources or type=quizzes')
+        row_type = 'resource' if kind == 'resources' else 'quiz'
+        # Header is line 1
+        for line_number, row in enumerate(csv.DictReader(_decoded(stream)), start=2):
+            yield line_number, row_type, row
+    else:
+        raise ImportFormatError(f"format must be one of {', '.join(FORMATS)}")
+
+
+class CatalogImport:
+    """Validate and insert catalog rows in batches, collecting a per-row report"""
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.inserted = {'resources': 0, 'quizzes': 0}
+        self.errors = []
+        self.error_count = 0
+        self.rows_seen = 0
+        # id in the import file -> id of the resource created for it
+        self._resource_map = {}
+        self._known_resources = set()
+        self._resources = []  # (line_number, file id, values)
+        self._quizzes = []    # (line_number, values)
+
+    def _error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def _resolve_resource(self, resource_id):
+        if resource_id in self._resource_map:
+            return self._resource_map[resource_id]
+        if resource_id not in self._known_resources:
+            if db.session.query(Resource.id).filter_by(id=resource_id).first() is None:
+                return None
+            self._known_resources.add(resource_id)
+        return resource_id
+
+    def run(self, stream, fmt='ndjson', kind='all'):
+        line_number = 0
+        try:
+            for line_number, row_type, row in _parse(stream, fmt, kind):
+                self.rows_seen += 1
+                if isinstance(row, Exception):
+                    self._error(line_number, str(row))
+                    continue
+                try:
+                    self._add(line_number, row_type, row)
+                except ValueError as e:
+                    self._error(line_number, str(e))
+        except UnicodeDecodeError:
+            # A CSV record can span lines, so the reader cannot resume past bad bytes
+            self._error(line_number + 1, 'input is not valid UTF-8; this and later rows were not imported')
+
+        self._flush_resources()
+        self._flush_quizzes()
+        metrics.incr('catalog_import.rows', self.rows_seen)
+        metrics.incr('catalog_import.errors', self.error_count)
+        return self.report()
+
+    def _add(self, line_number, row_type, row):
+        if row_type == 'resource':
+            file_id = row.get('id')
+            file_id = int(file_id) if file_id not in (None, '') else None
+            self._resources.append((line_number, file_id, _validate_resource(row)))
+            if len(self._resources) >= self.batch_size:
+                self._flush_resources()
+        elif row_type == 'quiz':
+            # Quizzes may reference resources still waiting in the batch
+            if self._resources:
+                self._flush_resources()
+            self._quizzes.append((line_number, _validate_quiz(row, self._resolve_resource)))
+            if len(self._quizzes) >= self.batch_size:
+                self._flush_quizzes()
+        else:
+            raise ValueError("type must be 'resource' or 'quiz'")
+
+    def _flush_resources(self):
+        if not self._resources:
+            return
+        batch, self._resources = self._resources, []
+        self._write(batch, self._insert_resources)
+
+    def _flush_quizzes(self):
+        if not self._quizzes:
+            return
+        batch, self._quizzes = self._quizzes, []
+        self._write(batch, self._insert_quizzes)
+
+    def _write(self, batch, insert_rows):
+        try:
+            insert_rows(batch)
+        except Exception:
+            db.session.rollback()
+            metrics.incr('catalog_import.batch_failures')
+            # Isolate the bad rows: retry one row per transaction
+            for row in batch:
+                try:
+                    insert_rows([row])
+                except Exception as e:
+                    db.session.rollback()
+                    self._error(row[0], f'insert failed: {e}')
+
+    def _insert_resources(self, batch):
+        objects = [Resource(**values) for _, _, values in batch]
+        db.session.add_all(objects)
+        db.session.flush()  # Get the IDs
+        if self.dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+
+        for (_, file_id, _), obj in zip(batch, objects):
+            if file_id is not None:
+                # Dry runs never get real ids; map to a placeholder that still resolves
+                self._resource_map[file_id] = obj.id if not self.dry_run else -1
+        self.inserted['resources'] += len(batch)
+        metrics.incr('catalog_import.resources', len(batch))
+
+    def _insert_quizzes(self, batch):
+        if not self.dry_run:
+            # Bulk INSERT bypasses the ORM flush, so log sync changes explicitly
+            quiz_ids = db.session.scalars(
+                insert(Quiz).returning(Quiz.id), [values for _, values in batch]
+            ).all()
+            resource_ids = {values['resource_id'] for _, values in batch}
+            catalog_sync.record_changes(db.session, [
+                ('quiz', quiz_id, 'upsert') for quiz_id in quiz_ids
+            ] + [('resource', resource_id, 'upsert') for resource_id in resource_ids])
+            db.session.commit()
+
+        self.inserted['quizzes'] += len(batch)
+        metrics.incr('catalog_import.quizzes', len(batch))
+
+    def report(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows_seen,
+            'inserted': self.inserted,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors)
+        }
+
+
+def import_catalog(stream, fmt='ndjson', kind='all', dry_run=False):
+    """Import rows from a binary (or text) stream of UTF-8 lines; returns the report dict"""
+    return CatalogImport(dry_run=dry_run).run(stream, fmt=fmt, kind=kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export or import the learning catalog')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = sub.add_parser('export')
+    export_parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    export_parser.add_argument('--type', choices=EXPORT_TYPES, default='all')
+
+    import_parser = sub.add_parser('import')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    import_parser.add_argument('--type', choices=EXPORT_TYPES, default='all')
+    import_parser.add_argument('--dry-run', action='store_true')
+
+    args = parser.parse_args()
+
+    # app.py reports startup progress on stdout; keep it out of the export
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import app
+
+    with app.app_context():
+        if args.command == 'export':
+            chunks = export_ndjson(args.type) if args.format == 'ndjson' else export_csv(args.type)
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+
+        with open(args.path, 'rb') as f:
+            report = import_catalog(f, fmt=args.format, kind=args.type, dry_run=args.dry_run)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report['error_count'] else 0)
+
+
+if __name__ == '__main__':
+    main()
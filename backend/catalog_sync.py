@@ -0,0 +1,128 @@
+"""
+Delta sync feed for the learning catalog.
+
+Every insert, update or delete of a Resource or Quiz appends a row to
+`catalog_changes` in the same transaction, with a monotonically increasing
+`seq`. Only the latest change per entity is kept, so the log is bounded by
+the catalog size plus tombstones for deleted rows. Clients keep the highest
+seq they have applied and ask for `changes_since(seq)`.
+
+Seqs are handed out at INSERT but become visible at COMMIT. On PostgreSQL
+catalog writers take a transaction-scoped advisory lock before appending, so
+seq order is commit order and a client that has seen seq N can never later
+miss a smaller one. SQLite already serializes writers.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+
+import metrics
+from database import db
+from fieldsets import quiz_counts
+from models import CatalogChange, Resource, Quiz
+
+TRACKED_TYPES = {Resource: 'resource', Quiz: 'quiz'}
+MAX_CHANGES_PER_PAGE = 1000
+# pg_advisory_xact_lock key held by catalog writers until commit
+CATALOG_WRITE_LOCK = 0x63617461
+
+
+def record_changes(session, changes):
+    """Append (entity_type, entity_id, op) changes, replacing older ones per entity"""
+    if not changes:
+        return
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute(select(func.pg_advisory_xact_lock(CATALOG_WRITE_LOCK)))
+    # Picked up after commit by catalog_bundle to rebuild the offline bundle
+    session.info['catalog_changed'] = True
+    now = datetime.utcnow()
+    for entity_type in {c[0] for c in changes}:
+        ids = [c[1] for c in changes if c[0] == entity_type]
+        connection.execute(delete(CatalogChange).where(
+            CatalogChange.entity_type == entity_type,
+            CatalogChange.entity_id.in_(ids)
+        ))
+    connection.execute(insert(CatalogChange), [
+        {'entity_type': entity_type, 'entity_id': entity_id, 'op': op, 'changed_at': now}
+        for entity_type, entity_id, op in changes
+    ])
+    metrics.incr('catalog_sync.changes_recorded', len(changes))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_catalog_changes(session, flush_context):
+    changes = {}
+    for obj in session.new:
+        if type(obj) in TRACKED_TYPES:
+            changes[(TRACKED_TYPES[type(obj)], obj.id)] = 'upsert'
+    for obj in session.dirty:
+        if type(obj) in TRACKED_TYPES and session.is_modified(obj, include_collections=False):
+            changes[(TRACKED_TYPES[type(obj)], obj.id)] = 'upsert'
+    for obj in session.deleted:
+        if type(obj) in TRACKED_TYPES:
+            changes[(TRACKED_TYPES[type(obj)], obj.id)] = 'delete'
+
+    # Adding or removing a quiz changes its resource's quiz_count
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Quiz) and obj.resource_id is not None:
+            changes.setdefault(('resource', obj.resource_id), 'upsert')
+
+    if changes:
+        record_changes(session, [(t, i, op) for (t, i), op in changes.items()])
+
+
+def backfill_changes():
+    """Seed the log for catalogs created before change tracking existed"""
+    if db.session.query(CatalogChange.seq).first() is not None:
+        return 0
+    changes = [('resource', rid, 'upsert') for (rid,) in db.session.query(Resource.id).order_by(Resource.id)]
+    changes += [('quiz', qid, 'upsert') for (qid,) in db.session.query(Quiz.id).order_by(Quiz.id)]
+    record_changes(db.session, changes)
+    db.session.commit()
+    return len(changes)
+
+
+def changes_since(since, limit=MAX_CHANGES_PER_PAGE):
+    """Return changes with seq > since, each with the current row for upserts"""
+    limit = max(1, min(limit, MAX_CHANGES_PER_PAGE))
+    rows = CatalogChange.query.filter(CatalogChange.seq > since).order_by(
+        CatalogChange.seq
+    ).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    resource_ids = [r.entity_id for r in rows if r.entity_type == 'resource' and r.op == 'upsert']
+    quiz_ids = [r.entity_id for r in rows if r.entity_type == 'quiz' and r.op == 'upsert']
+
+    resources = {}
+    if resource_ids:
+        counts = quiz_counts(resource_ids)
+        resources = {
+            r.id: r.to_dict(quiz_count=counts.get(r.id, 0))
+            for r in Resource.query.filter(Resource.id.in_(resource_ids)).all()
+        }
+    # Answer keys are never synced to clients
+    quizzes = {q.id: q.to_dict() for q in Quiz.query.filter(Quiz.id.in_(quiz_ids)).all()} if quiz_ids else {}
+
+    changes = []
+    for row in rows:
+        change = row.to_dict()
+        if row.op == 'upsert':
+            data = (resources if row.entity_type == 'resource' else quizzes).get(row.entity_id)
+            if data is None:
+                # Deleted after this change was read; a later tombstone follows
+                continue
+            change['data'] = data
+        changes.append(change)
+
+    metrics.incr('catalog_sync.requests')
+    metrics.incr('catalog_sync.changes_served', len(changes))
+    return {
+        'changes': changes,
+        'since': since,
+        'next_since': rows[-1].seq if rows else since,
+        'has_more': has_more
+    }
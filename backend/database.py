@@ -1,3 +1,27 @@
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
 
-db = SQLAlchemy()
+
+class RoutingSession(Session):
+    """Send a request's reads to the replica engine picked by db_routing (g.db_read_engine)"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context()
+                and not isinstance(clause, (UpdateBase, TextClause))):
+            engine = g.get('db_read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def insert_or_ignore(model):
+    """INSERT that skips rows conflicting with an existing key (PostgreSQL or SQLite)"""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
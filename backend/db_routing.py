@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Read-replica routing with read-your-writes stickiness.
+
+With DATABASE_REPLICA_URLS set, GET and HEAD requests read from a healthy
+replica (RoutingSession in database.py sends their SELECTs to
+g.db_read_engine); writes always go to the primary. Once a request writes,
+the rest of it reads from the primary, and its caller (JWT identity, else
+client IP) is pinned to the primary for REPLICA_STICKY_SECONDS so it sees
+its own changes. Every worker on the host shares the pins through a local
+SQLite file (see local_store.py).
+
+Lag comes from a heartbeat row the replica_lag_monitor job writes on the
+primary and reads back from each replica; it is published as the
+db.replica_lag_seconds.<replica> gauge, and a replica whose lag is unknown
+or above REPLICA_MAX_LAG_SECONDS gets no reads.
+
+Local stand-in for a replica (a SQLite copy refreshed every few seconds):
+    DATABASE_REPLICA_URLS=sqlite:////tmp/vajra-replica.db python app.py
+    python db_routing.py sync --replica /tmp/vajra-replica.db --interval 2
+A second local PostgreSQL set up as a streaming standby works the same way.
+"""
+
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import event
+
+import metrics
+from database import RoutingSession, db
+from local_store import LocalStore
+from rate_limit import client_ip
+
+logger = logging.getLogger('vajra.db_routing')
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Keep this above the worst lag a replica may have and still take reads
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '15'))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '10'))
+REPLICA_HEARTBEAT_INTERVAL = int(os.getenv('REPLICA_HEARTBEAT_INTERVAL', '2'))
+REPLICA_STICKY_DB = os.getenv('REPLICA_STICKY_DB', os.path.join(os.path.dirname(__file__), 'instance', 'replica_sticky.db'))
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class StickyStore(LocalStore):
+    """Callers pinned to the primary until a deadline"""
+
+    def __init__(self, path):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS sticky (key TEXT PRIMARY KEY, until REAL NOT NULL) WITHOUT ROWID',
+        ))
+
+    def pin(self, key, seconds, now=None):
+        now = time.time() if now is None else now
+        self.connection().execute(
+            'INSERT INTO sticky (key, until) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET until = MAX(until, excluded.until)',
+            (key, now + seconds)
+        )
+
+    def is_pinned(self, key, now=None):
+        now = time.time() if now is None else now
+        row = self.connection().execute('SELECT until FROM sticky WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] > now
+
+    def prune(self):
+        cursor = self.connection().execute('DELETE FROM sticky WHERE until < ?', (time.time(),))
+        return cursor.rowcount
+
+
+store = StickyStore(REPLICA_STICKY_DB)
+
+# Last measured lag per replica bind key in this worker (None until measured)
+replica_lag = {}
+
+
+def replica_binds():
+    """SQLALCHEMY_BINDS entries for the configured replicas"""
+    return {f'replica_{i}': url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+
+
+def healthy_replicas():
+    return [
+        key for key in replica_binds()
+        if replica_lag.get(key) is not None and replica_lag[key] <= REPLICA_MAX_LAG_SECONDS
+    ]
+
+
+def primary_only(fn):
+    """Keep a GET handler on the primary (it writes, or must never see stale rows)"""
+    fn.primary_only = True
+    return fn
+
+
+def _caller():
+    """Stickiness key: the JWT identity when the request carries a valid token, else the client IP"""
+    if 'db_caller' not in g:
+        identity = None
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+        except Exception:
+            pass
+        g.db_caller = f'user:{identity}' if identity is not None else f'ip:{client_ip()}'
+    return g.db_caller
+
+
+def _route_request():
+    g.db_read_engine = None
+    if request.method not in READ_METHODS or not DATABASE_REPLICA_URLS:
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None or getattr(view, 'primary_only', False):
+        return
+
+    candidates = healthy_replicas()
+    if not candidates:
+        metrics.incr('db.reads.primary_no_replica')
+        return
+    try:
+        if store.is_pinned(_caller()):
+            metrics.incr('db.reads.primary_sticky')
+            return
+    except sqlite3.Error:
+        # Without the pins we cannot promise read-your-writes; stay on the primary
+        metrics.incr('db.routing_errors')
+        logger.exception('sticky_store_failed', extra={'rate_key': 'sticky_store_failed'})
+        return
+
+    key = random.choice(candidates)
+    g.db_read_engine = db.engines[key]
+    metrics.incr(f'db.reads.{key}')
+
+
+def _pin_after_write(response):
+    wrote = g.get('db_wrote') or (request.method not in READ_METHODS + ('OPTIONS',) and response.status_code < 400)
+    if wrote and DATABASE_REPLICA_URLS:
+        try:
+            store.pin(_caller(), REPLICA_STICKY_SECONDS)
+        except sqlite3.Error:
+            metrics.incr('db.routing_errors')
+            logger.exception('sticky_store_failed', extra={'rate_key': 'sticky_store_failed'})
+    return response
+
+
+def _mark_write():
+    if has_request_context():
+        # Later reads in this request must see the write
+        g.db_wrote = True
+        g.db_read_engine = None
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    _mark_write()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+
+def measure_replica_lag():
+    """Write the primary heartbeat, then read it back from each replica"""
+    from models import ReplicaHeartbeat
+
+    now = time.time()
+    heartbeat = db.session.get(ReplicaHeartbeat, 1)
+    if heartbeat is None:
+        db.session.add(ReplicaHeartbeat(id=1, beat_at=now))
+    else:
+        heartbeat.beat_at = now
+    db.session.commit()
+
+    table = ReplicaHeartbeat.__table__
+    for key in replica_binds():
+        try:
+            with db.engines[key].connect() as conn:
+                beat_at = conn.execute(table.select().with_only_columns(table.c.beat_at)
+                                       .where(table.c.id == 1)).scalar()
+        except Exception:
+            beat_at = None
+            metrics.incr(f'db.replica_errors.{key}')
+            logger.warning('replica_unreachable', extra={'replica': key, 'rate_key': f'replica_unreachable:{key}'})
+        # Lag is at least the time since the newest heartbeat the replica has seen
+        lag = None if beat_at is None else max(0.0, now - beat_at)
+        replica_lag[key] = lag
+        metrics.set_gauge(f'db.replica_lag_seconds.{key}', round(lag, 3) if lag is not None else -1)
+    metrics.set_gauge('db.replicas_healthy', len(healthy_replicas()))
+
+
+def prune_pins():
+    return store.prune()
+
+
+def init_db_routing(app):
+    app.before_request(_route_request)
+    app.after_request(_pin_after_write)
+
+
+def sync_sqlite(primary_path, replica_path):
+    """Copy the primary SQLite file into the replica in place, so open readers see the new pages"""
+    src = sqlite3.connect(primary_path)
+    dst = sqlite3.connect(replica_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _sqlite_path(value):
+    return value[len('sqlite:///'):] if value.startswith('sqlite:///') else value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read-replica tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync_parser = sub.add_parser('sync', help='keep a SQLite copy of the primary as a local replica stand-in')
+    sync_parser.add_argument('--primary', help='primary SQLite file or URL (default: DATABASE_URL)')
+    sync_parser.add_argument('--replica', required=True, help='replica SQLite file or URL')
+    sync_parser.add_argument('--interval', type=float, default=2.0, help='seconds between copies')
+    sync_parser.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+
+    primary = args.primary or os.getenv(
+        'DATABASE_URL', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'vajra.db')
+    )
+    primary, replica = _sqlite_path(primary), _sqlite_path(args.replica)
+    if '://' in primary or '://' in replica:
+        print('sync only copies SQLite files; use streaming replication for other databases')
+        sys.exit(1)
+
+    while True:
+        started = time.monotonic()
+        sync_sqlite(primary, replica)
+        print(f"Synced {primary} -> {replica} in {(time.monotonic() - started) * 1000:.0f} ms")
+        if args.once:
+            break
+        time.sleep(args.interval)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+How far a worker has replayed an append-only event table.
+
+leaderboard.py and alert_audience.py keep in-memory indexes current by
+replaying event rows in seq order. Sequence values are handed out at INSERT
+but become visible at COMMIT, so on PostgreSQL a transaction holding seq N
+can commit after one holding N+1 has already been replayed. The cursor
+remembers the seqs it stepped over (gaps) and asks for them again on every
+sync until they show up, or until EVENT_GAP_SECONDS have passed: a
+rolled-back transaction leaves a gap that is never filled.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from database import db
+
+# Longest a transaction may hold an event seq before committing
+EVENT_GAP_SECONDS = int(os.getenv('EVENT_GAP_SECONDS', '300'))
+_IN_CHUNK = 500
+
+
+class EventCursor:
+    """Replay position in one event table: the newest seq seen plus gaps below it"""
+
+    def __init__(self, seq_column, created_column, gap_seconds=EVENT_GAP_SECONDS):
+        self.seq_column = seq_column
+        self.created_column = created_column
+        self.gap_seconds = gap_seconds
+        self.last_seq = None
+        self._gaps = {}  # seq -> when it was first missed (monotonic)
+
+    def reset(self):
+        """Position at the newest event, before rebuilding from the tables; returns its seq"""
+        newest = db.session.query(db.func.max(self.seq_column)).scalar() or 0
+        # Seqs handed out within the gap window may still be in flight
+        cutoff = datetime.utcnow() - timedelta(seconds=self.gap_seconds)
+        floor = db.session.query(db.func.max(self.seq_column)).filter(self.created_column < cutoff).scalar()
+        if floor is None:
+            floor = (db.session.query(db.func.min(self.seq_column)).scalar() or 1) - 1
+        present = {seq for seq, in db.session.query(self.seq_column).filter(
+            self.seq_column > floor, self.seq_column <= newest
+        )}
+        now = time.monotonic()
+        self._gaps = {seq: now for seq in range(floor + 1, newest + 1) if seq not in present}
+        self.last_seq = newest
+        return newest
+
+    def fetch(self, *columns):
+        """
+        Rows (seq, *columns) not replayed yet, in seq order, and the set of
+        seqs among them that arrived late (filled a gap). Call applied() once
+        they have been replayed.
+        """
+        now = time.monotonic()
+        self._gaps = {seq: missed for seq, missed in self._gaps.items() if now - missed < self.gap_seconds}
+        rows = db.session.query(self.seq_column, *columns).filter(
+            self.seq_column > self.last_seq
+        ).order_by(self.seq_column).all()
+        gaps = sorted(self._gaps)
+        late = []
+        for start in range(0, len(gaps), _IN_CHUNK):
+            late.extend(db.session.query(self.seq_column, *columns).filter(
+                self.seq_column.in_(gaps[start:start + _IN_CHUNK])
+            ).all())
+        if late:
+            metrics.incr('event_cursor.late_events', len(late))
+        return sorted(late + rows, key=lambda row: row[0]), {row[0] for row in late}
+
+    def applied(self, rows):
+        """Advance past rows returned by fetch(), remembering the seqs skipped over"""
+        now = time.monotonic()
+        expected = self.last_seq + 1
+        for row in rows:
+            seq = row[0]
+            self._gaps.pop(seq, None)
+            if seq >= expected:
+                for missing in range(expected, seq):
+                    self._gaps[missing] = now
+                expected = seq + 1
+        self.last_seq = expected - 1
@@ -0,0 +1,136 @@
+"""
+Sparse fieldsets for list endpoints (`?fields=id,title`).
+
+Each Fieldset whitelists the columns a client may ask for on one model and
+turns the request into load_only() so unrequested columns (long TEXT bodies,
+emails, phone numbers) are never selected. Computed fields such as counts
+are filled for the whole page with one grouped query. Without `?fields=` the
+model's full to_dict() is returned unchanged.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy.orm import load_only
+
+from database import db
+from models import User, Resource, Quiz, Community, CommunityMember, Alert
+
+
+class FieldsetError(ValueError):
+    """Raised for a `fields` parameter naming fields outside the whitelist"""
+
+
+class Fieldset:
+    def __init__(self, model, columns, computed=None, formatters=None, always_load=('id',)):
+        self.model = model
+        self.columns = tuple(columns)
+        # name -> function(list of ids) -> {id: value}
+        self.computed = computed or {}
+        # name -> function(raw column value) -> JSON value
+        self.formatters = formatters or {}
+        self.always_load = tuple(always_load)
+
+    @property
+    def allowed(self):
+        return set(self.columns) | set(self.computed)
+
+    def parse(self, raw):
+        """Validate a comma separated fields string; None means all fields"""
+        if raw is None or not raw.strip():
+            return None
+        fields = []
+        for name in raw.split(','):
+            name = name.strip()
+            if name and name not in fields:
+                fields.append(name)
+        unknown = [f for f in fields if f not in self.allowed]
+        if unknown:
+            raise FieldsetError(
+                f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(sorted(self.allowed))}"
+            )
+        return fields
+
+    def apply(self, query, fields):
+        """Restrict the columns loaded by query to the requested fields"""
+        if fields is None:
+            return query
+        names = list(self.always_load) + [f for f in fields if f in self.columns and f not in self.always_load]
+        return query.options(load_only(*[getattr(self.model, name) for name in names]))
+
+    def serialize(self, objects, fields, **options):
+        """Render objects with only the requested fields; options go to to_dict()"""
+        if fields is None:
+            return [obj.to_dict(**options) for obj in objects]
+
+        ids = [obj.id for obj in objects]
+        computed = {name: self.computed[name](ids) if ids else {} for name in fields if name in self.computed}
+
+        results = []
+        for obj in objects:
+            item = {}
+            for name in fields:
+                if name in computed:
+                    item[name] = computed[name].get(obj.id, 0)
+                    continue
+                value = getattr(obj, name)
+                if name in self.formatters:
+                    value = self.formatters[name](value)
+                elif isinstance(value, datetime):
+                    value = value.isoformat()
+                item[name] = value
+            results.append(item)
+        return results
+
+
+def quiz_counts(resource_ids):
+    """Number of quizzes per resource for a page of resources"""
+    rows = db.session.query(Quiz.resource_id, db.func.count(Quiz.id)).filter(
+        Quiz.resource_id.in_(resource_ids)
+    ).group_by(Quiz.resource_id).all()
+    return dict(rows)
+
+
+def member_counts(community_ids):
+    """Number of active members per community for a page of communities"""
+    rows = db.session.query(CommunityMember.community_id, db.func.count(CommunityMember.id)).filter(
+        CommunityMember.community_id.in_(community_ids),
+        CommunityMember.status == 'active'
+    ).group_by(CommunityMember.community_id).all()
+    return dict(rows)
+
+
+RESOURCE_FIELDS = Fieldset(
+    Resource,
+    ('id', 'title', 'description', 'content_url', 'content_type', 'category', 'created_at'),
+    computed={'quiz_count': quiz_counts}
+)
+
+QUIZ_FIELDS = Fieldset(
+    Quiz,
+    ('id', 'resource_id', 'question', 'options', 'correct_answer', 'created_at'),
+    formatters={'options': json.loads},
+    always_load=('id', 'resource_id')
+)
+
+COMMUNITY_FIELDS = Fieldset(
+    Community,
+    ('id', 'name', 'description', 'state', 'city', 'locality', 'latitude', 'longitude', 'is_public',
+     'max_members', 'creator_id', 'created_at', 'updated_at'),
+    computed={'member_count': member_counts}
+)
+
+ALERT_FIELDS = Fieldset(
+    Alert,
+    ('id', 'title', 'message', 'alert_type', 'severity', 'category', 'state', 'city',
+     'locality', 'area', 'community_id', 'issued_at', 'expires_at', 'is_active', 'source', 'created_at'),
+    formatters={'area': lambda area: json.loads(area) if area else None},
+    always_load=('id', 'issued_at')
+)
+
+# password_hash is deliberately not selectable
+USER_FIELDS = Fieldset(
+    User,
+    ('id', 'username', 'email', 'state', 'city', 'locality', 'latitude', 'longitude',
+     'phone_number', 'is_admin', 'created_at')
+)
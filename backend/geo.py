@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Offline geocoding and a grid index for "communities within R km".
+
+State/city pairs are resolved to city-level coordinates from a bundled
+gazetteer of Indian places (data/in_places.csv); clients may send exact
+coordinates instead. Users and communities store the grid cell their
+coordinates fall in (GEO_CELL_DEG squares, indexed), so a radius query reads
+only the cells overlapping the circle's bounding box and then refines the
+candidates by exact great-circle distance. alert_areas.py uses the same cells
+to match polygon-targeted alerts.
+
+CLI:
+    python geo.py backfill              # geocode rows that have no coordinates yet
+    python geo.py bench [--count 100000] # grid lookup vs naive scan on a scratch database
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert, or_
+
+import metrics
+from database import db
+from models import Community, User
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), 'data', 'in_places.csv')
+# Changing the cell size requires `python geo.py backfill --recompute`
+GEO_CELL_DEG = 0.1
+NEARBY_MAX_RADIUS_KM = float(os.getenv('NEARBY_MAX_RADIUS_KM', '50'))
+NEARBY_MAX_RESULTS = 100
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+GRID_ROWS = round(180 / GEO_CELL_DEG)
+GRID_COLS = round(360 / GEO_CELL_DEG)
+
+_gazetteer = None
+_place_names = None
+
+
+def _normalize(name):
+    return ' '.join((name or '').split()).casefold()
+
+
+def load_gazetteer():
+    """(by (state, city), by city) lookup tables, read once per process"""
+    global _gazetteer
+    if _gazetteer is None:
+        by_place, by_city = {}, {}
+        with open(GAZETTEER_PATH, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                coords = (float(row['latitude']), float(row['longitude']))
+                state, city = _normalize(row['state']), _normalize(row['city'])
+                by_place[(state, city)] = coords
+                by_city.setdefault(city, set()).add(coords)
+        _gazetteer = (by_place, by_city)
+    return _gazetteer
+
+
+def geocode(state, city):
+    """City-level (latitude, longitude) for a state/city pair, or None"""
+    if not city:
+        return None
+    by_place, by_city = load_gazetteer()
+    coords = by_place.get((_normalize(state), _normalize(city)))
+    if coords is None:
+        # Tolerate a missing or misspelled state when the city name is unambiguous
+        candidates = by_city.get(_normalize(city), ())
+        coords = next(iter(candidates)) if len(candidates) == 1 else None
+    metrics.incr('geo.geocode_hits' if coords else 'geo.geocode_misses')
+    return coords
+
+
+def load_place_names():
+    """(states, places by city, pattern matching any of their names), spelled as in the gazetteer"""
+    global _place_names
+    if _place_names is None:
+        states, places = {}, {}
+        with open(GAZETTEER_PATH, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                states[_normalize(row['state'])] = row['state']
+                places.setdefault(_normalize(row['city']), set()).add((row['state'], row['city']))
+        names = sorted(set(states) | set(places), key=len, reverse=True)
+        pattern = re.compile(r'(?<!\w)(' + '|'.join(map(re.escape, names)) + r')(?!\w)')
+        _place_names = (states, places, pattern)
+    return _place_names
+
+
+def match_places(text):
+    """
+    States and (state, city) places named in free text such as "Coastal
+    districts of Kerala: Kochi, Alappuzha", spelled as in the gazetteer. A city
+    is only kept when its state is unambiguous: the only one with a city of that
+    name, or the only such state also named in the text.
+    """
+    states, places, pattern = load_place_names()
+    named_states, named_cities = set(), []
+    for name in pattern.findall(_normalize(text)):
+        if name in states:
+            named_states.add(states[name])
+        if name in places:
+            named_cities.append(places[name])
+    matched = set()
+    for candidates in named_cities:
+        in_named_state = {place for place in candidates if place[0] in named_states}
+        if len(in_named_state) == 1:
+            matched |= in_named_state
+        elif len(candidates) == 1:
+            matched |= candidates
+    return named_states | {state for state, _ in matched}, matched
+
+
+def parse_coordinates(data):
+    """Explicit latitude/longitude from a request body; None if absent, ValueError if invalid"""
+    latitude, longitude = data.get('latitude'), data.get('longitude')
+    if latitude is None and longitude is None:
+        return None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError('latitude and longitude must both be numbers')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('latitude must be within [-90, 90] and longitude within [-180, 180]')
+    return latitude, longitude
+
+
+def resolve_location(data, state, city):
+    """Explicit coordinates if given, otherwise the gazetteer entry for state/city"""
+    return parse_coordinates(data) or geocode(state, city)
+
+
+def set_coordinates(obj, coords):
+    """Store coordinates on a User or Community, keeping its grid cell in step"""
+    obj.latitude, obj.longitude = coords if coords else (None, None)
+    obj.geo_cell = cell_id(*coords) if coords else None
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_row(latitude):
+    return min(GRID_ROWS - 1, int(math.floor((latitude + 90) / GEO_CELL_DEG)))
+
+
+def cell_col(longitude):
+    return int(math.floor((longitude + 180) / GEO_CELL_DEG)) % GRID_COLS
+
+
+def cell_id(latitude, longitude):
+    # Row-major, so the cells of one row form a contiguous id range
+    return cell_row(latitude) * GRID_COLS + cell_col(longitude)
+
+
+def cell_ranges(latitude, longitude, radius_km):
+    """Inclusive (first, last) cell id ranges covering the circle's bounding box"""
+    dlat = radius_km / KM_PER_DEGREE
+    max_lat = min(90.0, abs(latitude) + dlat)
+    cos_lat = math.cos(math.radians(max_lat))
+    dlng = 180.0 if cos_lat < 1e-9 else min(180.0, radius_km / (KM_PER_DEGREE * cos_lat))
+
+    if dlng >= 180:
+        col_spans = [(0, GRID_COLS - 1)]
+    else:
+        first, last = cell_col(longitude - dlng), cell_col(longitude + dlng)
+        # The box wraps around the antimeridian
+        col_spans = [(first, last)] if first <= last else [(first, GRID_COLS - 1), (0, last)]
+
+    ranges = []
+    for row in range(cell_row(max(-90.0, latitude - dlat)), cell_row(min(90.0, latitude + dlat)) + 1):
+        ranges.extend((row * GRID_COLS + a, row * GRID_COLS + b) for a, b in col_spans)
+    return ranges
+
+
+def nearby_communities(latitude, longitude, radius_km, limit=NEARBY_MAX_RESULTS, public_only=True):
+    """[(community_id, distance_km)] within radius_km, nearest first"""
+    query = db.session.query(Community.id, Community.latitude, Community.longitude).filter(or_(*[
+        Community.geo_cell.between(first, last) for first, last in cell_ranges(latitude, longitude, radius_km)
+    ]))
+    if public_only:
+        query = query.filter(Community.is_public.is_(True))
+
+    hits = []
+    candidates = 0
+    for community_id, lat, lng in query:
+        candidates += 1
+        distance = haversine_km(latitude, longitude, lat, lng)
+        if distance <= radius_km:
+            hits.append((community_id, distance))
+    hits.sort(key=lambda hit: (hit[1], hit[0]))
+    metrics.incr('geo.nearby_queries')
+    metrics.incr('geo.nearby_candidates', candidates)
+    return hits[:limit]
+
+
+def naive_nearby_communities(latitude, longitude, radius_km, limit=NEARBY_MAX_RESULTS, public_only=True):
+    """Reference implementation scanning every located community (used by the benchmark)"""
+    query = db.session.query(Community.id, Community.latitude, Community.longitude).filter(
+        Community.latitude.isnot(None)
+    )
+    if public_only:
+        query = query.filter(Community.is_public.is_(True))
+    hits = [
+        (community_id, distance) for community_id, lat, lng in query
+        for distance in (haversine_km(latitude, longitude, lat, lng),) if distance <= radius_km
+    ]
+    hits.sort(key=lambda hit: (hit[1], hit[0]))
+    return hits[:limit]
+
+
+def backfill(recompute=False):
+    """Geocode users and communities without coordinates; recompute refreshes every grid cell"""
+    counts = {'users': 0, 'communities': 0}
+    for model, key in ((User, 'users'), (Community, 'communities')):
+        query = model.query
+        if not recompute:
+            query = query.filter(or_(model.latitude.is_(None), model.geo_cell.is_(None)))
+        for obj in query.yield_per(1000):
+            if obj.latitude is not None and obj.longitude is not None:
+                coords = (obj.latitude, obj.longitude)
+            else:
+                coords = geocode(obj.state, obj.city)
+            if coords:
+                set_coordinates(obj, coords)
+                counts[key] += 1
+        db.session.commit()
+    return counts
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def benchmark(count, queries, radius_km):
+    """Time grid lookups against a naive scan over `count` synthetic communities"""
+    places = list(load_gazetteer()[0].items())
+    rng = random.Random(42)
+
+    creator = User(username='geo-bench', email='geo-bench@example.invalid', password_hash='-')
+    db.session.add(creator)
+    db.session.flush()
+
+    started = time.perf_counter()
+    for start in range(0, count, 5000):
+        rows = []
+        for i in range(start, min(count, start + 5000)):
+            (state, city), (lat, lng) = rng.choice(places)
+            # Cluster around real places, spread over roughly 30 km
+            lat, lng = lat + rng.gauss(0, 0.15), lng + rng.gauss(0, 0.15)
+            rows.append({
+                'name': f'Community {i}', 'state': state, 'city': city,
+                'latitude': lat, 'longitude': lng, 'geo_cell': cell_id(lat, lng),
+                'is_public': True, 'max_members': 500, 'creator_id': creator.id
+            })
+        db.session.execute(insert(Community), rows)
+    db.session.commit()
+    print(f"Inserted {count} communities in {time.perf_counter() - started:.1f}s")
+
+    points = [rng.choice(places)[1] for _ in range(queries)]
+    results = {}
+    for name, func in (('grid', nearby_communities), ('naive', naive_nearby_communities)):
+        timings, results[name] = [], []
+        for lat, lng in points:
+            started = time.perf_counter()
+            results[name].append(func(lat, lng, radius_km, limit=count))
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{name:>5}: mean {sum(timings) / len(timings):8.2f} ms  "
+              f"p95 {_percentile(timings, 0.95):8.2f} ms  ({queries} queries, radius {radius_km:g} km)")
+
+    mismatches = sum(1 for a, b in zip(results['grid'], results['naive']) if [h[0] for h in a] != [h[0] for h in b])
+    print(f"Mean matches per query: {sum(len(r) for r in results['grid']) / queries:.1f}; mismatches: {mismatches}")
+    return mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geocoding backfill and nearby-search benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = sub.add_parser('backfill')
+    backfill_parser.add_argument('--recompute', action='store_true', help='recompute grid cells for every row')
+    bench_parser = sub.add_parser('bench')
+    bench_parser.add_argument('--count', type=int, default=100000)
+    bench_parser.add_argument('--queries', type=int, default=200)
+    bench_parser.add_argument('--radius', type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        # Never touch the configured database
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        scratch.close()
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+
+    from app import app
+
+    with app.app_context():
+        if args.command == 'backfill':
+            counts = backfill(recompute=args.recompute)
+            print(f"Located {counts['users']} users and {counts['communities']} communities")
+            sys.exit(0)
+
+        try:
+            ok = benchmark(args.count, args.queries, args.radius)
+        finally:
+            db.session.remove()
+            os.remove(scratch.name)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Group commit for community messages.
+
+With GROUP_COMMIT_ENABLED, send_message hands its row to a writer thread in
+the same process instead of committing itself. The writer waits up to
+GROUP_COMMIT_WINDOW_MS for more messages, inserts the whole batch (and any
+outbox events) in one transaction, and only then releases each waiting
+request with its message id, so every response still reports a durable
+row. On SQLite this turns one fsync and write-lock acquisition per message
+into one per batch. A request that waits longer than GROUP_COMMIT_TIMEOUT
+gets WriteTimeout only if its message is still queued (and is then dropped);
+once the writer has picked it up, the request waits for that commit.
+
+Batching needs concurrent requests in one process, i.e. threaded workers
+(WORKER_CLASS=gthread, THREADS>1 in gunicorn.conf.py).
+
+Benchmark: python group_commit.py bench [--threads 32] [--messages 4000] [--database-url URL]
+"""
+
+import argparse
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import metrics
+import outbox
+from database import db
+from models import Message
+
+logger = logging.getLogger('vajra.group_commit')
+
+GROUP_COMMIT_ENABLED = os.getenv('GROUP_COMMIT_ENABLED', 'false').lower() == 'true'
+GROUP_COMMIT_WINDOW_MS = float(os.getenv('GROUP_COMMIT_WINDOW_MS', '5'))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', '200'))
+# How long a request waits for the writer to pick its message up before giving up
+GROUP_COMMIT_TIMEOUT = float(os.getenv('GROUP_COMMIT_TIMEOUT', '10'))
+
+
+class WriteTimeout(Exception):
+    """The message was not written: the writer did not reach it in time"""
+
+
+class MessageWriter:
+    """Writer thread that commits queued messages in batches"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def ensure_started(self):
+        """Start the thread once per process (threads do not survive fork)"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, values, sender=None, timeout=GROUP_COMMIT_TIMEOUT):
+        """Queue a message and block until its batch commits; returns Message.to_dict()"""
+        self.ensure_started()
+        future = Future()
+        self._queue.put((values, sender, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            if future.cancel():
+                # Still queued, and the writer skips cancelled messages: nothing was written
+                metrics.incr('group_commit.timeouts')
+                raise WriteTimeout(f'message not written within {timeout:g}s')
+            # Already in a batch being committed; its outcome is on the way
+            return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW_MS / 1000
+        while len(batch) < GROUP_COMMIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Claim each message; a request that timed out has cancelled its own
+            batch = [item for item in self._next_batch() if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                with self.app.app_context():
+                    self._write(batch)
+            except Exception as e:
+                logger.exception('group_commit_write_failed')
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            results, broadcast = self._insert(batch)
+        except Exception:
+            db.session.rollback()
+            metrics.incr('group_commit.batch_failures')
+            if len(batch) == 1:
+                raise
+            # Isolate the bad row: retry one message per transaction
+            results, broadcast = [], False
+            for item in batch:
+                try:
+                    item_results, item_broadcast = self._insert([item])
+                    results += item_results
+                    broadcast = broadcast or item_broadcast
+                except Exception as e:
+                    db.session.rollback()
+                    item[2].set_exception(e)
+
+        for future, data in results:
+            future.set_result(data)
+        if broadcast:
+            outbox.dispatcher.wake()
+
+        metrics.incr('group_commit.batches')
+        metrics.incr('group_commit.messages', len(results))
+        metrics.set_gauge('group_commit.last_batch_size', len(batch))
+        metrics.set_gauge('group_commit.last_batch_ms', round((time.monotonic() - started) * 1000, 2))
+
+    def _insert(self, batch):
+        messages = [Message(**values) for values, _, _ in batch]
+        db.session.add_all(messages)
+        db.session.flush()  # Get the IDs
+
+        broadcast = False
+        for message in messages:
+            if outbox.OUTBOX_ENABLED and outbox.is_broadcast(message):
+                outbox.add_broadcast_event(message)
+                broadcast = True
+
+        # Render before commit expires the objects
+        results = [
+            (future, message.to_dict(sender=sender))
+            for message, (_, sender, future) in zip(messages, batch)
+        ]
+        db.session.commit()
+        return results, broadcast
+
+
+writer = MessageWriter()
+
+
+def init_group_commit(app):
+    writer.init_app(app)
+
+
+def benchmark(thread_count, message_count):
+    """Messages/second for one-commit-per-request vs group commit"""
+    from models import User, Community, CommunityMember
+
+    users = [User(username=f'gc-bench{i}', email=f'gc-bench{i}@example.invalid', password_hash='-')
+             for i in range(thread_count)]
+    db.session.add_all(users)
+    db.session.flush()
+    community = Community(name='Group commit bench', state='Bench', city='Bench', creator_id=users[0].id)
+    db.session.add(community)
+    db.session.flush()
+    db.session.add_all([CommunityMember(community_id=community.id, user_id=u.id) for u in users])
+    db.session.commit()
+    community_id, user_ids = community.id, [u.id for u in users]
+    app = writer.app
+
+    def direct(values):
+        db.session.add(Message(**values))
+        db.session.commit()
+
+    def grouped(values):
+        writer.submit(values, sender={'id': values['sender_id']})
+
+    per_thread = message_count // thread_count
+    results = {}
+    for name, send in (('per-request commit', direct), ('group commit', grouped)):
+        def worker(user_id):
+            with app.app_context():
+                for i in range(per_thread):
+                    send({'community_id': community_id, 'sender_id': user_id, 'content': f'message {i}'})
+                db.session.remove()
+
+        threads = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        results[name] = per_thread * thread_count / elapsed
+        print(f"{name:>18}: {results[name]:8.0f} messages/s ({per_thread * thread_count} messages, {thread_count} threads)")
+
+    batches = metrics.get('group_commit.batches')
+    if batches:
+        print(f"Mean batch size: {metrics.get('group_commit.messages') / batches:.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group commit benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench_parser = sub.add_parser('bench')
+    bench_parser.add_argument('--threads', type=int, default=32)
+    bench_parser.add_argument('--messages', type=int, default=4000)
+    bench_parser.add_argument('--database-url', help='scratch database to use (default: temporary SQLite file)')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        scratch.close()
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    # Measure the write path alone
+    outbox.OUTBOX_ENABLED = False
+
+    from app import app
+
+    writer.init_app(app)
+    with app.app_context():
+        try:
+            benchmark(args.threads, args.messages)
+        finally:
+            db.session.remove()
+            if scratch:
+                os.remove(scratch.name)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
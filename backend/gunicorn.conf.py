@@ -3,7 +3,9 @@ import os
 # Server configuration
 bind = "0.0.0.0:" + str(os.getenv("PORT", "5000"))
 workers = int(os.getenv("WORKERS", "2"))
-worker_class = "sync"
+# gthread with THREADS > 1 lets GROUP_COMMIT_ENABLED batch concurrent message writes
+worker_class = os.getenv("WORKER_CLASS", "sync")
+threads = int(os.getenv("THREADS", "1"))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -11,6 +13,14 @@ max_requests = 1000
 max_requests_jitter = 50
 preload_app = True
 
+
+# Warm each worker (pools, caches) before it accepts its first request; see warmup.py
+def post_fork(server, worker):
+    from app import app  # already imported by the master (preload_app)
+    from warmup import on_post_fork
+    on_post_fork(app)
+    server.log.info("Worker %s warmed up", worker.pid)
+
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -0,0 +1,167 @@
+"""
+Idempotency-Key support for POSTs that clients retry blindly.
+
+The first request with a given key (per user and path) is recorded as
+pending, runs normally, and its response is stored in a host-local SQLite
+file (see local_store.py) for IDEMPOTENCY_TTL seconds. A retry with the same
+key and body gets the stored response replayed without touching the main
+database; the same key with a different body is rejected with 422, and a
+retry that arrives while the first attempt is still running gets 409.
+Server errors and 429s are not stored, so those can be retried for real.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from functools import wraps
+
+from flask import jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity
+
+import metrics
+from local_store import LocalStore
+
+logger = logging.getLogger('vajra.idempotency')
+
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_DB = os.getenv('IDEMPOTENCY_DB', os.path.join(os.path.dirname(__file__), 'instance', 'idempotency.db'))
+# A pending key older than this belongs to a request that died; let a retry take over
+PENDING_TIMEOUT = 60
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore(LocalStore):
+    def __init__(self, path, ttl=IDEMPOTENCY_TTL):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS idempotency_keys ('
+            'key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, '
+            'body BLOB, content_type TEXT, created REAL NOT NULL) WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created ON idempotency_keys (created)',
+        ))
+        self.ttl = ttl
+
+    def begin(self, key, fingerprint, now=None):
+        """
+        Claim key for a new request, or return the existing record.
+
+        Returns None when the caller owns the key and should run the request,
+        else (fingerprint, status, body, content_type) where status is None
+        while the original request is still in flight.
+        """
+        now = time.time() if now is None else now
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT fingerprint, status, body, content_type, created FROM idempotency_keys WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is not None:
+                expired = row[4] < now - self.ttl
+                abandoned = row[1] is None and row[4] < now - PENDING_TIMEOUT
+                if not (expired or abandoned):
+                    conn.execute('COMMIT')
+                    return row[:4]
+                conn.execute('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+            conn.execute(
+                'INSERT INTO idempotency_keys (key, fingerprint, created) VALUES (?, ?, ?)',
+                (key, fingerprint, now)
+            )
+            conn.execute('COMMIT')
+            return None
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def complete(self, key, status, body, content_type):
+        self.connection().execute(
+            'UPDATE idempotency_keys SET status = ?, body = ?, content_type = ? WHERE key = ?',
+            (status, body, content_type, key)
+        )
+
+    def release(self, key):
+        self.connection().execute('DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL', (key,))
+
+    def prune(self):
+        cursor = self.connection().execute(
+            'DELETE FROM idempotency_keys WHERE created < ?', (time.time() - self.ttl,)
+        )
+        return cursor.rowcount
+
+
+store = IdempotencyStore(IDEMPOTENCY_DB)
+
+
+def _error(message, status):
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def _should_store(status):
+    return status < 500 and status != 429
+
+
+def idempotent(fn):
+    """Honor an Idempotency-Key header; place below @jwt_required()"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        raw_key = request.headers.get('Idempotency-Key')
+        if raw_key is None:
+            return fn(*args, **kwargs)
+        if not raw_key.strip() or len(raw_key) > MAX_KEY_LENGTH:
+            return _error(f'Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters', 400)
+
+        key = f'{get_jwt_identity()}:{request.method}:{request.path}:{raw_key.strip()}'
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        try:
+            existing = store.begin(key, fingerprint)
+        except sqlite3.Error:
+            # Without the store we cannot dedupe; run the request as if no key was sent
+            metrics.incr('idempotency.errors')
+            logger.exception('idempotency_store_failed', extra={'rate_key': 'idempotency_store_failed'})
+            return fn(*args, **kwargs)
+
+        if existing is not None:
+            stored_fingerprint, status, body, content_type = existing
+            if stored_fingerprint != fingerprint:
+                metrics.incr('idempotency.mismatches')
+                return _error('Idempotency-Key was already used with a different request body', 422)
+            if status is None:
+                metrics.incr('idempotency.in_flight')
+                response = _error('A request with this Idempotency-Key is still being processed', 409)
+                response.headers['Retry-After'] = '1'
+                return response
+            metrics.incr('idempotency.replays')
+            response = make_response(body, status)
+            response.content_type = content_type
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(fn(*args, **kwargs))
+        except BaseException:
+            try:
+                store.release(key)
+            except sqlite3.Error:
+                pass
+            raise
+
+        try:
+            if _should_store(response.status_code):
+                store.complete(key, response.status_code, response.get_data(), response.content_type)
+                metrics.incr('idempotency.stored')
+            else:
+                store.release(key)
+        except sqlite3.Error:
+            metrics.incr('idempotency.errors')
+            logger.exception('idempotency_store_failed', extra={'rate_key': 'idempotency_store_failed'})
+        return response
+    return wrapper
+
+
+def prune_keys():
+    return store.prune()
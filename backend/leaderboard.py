@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Quiz leaderboards per state, city and community.
+
+Scores are maintained incrementally: submit_quiz adjusts the user's row in
+`leaderboard_scores` by the change in their score and appends a
+`leaderboard_events` row in the same transaction. Each worker keeps the
+boards in memory as order-statistic skiplists (top-N in O(N), a user's rank
+in O(log n)) and, before answering, replays events it has not seen yet
+(including ones that committed late, see event_cursor.py).
+
+Rebuild everything from user_progress with `python leaderboard.py rebuild`.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+
+import metrics
+from database import db, insert_or_ignore
+from event_cursor import EventCursor
+from models import LeaderboardScore, LeaderboardEvent, UserProgress, User, CommunityMember
+
+# Events older than this are pruned; a worker idle for longer rebuilds instead of replaying
+LEADERBOARD_EVENT_RETENTION_HOURS = int(os.getenv('LEADERBOARD_EVENT_RETENTION_HOURS', '24'))
+LEADERBOARD_MAX_LIMIT = 100
+SCOPES = ('state', 'city', 'community')
+
+_MAX_LEVELS = 24  # comfortably indexes ~16M entries
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedSet:
+    """
+    Indexable skiplist of unique, ordered keys.
+
+    width[level] is the number of level-0 steps a link skips, which gives
+    O(log n) insert, remove and rank (position of a key).
+    """
+
+    def __init__(self):
+        self.head = _Node(None, _MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _predecessors(self, key):
+        chain = [None] * _MAX_LEVELS
+        steps = [0] * _MAX_LEVELS
+        node = self.head
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps_at_level = self._predecessors(key)
+        levels = 1
+        while levels < _MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+
+        node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, _MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._predecessors(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+
+        for level in range(len(node.next)):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(len(node.next), _MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """Number of keys strictly smaller than key"""
+        _, steps = self._predecessors(key)
+        return sum(steps)
+
+    def first(self, count):
+        keys = []
+        node = self.head.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def board_keys(state, city, community_ids):
+    """Boards a user with this location and these memberships belongs to"""
+    keys = [('community', cid) for cid in community_ids]
+    if state:
+        keys.append(('state', state))
+        if city:
+            keys.append(('city', state, city))
+    return keys
+
+
+class LeaderboardIndex:
+    """In-memory boards for this worker, kept in step with leaderboard_events"""
+
+    def __init__(self):
+        self._boards = {}
+        self._users = {}  # user_id -> (sort key, board keys)
+        self._cursor = EventCursor(LeaderboardEvent.seq, LeaderboardEvent.created_at)
+        self._last_sync = 0
+        self._lock = threading.RLock()
+
+    def _set_user(self, user_id, score, boards):
+        old = self._users.pop(user_id, None)
+        if old:
+            old_key, old_boards = old
+            for board in old_boards:
+                self._boards[board].remove(old_key)
+        if score is None:
+            return
+        # Highest score first, ties broken by user id
+        key = (-score, user_id)
+        for board in boards:
+            self._boards.setdefault(board, RankedSet()).insert(key)
+        self._users[user_id] = (key, boards)
+
+    def _load_users(self, user_ids=None):
+        """(user_id, score, boards) for users with a score, optionally restricted to user_ids"""
+        score_query = db.session.query(
+            LeaderboardScore.user_id, LeaderboardScore.total_score, User.state, User.city
+        ).join(User, User.id == LeaderboardScore.user_id)
+        member_query = db.session.query(CommunityMember.user_id, CommunityMember.community_id).filter(
+            CommunityMember.status == 'active'
+        )
+        if user_ids is not None:
+            score_query = score_query.filter(LeaderboardScore.user_id.in_(user_ids))
+            member_query = member_query.filter(CommunityMember.user_id.in_(user_ids))
+
+        memberships = {}
+        for user_id, community_id in member_query.yield_per(5000):
+            memberships.setdefault(user_id, []).append(community_id)
+
+        for user_id, score, state, city in score_query.yield_per(5000):
+            yield user_id, score, board_keys(state, city, memberships.get(user_id, []))
+
+    def _rebuild(self):
+        self._boards = {}
+        self._users = {}
+        for user_id, score, boards in self._load_users():
+            self._set_user(user_id, score, boards)
+        metrics.incr('leaderboard.index_rebuilds')
+
+    def sync(self):
+        """Apply events committed by any worker since the last sync"""
+        with self._lock:
+            stale = time.monotonic() - self._last_sync > LEADERBOARD_EVENT_RETENTION_HOURS * 3600 / 2
+            if self._cursor.last_seq is None or stale:
+                self._cursor.reset()
+                self._rebuild()
+                self._last_sync = time.monotonic()
+                return
+
+            # Events are reloads of a user's current rows, so a late one is safe in any order
+            events, _ = self._cursor.fetch(LeaderboardEvent.user_id)
+            self._last_sync = time.monotonic()
+            if not events:
+                return
+
+            if any(user_id is None for _, user_id in events):
+                self._rebuild()
+                self._cursor.applied(events)
+                return
+
+            user_ids = list({user_id for _, user_id in events})
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                seen = set()
+                for user_id, score, boards in self._load_users(chunk):
+                    self._set_user(user_id, score, boards)
+                    seen.add(user_id)
+                for user_id in set(chunk) - seen:
+                    self._set_user(user_id, None, [])
+            self._cursor.applied(events)
+            metrics.incr('leaderboard.events_applied', len(events))
+
+    def top(self, board, limit):
+        with self._lock:
+            ranked = self._boards.get(board)
+            if not ranked:
+                return [], 0
+            return [(user_id, -neg_score) for neg_score, user_id in ranked.first(limit)], len(ranked)
+
+    def rank_of(self, board, user_id):
+        """(1-based rank, score) of a user on a board, or None"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if not entry or board not in entry[1]:
+                return None
+            key = entry[0]
+            return self._boards[board].rank(key) + 1, -key[0]
+
+
+index = LeaderboardIndex()
+
+
+def record_score_change(user_id, old_score, new_score):
+    """Adjust the user's total by the change in one resource score (caller commits)"""
+    delta = (new_score or 0) - (old_score or 0)
+    if not delta and db.session.get(LeaderboardScore, user_id) is not None:
+        return
+    # Incremented in SQL: concurrent submits by one user must not overwrite each other's totals
+    increment = update(LeaderboardScore).where(LeaderboardScore.user_id == user_id).values(
+        total_score=LeaderboardScore.total_score + delta
+    )
+    if db.session.execute(increment).rowcount == 0:
+        # First score since leaderboards existed: seed from progress already flushed
+        db.session.flush()
+        total = db.session.query(db.func.sum(UserProgress.quiz_score)).filter(
+            UserProgress.user_id == user_id
+        ).scalar() or 0
+        seeded = db.session.execute(insert_or_ignore(LeaderboardScore).values(
+            user_id=user_id, total_score=total, updated_at=datetime.utcnow()
+        )).rowcount
+        if not seeded:
+            # A concurrent submit seeded the row first, without this result
+            db.session.execute(increment)
+    db.session.add(LeaderboardEvent(user_id=user_id))
+    metrics.incr('leaderboard.score_updates')
+
+
+def record_membership_change(user_id):
+    """Community join/leave moves the user between community boards (caller commits)"""
+    db.session.add(LeaderboardEvent(user_id=user_id))
+
+
+def rebuild_scores():
+    """Recompute every total from user_progress and tell workers to reload"""
+    db.session.execute(delete(LeaderboardScore))
+    db.session.execute(insert(LeaderboardScore).from_select(
+        ['user_id', 'total_score', 'updated_at'],
+        select(
+            UserProgress.user_id,
+            db.func.coalesce(db.func.sum(UserProgress.quiz_score), 0),
+            db.literal(datetime.utcnow())
+        ).group_by(UserProgress.user_id)
+    ))
+    db.session.add(LeaderboardEvent(user_id=None))
+    db.session.commit()
+    return db.session.query(db.func.count(LeaderboardScore.user_id)).scalar()
+
+
+def prune_events():
+    """Drop replayed events past the retention window"""
+    cutoff = datetime.utcnow() - timedelta(hours=LEADERBOARD_EVENT_RETENTION_HOURS)
+    # Always keep the newest event so max(seq) never goes backwards
+    newest = db.session.query(db.func.max(LeaderboardEvent.seq)).scalar()
+    if newest is None:
+        return 0
+    result = db.session.execute(delete(LeaderboardEvent).where(
+        LeaderboardEvent.created_at < cutoff,
+        LeaderboardEvent.seq < newest
+    ))
+    db.session.commit()
+    return result.rowcount
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Usage: python leaderboard.py rebuild")
+        sys.exit(1)
+
+    from app import app
+
+    with app.app_context():
+        count = rebuild_scores()
+        print(f"Rebuilt leaderboard scores for {count} users")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
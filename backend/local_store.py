@@ -0,0 +1,38 @@
+"""
+Small SQLite files shared by the gunicorn workers on one host.
+
+Used for short-lived coordination state (rate-limit buckets, idempotency
+keys) that must be visible to every worker but does not belong in the main
+database: WAL mode so readers never block the writer, no fsync, memory
+mapped reads.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class LocalStore:
+    """One connection per thread and process to a WAL-mode SQLite file"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema  # statements run once per new connection
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Autocommit; callers open BEGIN IMMEDIATE for read-modify-write
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Losing a little of this state on power loss is harmless; never fsync
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA mmap_size=8388608')
+        for statement in self.schema:
+            conn.execute(statement)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,219 @@
+"""
+Structured, non-blocking logging for the API.
+
+Request threads only format a record and drop it on a bounded queue; a
+background QueueListener writes JSON lines to stderr, or to LOG_FILE when
+set. Every gunicorn worker appends to that file on its own, so it is opened
+with WatchedFileHandler and rotated externally (logrotate): a worker reopens
+the file once it has been moved instead of renaming it under the others. When the
+queue is full records are dropped and counted instead of blocking a request.
+Sampling and per-key rate limits keep log volume bounded on hot paths, and
+sensitive fields are redacted before anything reaches disk.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, has_request_context, request
+
+import metrics
+
+LOG_FILE = os.getenv('LOG_FILE', '')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Records per second allowed for each rate-limit key (logger + message by default)
+LOG_RATE_LIMIT = float(os.getenv('LOG_RATE_LIMIT', '50'))
+
+SENSITIVE_KEYS = {
+    'password', 'current_password', 'new_password', 'password_hash',
+    'access_token', 'token', 'authorization', 'jwt', 'secret',
+}
+REDACTED = '[REDACTED]'
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id', 'sample_rate', 'rate_key',
+}
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def redact(value):
+    """Return a copy of value with sensitive keys masked at any depth"""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id (if any) to every record"""
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep records logged with extra={'sample_rate': p} with probability p"""
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        metrics.incr('log.sampled_out')
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per rate key; suppressed records are counted, not queued"""
+
+    def __init__(self, rate=LOG_RATE_LIMIT, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._buckets = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+
+        key = getattr(record, 'rate_key', None) or (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                metrics.incr('log.rate_limited')
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            suppressed = self._suppressed.pop(key, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as a single JSON line with redacted extra fields"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                payload[key] = REDACTED if key.lower() in SENSITIVE_KEYS else redact(value)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record"""
+
+    def prepare(self, record):
+        # Render exception text on the request thread (the traceback object
+        # cannot cross the queue) but leave JSON encoding to the listener.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(dict(record.__dict__))
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            metrics.incr('log.enqueued')
+        except queue.Full:
+            metrics.incr('log.dropped')
+
+
+def _build_handler():
+    if LOG_FILE:
+        os.makedirs(os.path.dirname(os.path.abspath(LOG_FILE)), exist_ok=True)
+        handler = logging.handlers.WatchedFileHandler(LOG_FILE, delay=True)
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def _start_listener():
+    """(Re)create the queue, the queue handler and its writer thread"""
+    global _listener
+
+    with _listener_lock:
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+        queue_handler.addFilter(SamplingFilter())
+        queue_handler.addFilter(RateLimitFilter())
+
+        logger = logging.getLogger('vajra')
+        for handler in list(logger.handlers):
+            if isinstance(handler, DroppingQueueHandler):
+                logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, _build_handler(), respect_handler_level=True
+        )
+        _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging(app):
+    """Route the `vajra.*` loggers through the background writer and tag requests"""
+    if app.extensions.get('vajra_logging'):
+        return
+    app.extensions['vajra_logging'] = True
+
+    logger = logging.getLogger('vajra')
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    # Threads do not survive fork, so every gunicorn worker needs its own writer
+    os.register_at_fork(after_in_child=_start_listener)
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+
+    @app.after_request
+    def expose_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        return response
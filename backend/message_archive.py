@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Retention tiers for community messages.
+
+Messages older than MESSAGE_RETENTION_DAYS are moved, oldest first, out of
+the hot `messages` table into `message_archive_blocks`: one row per run of up
+to MESSAGE_ARCHIVE_BLOCK_SIZE consecutive messages of a community, stored as
+zlib-compressed JSON. The hot table and its indexes stay small while the full
+history remains readable through read_history(), which only opens archive
+blocks once a cursor walks past the newest archived message. Pinned
+messages are never archived: they stay in the hot table, so the two tiers
+can interleave by id and read_history merges them.
+
+Run once with `python message_archive.py`; it also runs as a periodic job.
+"""
+
+import json
+import os
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+
+from sqlalchemy import delete
+from sqlalchemy.orm import joinedload
+
+import metrics
+from database import db
+from models import Message, MessageArchiveBlock, User
+
+# On by default; 0 disables archiving
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', '180'))
+MESSAGE_ARCHIVE_BLOCK_SIZE = int(os.getenv('MESSAGE_ARCHIVE_BLOCK_SIZE', '500'))
+MESSAGE_ARCHIVE_INTERVAL = int(os.getenv('MESSAGE_ARCHIVE_INTERVAL', '3600'))
+
+# Archived columns, in storage order
+_FIELDS = ('id', 'community_id', 'sender_id', 'content', 'message_type',
+           'is_emergency', 'is_pinned', 'created_at', 'updated_at')
+
+# Blocks are immutable, so decoded blocks can be cached per process
+_BLOCK_CACHE_SIZE = 64
+_block_cache = OrderedDict()
+_block_cache_lock = Lock()
+
+
+def _encode_block(messages):
+    rows = [
+        [m.id, m.community_id, m.sender_id, m.content, m.message_type,
+         bool(m.is_emergency), bool(m.is_pinned),
+         m.created_at.isoformat(), m.updated_at.isoformat() if m.updated_at else None]
+        for m in messages
+    ]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def _decode_block(block):
+    with _block_cache_lock:
+        rows = _block_cache.get(block.id)
+        if rows is not None:
+            _block_cache.move_to_end(block.id)
+            return rows
+
+    rows = [dict(zip(_FIELDS, row)) for row in json.loads(zlib.decompress(block.data))]
+    metrics.incr('archive.blocks_decoded')
+    with _block_cache_lock:
+        _block_cache[block.id] = rows
+        while len(_block_cache) > _BLOCK_CACHE_SIZE:
+            _block_cache.popitem(last=False)
+    return rows
+
+
+def archive_old_messages(retention_days=MESSAGE_RETENTION_DAYS, block_size=MESSAGE_ARCHIVE_BLOCK_SIZE):
+    """Move messages past retention into compressed blocks; returns messages archived"""
+    if retention_days <= 0:
+        return 0
+
+    started = time.monotonic()
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    # Pinned messages stay in the hot table, where listings and pins can reach them
+    archivable = (Message.created_at < cutoff, Message.is_pinned.isnot(True))
+    community_ids = [row[0] for row in db.session.query(Message.community_id).filter(
+        *archivable
+    ).distinct().all()]
+
+    total = 0
+    for community_id in community_ids:
+        while True:
+            messages = Message.query.filter(
+                Message.community_id == community_id,
+                *archivable
+            ).order_by(Message.id).limit(block_size).all()
+
+            if not messages:
+                break
+
+            ids = [m.id for m in messages]
+            block = MessageArchiveBlock(
+                community_id=community_id,
+                first_message_id=ids[0],
+                last_message_id=ids[-1],
+                message_count=len(ids),
+                first_created_at=messages[0].created_at,
+                last_created_at=messages[-1].created_at,
+                data=_encode_block(messages)
+            )
+            # Detach the loaded messages so the bulk delete below is the only delete
+            db.session.expunge_all()
+            db.session.add(block)
+            result = db.session.execute(delete(Message).where(Message.id.in_(ids)))
+
+            # Another worker archived (part of) this range first
+            if result.rowcount != len(ids):
+                db.session.rollback()
+                metrics.incr('archive.conflicts')
+                break
+
+            db.session.commit()
+            total += len(ids)
+            metrics.incr('archive.blocks_written')
+
+            if len(ids) < block_size:
+                break
+
+    metrics.incr('archive.runs')
+    metrics.incr('archive.messages_archived', total)
+    metrics.set_gauge('archive.last_run_ms', round((time.monotonic() - started) * 1000, 1))
+    return total
+
+
+def _archived_before(community_id, before_id, limit):
+    """Up to limit archived messages with id < before_id, newest first"""
+    query = MessageArchiveBlock.query.filter(MessageArchiveBlock.community_id == community_id)
+    if before_id is not None:
+        query = query.filter(MessageArchiveBlock.first_message_id < before_id)
+
+    # Block ranges can overlap (a message archived after it was unpinned), so
+    # keep reading blocks until none can hold a newer row than the ones found
+    results = []
+    for block in query.order_by(MessageArchiveBlock.last_message_id.desc()).yield_per(4):
+        if len(results) >= limit and block.last_message_id < results[limit - 1]['id']:
+            break
+        results.extend(row for row in _decode_block(block) if before_id is None or row['id'] < before_id)
+        results.sort(key=lambda row: row['id'], reverse=True)
+    return results[:limit]
+
+
+def read_history(community_id, before_id=None, limit=50):
+    """
+    Return (messages, has_more) for a community, newest first, across both tiers.
+    Messages are dicts shaped like Message.to_dict().
+    """
+    query = Message.query.options(joinedload(Message.sender)).filter(
+        Message.community_id == community_id
+    )
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    hot = query.order_by(Message.id.desc()).limit(limit + 1).all()
+
+    newest_archived = db.session.query(db.func.max(MessageArchiveBlock.last_message_id)).filter(
+        MessageArchiveBlock.community_id == community_id
+    )
+    if before_id is not None:
+        newest_archived = newest_archived.filter(MessageArchiveBlock.first_message_id < before_id)
+    newest_archived = newest_archived.scalar()
+
+    if newest_archived is None or (len(hot) > limit and hot[limit - 1].id > newest_archived):
+        metrics.incr('archive.reads_hot')
+        return [m.to_dict() for m in hot[:limit]], len(hot) > limit
+
+    # Old pinned messages are still hot, so merge both tiers by id
+    archived = _archived_before(community_id, before_id, limit + 1)
+    metrics.incr('archive.reads_archive' if archived else 'archive.reads_hot')
+    merged = sorted(
+        [(m.id, m) for m in hot] + [(row['id'], row) for row in archived],
+        key=lambda item: item[0], reverse=True
+    )
+    has_more = len(merged) > limit
+    page = [item for _, item in merged[:limit]]
+
+    # Resolve senders of archived rows in one query
+    sender_ids = {item['sender_id'] for item in page if isinstance(item, dict)}
+    senders = {u.id: u.to_dict() for u in User.query.filter(User.id.in_(sender_ids)).all()} if sender_ids else {}
+    messages = [
+        {**item, 'sender': senders.get(item['sender_id']), 'archived': True} if isinstance(item, dict)
+        else item.to_dict()
+        for item in page
+    ]
+
+    return messages, has_more
+
+
+def main():
+    from app import app
+
+    with app.app_context():
+        count = archive_old_messages()
+        print(f"Archived {count} messages older than {MESSAGE_RETENTION_DAYS} days")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
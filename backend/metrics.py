@@ -0,0 +1,44 @@
+"""
+In-process counters and gauges for the API.
+
+Subsystems call incr() / set_gauge() on hot paths; the values are read back
+through snapshot() by the /metrics endpoint. Everything is per worker process.
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def incr(name, amount=1):
+    """Increase a counter by amount"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """Record the latest value of a gauge"""
+    with _lock:
+        _gauges[name] = value
+
+
+def get(name, default=0):
+    """Read a single counter or gauge"""
+    with _lock:
+        if name in _counters:
+            return _counters[name]
+        return _gauges.get(name, default)
+
+
+def snapshot(prefix=None):
+    """Return a copy of all counters and gauges, optionally filtered by prefix"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    if prefix:
+        counters = {k: v for k, v in counters.items() if k.startswith(prefix)}
+        gauges = {k: v for k, v in gauges.items() if k.startswith(prefix)}
+    return {'counters': counters, 'gauges': gauges}
+
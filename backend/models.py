@@ -15,18 +15,27 @@ class User(db.Model):
     city = db.Column(db.String(100), nullable=True)
     locality = db.Column(db.String(200), nullable=True)
     phone_number = db.Column(db.String(15), nullable=True)
+    # Optional coordinates, exact or resolved from state/city (see geo.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geo_cell = db.Column(db.Integer, nullable=True, index=True)  # see geo.cell_id
     is_admin = db.Column(db.Boolean, default=False)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Lets the alert audience index (alert_audience.py) load users already grouped by location
+    __table_args__ = (
+        db.Index('ix_users_location', 'state', 'city', 'id'),
+    )
+    
     # Relationships
     progress = db.relationship('UserProgress', backref='user', lazy=True)
     community_memberships = db.relationship('CommunityMember', backref='user', lazy=True)
     sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy=True)
     created_communities = db.relationship('Community', backref='creator', lazy=True)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, include_coordinates=False):
+        data = {
             'id': self.id,
             'username': self.username,
             'email': self.email,
@@ -37,6 +46,11 @@ class User(db.Model):
             'is_admin': self.is_admin,
             'created_at': self.created_at.isoformat()
         }
+        # Coordinates may be exact; only the user themselves gets them back
+        if include_coordinates:
+            data['latitude'] = self.latitude
+            data['longitude'] = self.longitude
+        return data
 
 class Resource(db.Model):
     __tablename__ = 'resources'
@@ -53,7 +67,8 @@ class Resource(db.Model):
     quizzes = db.relationship('Quiz', backref='resource', lazy=True)
     progress = db.relationship('UserProgress', backref='resource', lazy=True)
     
-    def to_dict(self):
+    def to_dict(self, quiz_count=None):
+        # Pass quiz_count when it was already counted in SQL to avoid loading every quiz
         return {
             'id': self.id,
             'title': self.title,
@@ -62,7 +77,7 @@ class Resource(db.Model):
             'content_type': self.content_type,
             'category': self.category,
             'created_at': self.created_at.isoformat(),
-            'quiz_count': len(self.quizzes)
+            'quiz_count': len(self.quizzes) if quiz_count is None else quiz_count
         }
 
 class Quiz(db.Model):
@@ -89,6 +104,30 @@ class Quiz(db.Model):
         data['correct_answer'] = self.correct_answer
         return data
 
+class CatalogChange(db.Model):
+    __tablename__ = 'catalog_changes'
+    
+    # seq is the sync cursor; AUTOINCREMENT so SQLite never reuses a value
+    seq = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # resource, quiz
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_catalog_changes_entity', 'entity_type', 'entity_id'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'type': self.entity_type,
+            'id': self.entity_id,
+            'op': self.op,
+            'changed_at': self.changed_at.isoformat()
+        }
+
 class UserProgress(db.Model):
     __tablename__ = 'user_progress'
     
@@ -111,6 +150,69 @@ class UserProgress(db.Model):
         }
 
 
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    
+    # Maintained by submit_quiz so profile views never aggregate user_progress
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    attempted_count = db.Column(db.Integer, nullable=False, default=0)
+    completed_count = db.Column(db.Integer, nullable=False, default=0)  # passing scores
+    score_total = db.Column(db.Float, nullable=False, default=0)
+    badges = db.Column(db.Text, nullable=False, default='[]')  # JSON list
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'attempted_resources': self.attempted_count,
+            'completed_resources': self.completed_count,
+            'average_score': round(self.score_total / self.attempted_count, 1) if self.attempted_count else 0,
+            'badges': json.loads(self.badges)
+        }
+
+class LeaderboardScore(db.Model):
+    __tablename__ = 'leaderboard_scores'
+    
+    # Sum of the user's latest quiz score per resource
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    total_score = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'total_score': self.total_score,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class LeaderboardEvent(db.Model):
+    __tablename__ = 'leaderboard_events'
+    
+    # Workers replay events after their last seen seq to update in-memory boards
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True)  # NULL means rebuild everything
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = ({'sqlite_autoincrement': True},)
+
+
+class UserLocationEvent(db.Model):
+    __tablename__ = 'user_location_events'
+    
+    # Workers replay events after their last seen seq to update their audience index
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True)  # NULL means rebuild everything
+    op = db.Column(db.String(10), nullable=True)  # insert, update, delete
+    # False when the user's previous location was not loaded at flush time
+    old_known = db.Column(db.Boolean, default=True)
+    old_state = db.Column(db.String(100), nullable=True)
+    old_city = db.Column(db.String(100), nullable=True)
+    new_state = db.Column(db.String(100), nullable=True)
+    new_city = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = ({'sqlite_autoincrement': True},)
+
+
 class Community(db.Model):
     __tablename__ = 'communities'
     
@@ -122,6 +224,10 @@ class Community(db.Model):
     state = db.Column(db.String(100), nullable=False)
     city = db.Column(db.String(100), nullable=False)
     locality = db.Column(db.String(200), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    # Grid cell of (latitude, longitude) for radius queries, see geo.cell_id
+    geo_cell = db.Column(db.Integer, nullable=True, index=True)
     
     # Community settings
     is_public = db.Column(db.Boolean, default=True)
@@ -136,9 +242,11 @@ class Community(db.Model):
     # Relationships
     members = db.relationship('CommunityMember', backref='community', lazy=True, cascade='all, delete-orphan')
     messages = db.relationship('Message', backref='community', lazy=True, cascade='all, delete-orphan')
+    archive_blocks = db.relationship('MessageArchiveBlock', backref='community', lazy=True, cascade='all, delete-orphan')
     alerts = db.relationship('Alert', backref='community', lazy=True)
     
-    def to_dict(self):
+    def to_dict(self, member_count=None):
+        # Pass member_count when it was already counted in SQL to avoid loading every member
         return {
             'id': self.id,
             'name': self.name,
@@ -146,10 +254,12 @@ class Community(db.Model):
             'state': self.state,
             'city': self.city,
             'locality': self.locality,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'is_public': self.is_public,
             'max_members': self.max_members,
             'creator_id': self.creator_id,
-            'member_count': len(self.members),
+            'member_count': len(self.members) if member_count is None else member_count,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
@@ -198,7 +308,13 @@ class Message(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
+    # Keyset pagination of a community's history walks this index
+    __table_args__ = (db.Index('ix_messages_community_id_id', 'community_id', 'id'),)
+    
+    def to_dict(self, sender=None):
+        # Pass the sender's dict when it is already at hand to skip loading it
+        if sender is None and self.sender:
+            sender = self.sender.to_dict()
         return {
             'id': self.id,
             'community_id': self.community_id,
@@ -209,7 +325,39 @@ class Message(db.Model):
             'is_pinned': self.is_pinned,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'sender': self.sender.to_dict() if self.sender else None
+            'sender': sender
+        }
+
+class MessageArchiveBlock(db.Model):
+    __tablename__ = 'message_archive_blocks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    community_id = db.Column(db.Integer, db.ForeignKey('communities.id'), nullable=False)
+    
+    # Range of archived message ids held in this block (inclusive)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    first_created_at = db.Column(db.DateTime, nullable=False)
+    last_created_at = db.Column(db.DateTime, nullable=False)
+    
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON list of messages
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_archive_blocks_community_last_id', 'community_id', 'last_message_id'),)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'community_id': self.community_id,
+            'first_message_id': self.first_message_id,
+            'last_message_id': self.last_message_id,
+            'message_count': self.message_count,
+            'first_created_at': self.first_created_at.isoformat(),
+            'last_created_at': self.last_created_at.isoformat(),
+            'compressed_bytes': len(self.data),
+            'created_at': self.created_at.isoformat()
         }
 
 class Alert(db.Model):
@@ -228,6 +376,12 @@ class Alert(db.Model):
     state = db.Column(db.String(100), nullable=True)
     city = db.Column(db.String(100), nullable=True)
     locality = db.Column(db.String(200), nullable=True)
+    # Optional GeoJSON Polygon/MultiPolygon and its bounding box (see alert_areas.py)
+    area = db.Column(db.Text, nullable=True)
+    bbox_min_lat = db.Column(db.Float, nullable=True)
+    bbox_min_lng = db.Column(db.Float, nullable=True)
+    bbox_max_lat = db.Column(db.Float, nullable=True)
+    bbox_max_lng = db.Column(db.Float, nullable=True)
     
     # Community specific alerts
     community_id = db.Column(db.Integer, db.ForeignKey('communities.id'), nullable=True)
@@ -239,11 +393,27 @@ class Alert(db.Model):
     # Alert status
     is_active = db.Column(db.Boolean, default=True)
     source = db.Column(db.String(100), nullable=True)  # IMD, NDMA, community, etc.
+    # Alerts ingested from CAP feeds (see alert_feeds.py): `sender|identifier` of
+    # the first message in the thread, and the `sent` time of the latest applied
+    external_id = db.Column(db.String(255), nullable=True)
+    external_version = db.Column(db.DateTime, nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
+    # Partial indexes (PostgreSQL/SQLite) so the read path and the expiry
+    # sweeper only touch live rows; other backends get a plain index
+    __table_args__ = (
+        db.Index('ix_alerts_active_location', 'state', 'city', 'issued_at',
+                 postgresql_where=(is_active == True), sqlite_where=(is_active == True)),
+        db.Index('ix_alerts_active_expires', 'expires_at',
+                 postgresql_where=(is_active == True), sqlite_where=(is_active == True)),
+        db.Index('ix_alerts_active_bbox', 'bbox_min_lat', 'bbox_max_lat',
+                 postgresql_where=(is_active == True), sqlite_where=(is_active == True)),
+        db.Index('ix_alerts_external_id', 'external_id', unique=True),
+    )
+    
+    def to_dict(self, include_area=False):
+        data = {
             'id': self.id,
             'title': self.title,
             'message': self.message,
@@ -260,4 +430,113 @@ class Alert(db.Model):
             'source': self.source,
             'created_at': self.created_at.isoformat()
         }
+        # Polygons can run to thousands of vertices; lists leave them out
+        if include_area:
+            data['area'] = json.loads(self.area) if self.area else None
+        return data
+
+
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)  # community_broadcast, alert_audience
+    dedup_key = db.Column(db.String(100), unique=True, nullable=False)
+    community_id = db.Column(db.Integer, db.ForeignKey('communities.id'), nullable=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON string
+    
+    # Delivery state
+    status = db.Column(db.String(20), default='pending', index=True)  # pending, processing, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    cursor = db.Column(db.Integer, default=0)  # last recipient user id delivered
+    delivered_count = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'event_type': self.event_type,
+            'dedup_key': self.dedup_key,
+            'community_id': self.community_id,
+            'payload': json.loads(self.payload),
+            'status': self.status,
+            'attempts': self.attempts,
+            'delivered_count': self.delivered_count,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat(),
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
 
+
+class ProvisioningJob(db.Model):
+    __tablename__ = 'provisioning_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    status = db.Column(db.String(20), default='running', index=True)  # running, done, failed
+    total_rows = db.Column(db.Integer, default=0)
+    processed_rows = db.Column(db.Integer, default=0)
+    created_count = db.Column(db.Integer, default=0)
+    report = db.Column(db.Text, nullable=True)  # JSON, set when the job finishes
+    error = db.Column(db.Text, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self, include_report=False):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'created_count': self.created_count,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+        if include_report:
+            data['report'] = json.loads(self.report) if self.report else None
+        return data
+
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeats'
+
+    # Single row written on the primary; its age on a replica is that replica's lag
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+
+class AlertFeedCheckpoint(db.Model):
+    """Where ingestion of one CAP feed stopped, and which worker is ingesting it"""
+    __tablename__ = 'alert_feed_checkpoints'
+    
+    source = db.Column(db.String(100), primary_key=True)
+    # Last fully written entry: the document's ordering key and the entry's index in it
+    document = db.Column(db.String(500), nullable=True)
+    entry = db.Column(db.Integer, nullable=True)
+    # HTTP validators of the last fetch, for conditional requests
+    etag = db.Column(db.String(255), nullable=True)
+    last_modified = db.Column(db.String(100), nullable=True)
+    
+    entries_total = db.Column(db.Integer, default=0)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'document': self.document,
+            'entry': self.entry,
+            'entries_total': self.entries_total,
+            'ingesting': self.locked_by is not None,
+            'last_error': self.last_error,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
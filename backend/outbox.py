@@ -0,0 +1,277 @@
+"""
+Transactional outbox and background fan-out for community broadcasts.
+
+send_message writes an OutboxEvent in the same commit as an emergency or
+announcement message. A dispatcher thread in each worker claims due events,
+pages through the community's active members by user id and hands them to a
+notification sink in batches. The per-event cursor records the last user id
+delivered, so a retry resumes after the last successful batch instead of
+notifying everyone again.
+
+create_alert writes `alert_audience` events the same way; those are resolved
+from the location index and streamed to AUDIENCE_SINK (see alert_audience.py).
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+import alert_audience
+import metrics
+from database import db
+from models import OutboxEvent, CommunityMember, User, Community
+
+logger = logging.getLogger('vajra.outbox')
+
+OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'true').lower() == 'true'
+OUTBOX_SINK = os.getenv('OUTBOX_SINK', 'file:' + os.path.join(os.path.dirname(__file__), 'instance', 'notifications.ndjson'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '250'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+# An event stuck in `processing` longer than this is assumed orphaned by a dead worker
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '120'))
+
+BROADCAST_MESSAGE_TYPES = ('emergency', 'announcement')
+
+
+def is_broadcast(message):
+    """Whether a message should be pushed to members who are not online"""
+    return bool(message.is_emergency) or message.message_type in BROADCAST_MESSAGE_TYPES
+
+
+def add_broadcast_event(message):
+    """Stage an outbox row for message in the current session (caller commits)"""
+    payload = {
+        'message_id': message.id,
+        'community_id': message.community_id,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'message_type': message.message_type,
+        'is_emergency': bool(message.is_emergency),
+    }
+    event = OutboxEvent(
+        event_type='community_broadcast',
+        dedup_key=f'message:{message.id}',
+        community_id=message.community_id,
+        payload=json.dumps(payload)
+    )
+    db.session.add(event)
+    metrics.incr('outbox.events_enqueued')
+    return event
+
+
+# Sinks
+
+class FileSink:
+    """Append notifications as NDJSON lines (local stand-in for SMS/push)"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def send(self, notifications):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(n) + '\n' for n in notifications))
+
+
+class SocketSink:
+    """Stream notifications as NDJSON to a local unix or TCP socket"""
+
+    def __init__(self, address, family=socket.AF_UNIX):
+        self.address = address
+        self.family = family
+
+    def send(self, notifications):
+        data = ''.join(json.dumps(n) + '\n' for n in notifications).encode('utf-8')
+        with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10)
+            sock.connect(self.address)
+            sock.sendall(data)
+
+
+def build_sink(spec):
+    """Create a sink from a spec like `file:/path`, `unix:/path.sock` or `tcp:host:port`"""
+    kind, _, target = spec.partition(':')
+    if kind == 'file':
+        return FileSink(target)
+    if kind == 'unix':
+        return SocketSink(target)
+    if kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        return SocketSink((host, int(port)), family=socket.AF_INET)
+    raise ValueError(f'Unknown notification sink: {spec}')
+
+
+# Dispatcher
+
+class OutboxDispatcher:
+    """Background thread that drains due outbox events in this process"""
+
+    def __init__(self, app=None, sink=None):
+        self.app = app
+        self.sink = sink
+        self.audience_sink = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        if self.sink is None:
+            self.sink = build_sink(OUTBOX_SINK)
+        if self.audience_sink is None:
+            self.audience_sink = build_sink(alert_audience.AUDIENCE_SINK)
+
+        @app.before_request
+        def start_outbox_dispatcher():
+            self.ensure_started()
+
+    def ensure_started(self):
+        """Start the thread once per process (threads do not survive fork)"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Signal that new events were committed"""
+        self.ensure_started()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(OUTBOX_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while self.dispatch_due():
+                        pass
+            except Exception:
+                logger.exception('outbox_dispatch_error')
+
+    def dispatch_due(self, limit=20):
+        """Claim and deliver up to limit due events; returns how many were claimed"""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        candidate_ids = [row[0] for row in db.session.query(OutboxEvent.id).filter(
+            db.or_(
+                db.and_(OutboxEvent.status == 'pending', OutboxEvent.next_attempt_at <= now),
+                db.and_(OutboxEvent.status == 'processing', OutboxEvent.locked_at < stale)
+            )
+        ).order_by(OutboxEvent.id).limit(limit).all()]
+
+        claimed = 0
+        for event_id in candidate_ids:
+            if self._claim(event_id, now, stale):
+                claimed += 1
+                self._deliver(db.session.get(OutboxEvent, event_id))
+        return claimed
+
+    def _claim(self, event_id, now, stale):
+        # Conditional UPDATE so only one worker wins each event
+        result = db.session.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id == event_id)
+            .where(db.or_(
+                OutboxEvent.status == 'pending',
+                db.and_(OutboxEvent.status == 'processing', OutboxEvent.locked_at < stale)
+            ))
+            .values(status='processing', locked_at=now)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _send_broadcast(self, event, payload):
+        """Page the community's active members after event.cursor into the sink; returns how many were sent"""
+        sent = 0
+        community_name = db.session.query(Community.name).filter_by(id=event.community_id).scalar()
+        while True:
+            recipients = db.session.query(
+                CommunityMember.user_id, User.username, User.phone_number
+            ).join(User, User.id == CommunityMember.user_id).filter(
+                CommunityMember.community_id == event.community_id,
+                CommunityMember.status == 'active',
+                CommunityMember.user_id != payload['sender_id'],
+                CommunityMember.user_id > (event.cursor or 0)
+            ).order_by(CommunityMember.user_id).limit(OUTBOX_BATCH_SIZE).all()
+
+            if not recipients:
+                break
+
+            self.sink.send([
+                {
+                    'notification_id': f'{event.id}:{user_id}',
+                    'user_id': user_id,
+                    'username': username,
+                    'phone_number': phone_number,
+                    'community_name': community_name,
+                    **payload
+                }
+                for user_id, username, phone_number in recipients
+            ])
+
+            # Advance the cursor after every batch so a retry skips it
+            event.cursor = recipients[-1][0]
+            event.delivered_count = (event.delivered_count or 0) + len(recipients)
+            event.locked_at = datetime.utcnow()
+            db.session.commit()
+            sent += len(recipients)
+            metrics.incr('outbox.batches_sent')
+            metrics.incr('outbox.notifications_sent', len(recipients))
+        return sent
+
+    def _deliver(self, event):
+        payload = json.loads(event.payload)
+        started = time.monotonic()
+        sent = 0
+        try:
+            if event.event_type == 'alert_audience':
+                sent = alert_audience.deliver(event, payload, self.audience_sink)
+            else:
+                sent = self._send_broadcast(event, payload)
+
+            event.status = 'done'
+            event.processed_at = datetime.utcnow()
+            event.last_error = None
+            db.session.commit()
+            metrics.incr('outbox.events_delivered')
+        except Exception as e:
+            db.session.rollback()
+            event.attempts = (event.attempts or 0) + 1
+            event.last_error = str(e)[:1000]
+            if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                event.status = 'failed'
+                metrics.incr('outbox.events_failed')
+            else:
+                event.status = 'pending'
+                event.next_attempt_at = datetime.utcnow() + timedelta(seconds=2 ** event.attempts)
+                metrics.incr('outbox.retries')
+            db.session.commit()
+            logger.warning('outbox_delivery_failed', extra={
+                'event_id': event.id, 'attempts': event.attempts, 'error': event.last_error
+            })
+        finally:
+            elapsed = time.monotonic() - started
+            if sent and elapsed > 0:
+                metrics.set_gauge('outbox.last_throughput_per_sec', round(sent / elapsed, 1))
+
+
+dispatcher = OutboxDispatcher()
+
+
+def init_outbox(app):
+    """Attach the dispatcher to the app when the outbox is enabled"""
+    if OUTBOX_ENABLED:
+        dispatcher.init_app(app)
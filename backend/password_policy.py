@@ -0,0 +1,27 @@
+"""
+Password rules shared by change-password and bulk user provisioning.
+"""
+
+import secrets
+
+PASSWORD_MIN_LENGTH = 8
+
+
+def password_problem(password):
+    """What the password is missing, worded to follow 'password', or None if it is acceptable"""
+    if len(password) < PASSWORD_MIN_LENGTH:
+        return f'must be at least {PASSWORD_MIN_LENGTH} characters long'
+    has_upper = any(c.isupper() for c in password)
+    has_lower = any(c.islower() for c in password)
+    has_digit = any(c.isdigit() for c in password)
+    if not (has_upper and has_lower and has_digit):
+        return 'must contain at least one uppercase letter, one lowercase letter, and one digit'
+    return None
+
+
+def generate_password():
+    """Random password that satisfies password_problem()"""
+    while True:
+        password = secrets.token_urlsafe(9)
+        if password_problem(password) is None:
+            return password
@@ -0,0 +1,201 @@
+"""
+Token-bucket rate limiting shared by all gunicorn workers.
+
+Buckets live in a small SQLite database in WAL mode (separate from the main
+database, durability off) so every worker on the host sees the same counts.
+Each limited route has per-IP and/or per-user buckets that return 429, and
+optionally a `global` bucket that acts as admission control for the whole
+host and returns 503 once the route's capacity is used up. Both responses
+carry Retry-After.
+
+Limits are "capacity/seconds" and can be overridden per route and scope:
+    RATE_LIMITS="login.ip=30/60;send_message.user=60/60;signup.global=off"
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import time
+from functools import wraps
+
+from flask import jsonify, request
+from flask_jwt_extended import get_jwt_identity
+
+import metrics
+from local_store import LocalStore
+
+logger = logging.getLogger('vajra.rate_limit')
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', os.path.join(os.path.dirname(__file__), 'instance', 'ratelimit.db'))
+# Number of reverse proxies in front of the app that append to X-Forwarded-For
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
+RATE_LIMIT_PRUNE_INTERVAL = int(os.getenv('RATE_LIMIT_PRUNE_INTERVAL', '3600'))
+
+DEFAULT_LIMITS = {
+    'login': {'ip': '20/60', 'user': '10/60', 'global': '50/1'},
+    'signup': {'ip': '5/300', 'global': '20/1'},
+    'change_password': {'ip': '20/300', 'user': '5/300'},
+    'send_message': {'ip': '120/60', 'user': '30/60'},
+    'create_alert': {'ip': '30/60', 'user': '10/60'},
+}
+
+
+def _parse_limit(value):
+    """'capacity/seconds' -> (capacity, tokens per second), or None when disabled"""
+    if value is None or value.strip().lower() in ('', '0', 'off'):
+        return None
+    capacity, seconds = value.split('/')
+    capacity, seconds = float(capacity), float(seconds)
+    if capacity <= 0 or seconds <= 0:
+        return None
+    return capacity, capacity / seconds
+
+
+def load_limits(overrides=None):
+    limits = {name: dict(scopes) for name, scopes in DEFAULT_LIMITS.items()}
+    for item in (overrides or '').split(';'):
+        if not item.strip():
+            continue
+        target, value = item.split('=', 1)
+        name, scope = target.strip().split('.', 1)
+        limits.setdefault(name, {})[scope] = value.strip()
+    return {
+        name: {scope: parsed for scope, value in scopes.items() if (parsed := _parse_limit(value))}
+        for name, scopes in limits.items()
+    }
+
+
+LIMITS = load_limits(os.getenv('RATE_LIMITS'))
+
+
+class BucketStore(LocalStore):
+    """Token buckets keyed by route, scope and subject"""
+
+    def __init__(self, path):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS buckets '
+            '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID',
+        ))
+
+    def acquire(self, buckets, now=None):
+        """
+        Take one token from every (key, capacity, rate) bucket, or from none.
+
+        Returns (None, 0) when allowed, else (index of the first exhausted
+        bucket, seconds until it has a token).
+        """
+        now = time.time() if now is None else now
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                levels.append(tokens)
+
+            for index, ((key, capacity, rate), tokens) in enumerate(zip(buckets, levels)):
+                if tokens < 1:
+                    conn.execute('ROLLBACK')
+                    return index, max(1, math.ceil((1 - tokens) / rate))
+
+            conn.executemany(
+                'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                [(key, tokens - 1, now) for (key, _, _), tokens in zip(buckets, levels)]
+            )
+            conn.execute('COMMIT')
+            return None, 0
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def prune(self, idle_seconds=86400):
+        """Drop buckets untouched for idle_seconds (they would be full again anyway)"""
+        conn = self.connection()
+        cursor = conn.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - idle_seconds,))
+        return cursor.rowcount
+
+
+store = BucketStore(RATE_LIMIT_DB)
+
+
+def client_ip():
+    """Client address, taken from X-Forwarded-For only as far as TRUSTED_PROXIES allows"""
+    forwarded = request.headers.get('X-Forwarded-For')
+    if TRUSTED_PROXIES and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if len(hops) >= TRUSTED_PROXIES:
+            return hops[-TRUSTED_PROXIES]
+    return request.remote_addr or 'unknown'
+
+
+def _user_key(name):
+    if name == 'login':
+        # Not authenticated yet: limit attempts per account name instead
+        data = request.get_json(silent=True) or {}
+        username = data.get('username')
+        return username.strip().lower() if isinstance(username, str) and username.strip() else None
+    try:
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def _too_many(scope, retry_after):
+    if scope == 'global':
+        response = jsonify({'error': 'Server is busy, please retry later', 'retry_after': retry_after})
+        response.status_code = 503
+    else:
+        response = jsonify({'error': 'Too many requests, please retry later', 'retry_after': retry_after})
+        response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limited(name):
+    """Apply the LIMITS entry for name; place below @jwt_required() so the user is known"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            limits = LIMITS.get(name)
+            if not RATE_LIMIT_ENABLED or not limits:
+                return fn(*args, **kwargs)
+
+            buckets, scopes = [], []
+            for scope, (capacity, rate) in limits.items():
+                if scope == 'ip':
+                    subject = client_ip()
+                elif scope == 'user':
+                    subject = _user_key(name)
+                elif scope == 'global':
+                    subject = '*'
+                else:
+                    continue
+                if subject is None:
+                    continue
+                buckets.append((f'{name}:{scope}:{subject}', capacity, rate))
+                scopes.append(scope)
+
+            try:
+                blocked, retry_after = store.acquire(buckets)
+            except sqlite3.Error:
+                # Fail open: a broken limiter must not take the API down with it
+                metrics.incr('rate_limit.errors')
+                logger.exception('rate_limit_store_failed', extra={'rate_key': 'rate_limit_store_failed'})
+                return fn(*args, **kwargs)
+
+            if blocked is not None:
+                metrics.incr(f'rate_limit.{name}.limited.{scopes[blocked]}')
+                return _too_many(scopes[blocked], retry_after)
+            metrics.incr(f'rate_limit.{name}.allowed')
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def prune_buckets():
+    return store.prune()
@@ -0,0 +1,315 @@
+"""
+Response cache for hot GET endpoints, shared by all gunicorn workers.
+
+Two tiers: a small LRU in each worker and a host-local SQLite file (see
+local_store.py) that every worker reads and fills, so a response computed by
+one worker is served by the others. Entries are keyed by endpoint, path,
+query string and whatever part of the caller the response depends on, and
+carry tags such as `resource:*`, `community:<id>` or `alerts:<state>`.
+
+Invalidation bumps a per-tag version in the shared file; an entry whose tag
+versions are behind is ignored by both tiers. Concurrent misses for the same
+key are coalesced into one computation (see single_flight.py). Tags are bumped after every
+commit that touches a tagged model (collected at flush, like catalog_sync),
+so the write routes invalidate without calling the cache themselves. Bulk
+UPDATEs bypass the flush and must call invalidate() directly. Every entry
+also expires after its TTL as a safety net.
+
+Hit ratios are published per cache as response_cache.<name>.hit_ratio.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import metrics
+import single_flight
+from db_routing import REPLICA_MAX_LAG_SECONDS
+from local_store import LocalStore
+from models import Alert, Community, CommunityMember, Quiz, Resource
+
+logger = logging.getLogger('vajra.response_cache')
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() != 'false'
+RESPONSE_CACHE_DB = os.getenv('RESPONSE_CACHE_DB', os.path.join(os.path.dirname(__file__), 'instance', 'response_cache.db'))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '60'))
+# Entries kept in each worker's LRU
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '512'))
+
+# Bumped by every alert change: entries for callers whose alerts are not filtered by state
+ALERTS_UNFILTERED = 'alerts:unfiltered'
+
+
+class TaggedStore(LocalStore):
+    """Cached responses and the current version of every tag"""
+
+    def __init__(self, path):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, status INTEGER NOT NULL, '
+            'body BLOB NOT NULL, content_type TEXT, tags TEXT NOT NULL, expires REAL NOT NULL) WITHOUT ROWID',
+            'CREATE TABLE IF NOT EXISTS tag_versions '
+            '(tag TEXT PRIMARY KEY, version INTEGER NOT NULL, bumped_at REAL NOT NULL) WITHOUT ROWID',
+        ))
+
+    def versions(self, tags):
+        """{tag: (version, bumped_at)} for tags, (0, 0) for tags never bumped"""
+        tags = list(tags)
+        found = {}
+        if tags:
+            placeholders = ','.join('?' * len(tags))
+            found = {
+                tag: (version, bumped_at) for tag, version, bumped_at in self.connection().execute(
+                    f'SELECT tag, version, bumped_at FROM tag_versions WHERE tag IN ({placeholders})', tags
+                )
+            }
+        return {tag: found.get(tag, (0, 0.0)) for tag in tags}
+
+    def bump(self, tags, now=None):
+        now = time.time() if now is None else now
+        self.connection().executemany(
+            'INSERT INTO tag_versions (tag, version, bumped_at) VALUES (?, 1, ?) '
+            'ON CONFLICT(tag) DO UPDATE SET version = version + 1, bumped_at = excluded.bumped_at',
+            [(tag, now) for tag in tags]
+        )
+
+    def get(self, key, now=None):
+        now = time.time() if now is None else now
+        row = self.connection().execute(
+            'SELECT status, body, content_type, tags, expires FROM entries WHERE key = ? AND expires > ?',
+            (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3]), row[4]
+
+    def put(self, key, entry):
+        status, body, content_type, tags, expires = entry
+        self.connection().execute(
+            'INSERT OR REPLACE INTO entries (key, status, body, content_type, tags, expires) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, status, body, content_type, json.dumps(tags), expires)
+        )
+
+    def prune(self):
+        cursor = self.connection().execute('DELETE FROM entries WHERE expires < ?', (time.time(),))
+        return cursor.rowcount
+
+
+store = TaggedStore(RESPONSE_CACHE_DB)
+
+# Per-worker tier: key -> (status, body, content_type, {tag: version}, expires)
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _local_get(key):
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is not None:
+            _local.move_to_end(key)
+        return entry
+
+
+def _local_put(key, entry):
+    with _local_lock:
+        _local[key] = entry
+        _local.move_to_end(key)
+        while len(_local) > RESPONSE_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def _local_discard(key):
+    with _local_lock:
+        _local.pop(key, None)
+
+
+def _is_current(entry, now):
+    tags = entry[3]
+    return entry[4] > now and all(
+        version == tags[tag] for tag, (version, _) in store.versions(tags).items()
+    )
+
+
+def invalidate(tags):
+    """Make every entry carrying any of tags stale, in all workers"""
+    tags = sorted(set(tags))
+    if not tags or not RESPONSE_CACHE_ENABLED:
+        return
+    try:
+        store.bump(tags)
+        metrics.incr('response_cache.invalidations', len(tags))
+    except sqlite3.Error:
+        metrics.incr('response_cache.errors')
+        logger.exception('response_cache_store_failed', extra={'rate_key': 'response_cache_store_failed'})
+
+
+def add_tags(tags):
+    """Tag the response being computed with tags only known inside the handler"""
+    g.setdefault('response_cache_tags', set()).update(tags)
+
+
+def _record(name, outcome):
+    metrics.incr(f'response_cache.{name}.{outcome}')
+    hits = sum(metrics.get(f'response_cache.{name}.hits.{tier}') for tier in ('local', 'shared', 'coalesced'))
+    total = hits + metrics.get(f'response_cache.{name}.misses')
+    metrics.set_gauge(f'response_cache.{name}.hit_ratio', round(hits / total, 4))
+
+
+def _replay(entry, source):
+    status, body, content_type = entry[:3]
+    response = make_response(body, status)
+    response.content_type = content_type
+    response.headers['X-Cache'] = source
+    return response
+
+
+def cached(name, tags=None, vary=None, ttl=RESPONSE_CACHE_TTL):
+    """
+    Cache 200 responses of a GET handler; place below @jwt_required().
+
+    tags() and vary() are called before the handler: tags returns the tags
+    the response depends on, vary returns the part of the caller that changes
+    the response (e.g. their state), or None when it does not depend on them.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not RESPONSE_CACHE_ENABLED or request.method != 'GET':
+                return fn(*args, **kwargs)
+
+            query = '&'.join(sorted(request.query_string.decode('utf-8', 'replace').split('&')))
+            key = f'{name}|{request.path}|{query}|{vary() if vary else ""}'
+            now = time.time()
+            try:
+                entry = _local_get(key)
+                if entry is not None:
+                    if _is_current(entry, now):
+                        _record(name, 'hits.local')
+                        return _replay(entry, 'HIT')
+                    _local_discard(key)
+
+                entry = store.get(key, now)
+                if entry is not None and _is_current(entry, now):
+                    _local_put(key, entry)
+                    _record(name, 'hits.shared')
+                    return _replay(entry, 'HIT')
+
+                # Read versions before computing, so a write that commits meanwhile makes this entry stale
+                static_tags = set(tags() if tags else ())
+                versions = store.versions(static_tags)
+            except sqlite3.Error:
+                metrics.incr('response_cache.errors')
+                logger.exception('response_cache_store_failed', extra={'rate_key': 'response_cache_store_failed'})
+                return fn(*args, **kwargs)
+
+            _record(name, 'misses')
+            computed = []
+
+            def compute():
+                g.response_cache_tags = set()
+                response = make_response(fn(*args, **kwargs))
+                response.headers['X-Cache'] = 'MISS'
+                computed.append(response)
+                if response.status_code != 200:
+                    return None
+                try:
+                    versions.update(store.versions(g.response_cache_tags - static_tags))
+                    entry = (
+                        response.status_code, response.get_data(), response.content_type,
+                        {tag: version for tag, (version, _) in versions.items()}, now + ttl
+                    )
+                    # A replica may not have caught up with a recent invalidation yet
+                    if g.get('db_read_engine') is not None and any(
+                        bumped_at > now - REPLICA_MAX_LAG_SECONDS for _, bumped_at in versions.values()
+                    ):
+                        metrics.incr(f'response_cache.{name}.skipped_replica')
+                        return entry  # fine for the requests waiting on this one, not for later ones
+                    store.put(key, entry)
+                    _local_put(key, entry)
+                    return entry
+                except sqlite3.Error:
+                    metrics.incr('response_cache.errors')
+                    logger.exception('response_cache_store_failed', extra={'rate_key': 'response_cache_store_failed'})
+                    return None
+
+            def poll():
+                entry = store.get(key)
+                return entry if entry is not None and _is_current(entry, time.time()) else None
+
+            # Identical requests arriving together share one computation (see single_flight.py)
+            entry, _ = single_flight.do(key, compute, poll)
+            if computed:
+                return computed[0]
+            try:
+                current = _is_current(entry, time.time())
+            except sqlite3.Error:
+                current = False
+            if not current:
+                # Invalidated while the leader was computing: this request may need to see that write
+                compute()
+                return computed[0]
+            _record(name, 'hits.coalesced')
+            return _replay(entry, 'HIT')
+        return wrapper
+    return decorator
+
+
+def alert_tags(alert):
+    tags = {ALERTS_UNFILTERED}
+    # Polygon alerts reach users by coordinates, whatever their state
+    tags.add(f'alerts:{alert.state}' if alert.state and alert.area is None else 'alerts:*')
+    if alert.community_id is not None:
+        tags.add(f'community:{alert.community_id}')
+    return tags
+
+
+def tags_for(obj):
+    """Cache tags a change to obj invalidates"""
+    if isinstance(obj, (Resource, Quiz)):
+        return {'resource:*'}
+    if isinstance(obj, Community):
+        return {f'community:{obj.id}', f'communities:{obj.state}', 'communities:*'}
+    if isinstance(obj, CommunityMember):
+        return {f'community:{obj.community_id}'}
+    if isinstance(obj, Alert):
+        return alert_tags(obj)
+    # User and membership changes reach cached alert lists through their vary key
+    return set()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    tags = session.info.setdefault('response_cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags |= tags_for(obj)
+
+
+@event.listens_for(Session, 'before_commit')
+def _collect_catalog_tags(session):
+    # Catalog rows written without the ORM are still recorded through catalog_sync
+    if session.info.get('catalog_changed'):
+        session.info.setdefault('response_cache_tags', set()).add('resource:*')
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    tags = session.info.pop('response_cache_tags', None)
+    if tags:
+        invalidate(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_tags(session):
+    session.info.pop('response_cache_tags', None)
+
+
+def prune_entries():
+    return store.prune()
@@ -1,17 +1,39 @@
 import os
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, Response, stream_with_context, send_from_directory, url_for, current_app
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from database import db
-from models import User, Resource, Quiz, UserProgress, Community, CommunityMember, Message, Alert
+from models import User, Resource, Quiz, UserProgress, Community, CommunityMember, Message, Alert, ProvisioningJob, AlertFeedCheckpoint
+import outbox
+import group_commit
+from alert_sweeper import active_alert_filter
+from message_archive import read_history
+import catalog_io
+import catalog_sync
+import catalog_bundle
+import leaderboard
+import user_stats
+import geo
+import alert_areas
+import alert_audience
+import alert_feeds
+import regional_analytics
+import user_provisioning
+from rate_limit import rate_limited
+from idempotency import idempotent
+import response_cache
+from response_cache import cached
+from fieldsets import FieldsetError, RESOURCE_FIELDS, QUIZ_FIELDS, COMMUNITY_FIELDS, ALERT_FIELDS, USER_FIELDS, member_counts, quiz_counts
+from password_policy import password_problem
 import json
 from functools import wraps
 import logging
 
-# Configure logging to a file
-logging.basicConfig(filename=os.path.join(os.path.dirname(__file__), 'backend_login_debug.log'), level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+auth_logger = logging.getLogger('vajra.auth')
+
+# Fraction of successful logins that are logged (failures are always logged, rate-limited)
+LOGIN_LOG_SAMPLE_RATE = float(os.getenv('LOGIN_LOG_SAMPLE_RATE', '0.1'))
 
 # Create blueprints
 auth_bp = Blueprint('auth', __name__)
@@ -50,6 +72,7 @@ def admin_required(fn):
 
 # Authentication routes
 @auth_bp.route('/signup', methods=['POST'])
+@rate_limited('signup')
 def signup():
     try:
         data = request.get_json()
@@ -65,13 +88,23 @@ def signup():
         if User.query.filter_by(email=data['email']).first():
             return jsonify({'error': 'Email already exists'}), 400
         
+        # Location is optional; coordinates come from the request or the gazetteer
+        try:
+            coords = geo.resolve_location(data, data.get('state'), data.get('city'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Create new user
         password_hash = generate_password_hash(data['password'])
         new_user = User(
             username=data['username'],
             email=data['email'],
-            password_hash=password_hash
+            password_hash=password_hash,
+            state=data.get('state'),
+            city=data.get('city'),
+            locality=data.get('locality')
         )
+        geo.set_coordinates(new_user, coords)
         
         db.session.add(new_user)
         db.session.commit()
@@ -82,65 +115,142 @@ def signup():
         return jsonify({
             'message': 'User created successfully',
             'access_token': access_token,
-            'user': new_user.to_dict()
+            'user': new_user.to_dict(include_coordinates=True)
         }), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limited('login')
 def login():
     try:
         data = request.get_json()
-        logging.info(f"Login attempt: {data}")
         
         if not data or not data.get('username') or not data.get('password'):
             return jsonify({'error': 'Username and password are required'}), 400
         
         # Find user
         user = User.query.filter_by(username=data['username']).first()
-        logging.info(f"User found: {user}")
         
-        if user:
-            password_check = check_password_hash(user.password_hash, data['password'])
-            logging.info(f"Password check result: {password_check}")
-
         if not user or not check_password_hash(user.password_hash, data['password']):
+            auth_logger.info('login_failed', extra={
+                'username': data['username'],
+                'reason': 'unknown_user' if not user else 'bad_password',
+                'remote_addr': request.remote_addr,
+            })
             return jsonify({'error': 'Invalid username or password'}), 401
         
+        auth_logger.info('login_succeeded', extra={
+            'user_id': user.id,
+            'sample_rate': LOGIN_LOG_SAMPLE_RATE,
+        })
+        
         # Create access token (convert user ID to string for JWT compatibility)
         access_token = create_access_token(identity=str(user.id))
         
         return jsonify({
             'message': 'Login successful',
             'access_token': access_token,
-            'user': user.to_dict()
+            'user': user.to_dict(include_coordinates=True)
         }), 200
         
     except Exception as e:
-        logging.error(f"Error in login: {e}")
+        auth_logger.exception('login_error')
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/me', methods=['GET'])
+@jwt_required()
+def get_current_user():
+    try:
+        user_id = int(get_jwt_identity())
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        stats = user_stats.get_stats(user_id)
+        
+        return jsonify({
+            'user': user.to_dict(include_coordinates=True),
+            'stats': stats.to_dict()
+        }), 200
+        
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid user identity in token'}), 401
+    except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Resource routes
 @resources_bp.route('/resources', methods=['GET'])
+@cached('resources', tags=lambda: ['resource:*'])
 def get_resources():
     try:
         category = request.args.get('category')
+        fields = RESOURCE_FIELDS.parse(request.args.get('fields'))
         
+        query = RESOURCE_FIELDS.apply(Resource.query, fields)
         if category:
-            resources = Resource.query.filter_by(category=category).all()
-        else:
-            resources = Resource.query.all()
+            query = query.filter_by(category=category)
+        resources = query.all()
         
         return jsonify({
-            'resources': [resource.to_dict() for resource in resources],
+            'resources': RESOURCE_FIELDS.serialize(resources, fields),
             'count': len(resources)
         }), 200
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@resources_bp.route('/resources/changes', methods=['GET'])
+def get_resource_changes():
+    try:
+        since = request.args.get('since', 0, type=int)
+        limit = request.args.get('limit', catalog_sync.MAX_CHANGES_PER_PAGE, type=int)
+        
+        if since < 0:
+            return jsonify({'error': 'since must be a non-negative sequence number'}), 400
+        
+        return jsonify(catalog_sync.changes_since(since, limit)), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@resources_bp.route('/catalog/bundle', methods=['GET'])
+def get_catalog_bundle_manifest():
+    try:
+        manifest = catalog_bundle.read_manifest()
+        if manifest is None:
+            manifest = catalog_bundle.build_bundle()
+        
+        response = jsonify({
+            **manifest,
+            'url': url_for('resources.get_catalog_bundle_file', filename=manifest['file'])
+        })
+        # The manifest is the only mutable piece; clients revalidate it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@resources_bp.route('/catalog/bundle/<path:filename>', methods=['GET'])
+def get_catalog_bundle_file(filename):
+    if not filename.startswith('catalog-') or not filename.endswith('.json.gz'):
+        return jsonify({'error': 'Bundle not found'}), 404
+    
+    # Content-addressed file: served via sendfile and cached forever
+    response = send_from_directory(
+        catalog_bundle.BUNDLE_DIR, filename,
+        mimetype='application/json', max_age=31536000, etag=filename
+    )
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @resources_bp.route('/resources/<int:resource_id>', methods=['GET'])
+@cached('resource', tags=lambda: ['resource:*'])
 def get_resource(resource_id):
     try:
         resource = Resource.query.get(resource_id)
@@ -239,9 +349,61 @@ def delete_resource(resource_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Admin catalog import/export
+@resources_bp.route('/admin/catalog/export', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_catalog():
+    try:
+        fmt = request.args.get('format', 'ndjson')
+        kind = request.args.get('type', 'all' if fmt == 'ndjson' else 'resources')
+        
+        if fmt == 'ndjson':
+            chunks = catalog_io.export_ndjson(kind)
+            mimetype = 'application/x-ndjson'
+        elif fmt == 'csv':
+            chunks = catalog_io.export_csv(kind)
+            mimetype = 'text/csv'
+        else:
+            return jsonify({'error': 'format must be ndjson or csv'}), 400
+        
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=catalog-{kind}.{fmt}'
+        return response
+        
+    except catalog_io.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@resources_bp.route('/admin/catalog/import', methods=['POST'])
+@jwt_required()
+@admin_required
+def import_catalog():
+    try:
+        fmt = request.args.get('format', 'ndjson')
+        kind = request.args.get('type', 'all' if fmt == 'ndjson' else 'resources')
+        dry_run = request.args.get('dry_run', 'false').lower() in ('1', 'true', 'yes')
+        
+        # Accept a multipart upload (field "file") or the raw request body
+        upload = request.files.get('file')
+        # Decoded line by line in catalog_io, so invalid UTF-8 is reported against its line
+        stream = upload.stream if upload else request.stream
+        
+        report = catalog_io.import_catalog(stream, fmt=fmt, kind=kind, dry_run=dry_run)
+        status = 200 if report['error_count'] == 0 else 207
+        return jsonify(report), status
+        
+    except catalog_io.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 # Quiz routes
 @quiz_bp.route('/quiz/submit', methods=['POST'])
 @jwt_required()
+@idempotent
 def submit_quiz():
     try:
         user_id_str = get_jwt_identity()
@@ -275,6 +437,7 @@ def submit_quiz():
         
         # Save or update user progress
         progress = UserProgress.query.filter_by(user_id=user_id, resource_id=resource_id).first()
+        previous_score = progress.quiz_score if progress else None
         
         if progress:
             progress.quiz_score = score
@@ -287,56 +450,71 @@ def submit_quiz():
             )
             db.session.add(progress)
         
+        leaderboard.record_score_change(user_id, previous_score, score)
+        user_stats.record_quiz_result(user_id, previous_score, score)
         db.session.commit()
         
         return jsonify({
             'score': score,
             'correct_answers': correct_answers,
             'total_questions': total_questions,
-            'passed': score >= 70,  # 70% passing grade
+            'passed': score >= user_stats.PASSING_SCORE,
             'progress': progress.to_dict()
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _admin_quiz_listing():
+    """Page of quizzes with answers; resources go in a side map keyed by id, not into every quiz"""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    resource_id = request.args.get('resource_id', type=int)
+    fields = QUIZ_FIELDS.parse(request.args.get('fields'))
+    
+    query = QUIZ_FIELDS.apply(Quiz.query, fields).options(db.joinedload(Quiz.resource))
+    
+    if resource_id:
+        query = query.filter_by(resource_id=resource_id)
+    
+    quizzes = query.order_by(Quiz.created_at.desc()).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+    
+    if fields is None:
+        quiz_data = [quiz.to_dict_with_answer() for quiz in quizzes.items]
+    else:
+        quiz_data = QUIZ_FIELDS.serialize(quizzes.items, fields)
+    
+    # Each resource once, with quiz counts from one grouped query
+    resources = {quiz.resource.id: quiz.resource for quiz in quizzes.items if quiz.resource}
+    counts = quiz_counts(list(resources)) if resources else {}
+    
+    return jsonify({
+        'quizzes': quiz_data,
+        'resources': {
+            str(rid): resource.to_dict(quiz_count=counts.get(rid, 0))
+            for rid, resource in resources.items()
+        },
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': quizzes.total,
+            'pages': quizzes.pages,
+            'has_next': quizzes.has_next,
+            'has_prev': quizzes.has_prev
+        }
+    }), 200
+
 @quiz_bp.route('/quizzes', methods=['GET'])
 @jwt_required()
 @admin_required
 def get_quizzes():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        resource_id = request.args.get('resource_id', type=int)
-        
-        query = Quiz.query
-        
-        if resource_id:
-            query = query.filter_by(resource_id=resource_id)
-        
-        quizzes = query.order_by(Quiz.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        # Include resource information
-        quiz_data = []
-        for quiz in quizzes.items:
-            quiz_dict = quiz.to_dict_with_answer()
-            quiz_dict['resource'] = quiz.resource.to_dict() if quiz.resource else None
-            quiz_data.append(quiz_dict)
-        
-        return jsonify({
-            'quizzes': quiz_data,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': quizzes.total,
-                'pages': quizzes.pages,
-                'has_next': quizzes.has_next,
-                'has_prev': quizzes.has_prev
-            }
-        }), 200
+        return _admin_quiz_listing()
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -416,6 +594,57 @@ def delete_quiz(quiz_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Leaderboard routes
+@quiz_bp.route('/leaderboards/<scope>', methods=['GET'])
+@jwt_required()
+def get_leaderboard(scope):
+    try:
+        user_id_str = get_jwt_identity()
+        user_id = int(user_id_str)
+        
+        if scope not in leaderboard.SCOPES:
+            return jsonify({'error': f"Scope must be one of {', '.join(leaderboard.SCOPES)}"}), 400
+        
+        limit = min(max(request.args.get('limit', 10, type=int), 1), leaderboard.LEADERBOARD_MAX_LIMIT)
+        user = User.query.get(user_id)
+        
+        # Default to the current user's own state/city
+        if scope == 'community':
+            community_id = request.args.get('community_id', type=int)
+            if not community_id:
+                return jsonify({'error': 'community_id is required'}), 400
+            community, membership, error = community_access(community_id, user_id)
+            if error:
+                return error
+            board = ('community', community_id)
+        else:
+            state = request.args.get('state', user.state if user else None)
+            city = request.args.get('city', user.city if user else None)
+            if not state or (scope == 'city' and not city):
+                return jsonify({'error': 'state (and city for city boards) is required'}), 400
+            board = ('state', state) if scope == 'state' else ('city', state, city)
+        
+        leaderboard.index.sync()
+        top, total = leaderboard.index.top(board, limit)
+        usernames = dict(db.session.query(User.id, User.username).filter(
+            User.id.in_([uid for uid, _ in top])
+        ).all()) if top else {}
+        me = leaderboard.index.rank_of(board, user_id)
+        
+        return jsonify({
+            'scope': scope,
+            'board': list(board[1:]),
+            'total_participants': total,
+            'top': [
+                {'rank': position, 'user_id': uid, 'username': usernames.get(uid), 'score': round(score, 1)}
+                for position, (uid, score) in enumerate(top, start=1)
+            ],
+            'me': {'rank': me[0], 'score': round(me[1], 1)} if me else None
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # User routes
 @user_bp.route('/user/<int:user_id>', methods=['GET'])
 @jwt_required()
@@ -432,32 +661,26 @@ def get_user_profile(user_id):
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get user progress
-        progress = UserProgress.query.filter_by(user_id=user_id).all()
+        stats = user_stats.get_stats(user_id)
         
-        # Calculate badges/achievements
-        badges = []
-        completed_resources = len([p for p in progress if p.quiz_score and p.quiz_score >= 70])
+        response = {
+            'user': user.to_dict(include_coordinates=True),
+            **stats.to_dict()
+        }
         
-        if completed_resources >= 1:
-            badges.append("First Steps")
-        if completed_resources >= 3:
-            badges.append("Safety Aware")
-        if completed_resources >= 5:
-            badges.append("Emergency Expert")
+        # The full progress history is only loaded on request (?include=progress)
+        if 'progress' in request.args.get('include', '').split(','):
+            progress = UserProgress.query.filter_by(user_id=user_id).all()
+            response['progress'] = [p.to_dict() for p in progress]
         
-        return jsonify({
-            'user': user.to_dict(),
-            'progress': [p.to_dict() for p in progress],
-            'badges': badges,
-            'completed_resources': completed_resources
-        }), 200
+        return jsonify(response), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @user_bp.route('/user/change-password', methods=['POST'])
 @jwt_required()
+@rate_limited('change_password')
 def change_password():
     try:
         user_id_str = get_jwt_identity()
@@ -477,18 +700,9 @@ def change_password():
         
         # Validate new password strength
         new_password = data['new_password']
-        if len(new_password) < 8:
-            return jsonify({'error': 'New password must be at least 8 characters long'}), 400
-        
-        # Check for password complexity (optional but recommended)
-        has_upper = any(c.isupper() for c in new_password)
-        has_lower = any(c.islower() for c in new_password)
-        has_digit = any(c.isdigit() for c in new_password)
-        
-        if not (has_upper and has_lower and has_digit):
-            return jsonify({
-                'error': 'New password must contain at least one uppercase letter, one lowercase letter, and one digit'
-            }), 400
+        problem = password_problem(new_password)
+        if problem:
+            return jsonify({'error': f'New password {problem}'}), 400
         
         # Update password
         user.password_hash = generate_password_hash(new_password)
@@ -502,21 +716,30 @@ def change_password():
         return jsonify({'error': str(e)}), 500
 
 # Community routes
+def _community_scope():
+    """(state, city) a community listing is filtered by: query args, else the caller's own"""
+    user = db.session.get(User, int(get_jwt_identity()))
+    return (
+        request.args.get('state', user.state if user else None),
+        request.args.get('city', user.city if user else None)
+    )
+
+def _community_listing_tags():
+    state = _community_scope()[0]
+    return [f'communities:{state}' if state else 'communities:*']
+
 @community_bp.route('/communities', methods=['GET'])
 @jwt_required()
+@cached('communities', tags=_community_listing_tags, vary=lambda: '|'.join(map(str, _community_scope())))
 def get_communities():
     try:
-        user_id_str = get_jwt_identity()
-        user_id = int(user_id_str)
-        user = User.query.get(user_id)
-        
         # Get query parameters
-        state = request.args.get('state', user.state if user else None)
-        city = request.args.get('city', user.city if user else None)
+        state, city = _community_scope()
         locality = request.args.get('locality')
+        fields = COMMUNITY_FIELDS.parse(request.args.get('fields'))
         
         # Build query
-        query = Community.query.filter_by(is_public=True)
+        query = COMMUNITY_FIELDS.apply(Community.query, fields).filter_by(is_public=True)
         
         if state:
             query = query.filter_by(state=state)
@@ -526,17 +749,74 @@ def get_communities():
             query = query.filter_by(locality=locality)
             
         communities = query.all()
+        # Member counts and details change with the community
+        response_cache.add_tags(f'community:{c.id}' for c in communities)
+        
+        if fields is None:
+            counts = member_counts([c.id for c in communities]) if communities else {}
+            community_data = [c.to_dict(member_count=counts.get(c.id, 0)) for c in communities]
+        else:
+            community_data = COMMUNITY_FIELDS.serialize(communities, fields)
         
         return jsonify({
-            'communities': [community.to_dict() for community in communities],
+            'communities': community_data,
             'count': len(communities)
         }), 200
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@community_bp.route('/communities/nearby', methods=['GET'])
+@jwt_required()
+def get_nearby_communities():
+    try:
+        user_id = int(get_jwt_identity())
+        user = User.query.get(user_id)
+        
+        # Explicit ?lat=&lng= wins; otherwise search around the user's own location
+        if request.args.get('lat') is not None or request.args.get('lng') is not None:
+            try:
+                coords = geo.parse_coordinates({
+                    'latitude': request.args.get('lat'),
+                    'longitude': request.args.get('lng')
+                })
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        elif user and user.latitude is not None and user.longitude is not None:
+            coords = (user.latitude, user.longitude)
+        else:
+            coords = geo.geocode(user.state, user.city) if user else None
+        if coords is None:
+            return jsonify({'error': 'Location unknown; pass lat and lng'}), 400
+        
+        radius_km = request.args.get('radius_km', 10, type=float)
+        if not 0 < radius_km <= geo.NEARBY_MAX_RADIUS_KM:
+            return jsonify({'error': f'radius_km must be between 0 and {geo.NEARBY_MAX_RADIUS_KM:g}'}), 400
+        
+        hits = geo.nearby_communities(coords[0], coords[1], radius_km)
+        ids = [community_id for community_id, _ in hits]
+        communities = {c.id: c for c in Community.query.filter(Community.id.in_(ids)).all()} if ids else {}
+        counts = member_counts(ids) if ids else {}
+        
+        return jsonify({
+            'communities': [
+                {**communities[community_id].to_dict(member_count=counts.get(community_id, 0)),
+                 'distance_km': round(distance, 2)}
+                for community_id, distance in hits if community_id in communities
+            ],
+            'center': {'latitude': coords[0], 'longitude': coords[1]},
+            'radius_km': radius_km,
+            'count': len(hits)
+        }), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @community_bp.route('/communities', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_community():
     try:
         user_id_str = get_jwt_identity()
@@ -547,6 +827,11 @@ def create_community():
         if not data or not data.get('name') or not data.get('state') or not data.get('city'):
             return jsonify({'error': 'Name, state, and city are required'}), 400
         
+        try:
+            coords = geo.resolve_location(data, data['state'], data['city'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Create new community
         new_community = Community(
             name=data['name'],
@@ -558,6 +843,7 @@ def create_community():
             max_members=data.get('max_members', 500),
             creator_id=user_id
         )
+        geo.set_coordinates(new_community, coords)
         
         db.session.add(new_community)
         db.session.flush()  # Get the ID
@@ -571,6 +857,7 @@ def create_community():
         )
         
         db.session.add(creator_member)
+        leaderboard.record_membership_change(user_id)
         db.session.commit()
         
         return jsonify({
@@ -581,6 +868,59 @@ def create_community():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+COMMUNITY_EMBEDS = {'members', 'messages'}
+
+def community_member_page(community_id, page, per_page):
+    """One page of active members with only the fields a member list renders"""
+    query = db.session.query(
+        CommunityMember.user_id, User.username, CommunityMember.role, CommunityMember.joined_at
+    ).join(User, User.id == CommunityMember.user_id).filter(
+        CommunityMember.community_id == community_id,
+        CommunityMember.status == 'active'
+    )
+    
+    total = query.order_by(None).count()
+    rows = query.order_by(CommunityMember.joined_at, CommunityMember.user_id).offset(
+        (page - 1) * per_page
+    ).limit(per_page).all()
+    pages = (total + per_page - 1) // per_page
+    
+    return {
+        'members': [
+            {
+                'user_id': user_id,
+                'username': username,
+                'role': role,
+                'joined_at': joined_at.isoformat() if joined_at else None
+            }
+            for user_id, username, role, joined_at in rows
+        ],
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': pages,
+            'has_next': page < pages,
+            'has_prev': page > 1
+        }
+    }
+
+def community_access(community_id, user_id):
+    """Return (community, membership, error_response) for a viewer"""
+    community = Community.query.get(community_id)
+    if not community:
+        return None, None, (jsonify({'error': 'Community not found'}), 404)
+    
+    membership = CommunityMember.query.filter_by(
+        community_id=community_id,
+        user_id=user_id
+    ).first()
+    
+    if not community.is_public and not membership:
+        return community, membership, (jsonify({'error': 'Access denied'}), 403)
+    
+    return community, membership, None
+
 @community_bp.route('/communities/<int:community_id>', methods=['GET'])
 @jwt_required()
 def get_community(community_id):
@@ -588,36 +928,61 @@ def get_community(community_id):
         user_id_str = get_jwt_identity()
         user_id = int(user_id_str)
         
-        community = Community.query.get(community_id)
-        if not community:
-            return jsonify({'error': 'Community not found'}), 404
+        # Heavy sections are opt-in: ?embed=members,messages
+        embeds = {e.strip() for e in request.args.get('embed', '').split(',') if e.strip()}
+        unknown = embeds - COMMUNITY_EMBEDS
+        if unknown:
+            return jsonify({'error': f'Unknown embed: {", ".join(sorted(unknown))}'}), 400
         
-        # Check if user is a member
-        membership = CommunityMember.query.filter_by(
-            community_id=community_id, 
-            user_id=user_id
-        ).first()
-        
-        if not community.is_public and not membership:
-            return jsonify({'error': 'Access denied'}), 403
+        community, membership, error = community_access(community_id, user_id)
+        if error:
+            return error
         
-        # Get community members
-        members = CommunityMember.query.filter_by(
+        member_count = CommunityMember.query.filter_by(
             community_id=community_id,
             status='active'
-        ).all()
+        ).count()
         
-        # Get recent messages (last 50)
-        recent_messages = Message.query.filter_by(
-            community_id=community_id
-        ).order_by(Message.created_at.desc()).limit(50).all()
+        response = {
+            'community': community.to_dict(member_count=member_count),
+            'user_membership': {
+                'role': membership.role,
+                'status': membership.status,
+                'joined_at': membership.joined_at.isoformat()
+            } if membership else None
+        }
         
-        return jsonify({
-            'community': community.to_dict(),
-            'members': [member.to_dict() for member in members],
-            'recent_messages': [msg.to_dict() for msg in reversed(recent_messages)],
-            'user_membership': membership.to_dict() if membership else None
-        }), 200
+        if 'members' in embeds:
+            per_page = min(max(request.args.get('members_per_page', 50, type=int), 1), 200)
+            response['members'] = community_member_page(community_id, 1, per_page)
+        
+        if 'messages' in embeds:
+            # Get recent messages (last 50) with senders in the same query
+            recent_messages = Message.query.options(db.joinedload(Message.sender)).filter_by(
+                community_id=community_id
+            ).order_by(Message.id.desc()).limit(50).all()
+            response['recent_messages'] = [msg.to_dict() for msg in reversed(recent_messages)]
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@community_bp.route('/communities/<int:community_id>/members', methods=['GET'])
+@jwt_required()
+def get_community_members(community_id):
+    try:
+        user_id_str = get_jwt_identity()
+        user_id = int(user_id_str)
+        
+        community, membership, error = community_access(community_id, user_id)
+        if error:
+            return error
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+        
+        return jsonify(community_member_page(community_id, page, per_page)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -665,6 +1030,7 @@ def join_community(community_id):
             )
             db.session.add(new_membership)
         
+        leaderboard.record_membership_change(user_id)
         db.session.commit()
         
         return jsonify({
@@ -696,6 +1062,7 @@ def leave_community(community_id):
             return jsonify({'error': 'Community creators cannot leave their community'}), 400
         
         membership.status = 'inactive'
+        leaderboard.record_membership_change(user_id)
         db.session.commit()
         
         return jsonify({'message': 'Successfully left community'}), 200
@@ -721,7 +1088,24 @@ def get_messages(community_id):
         if not membership:
             return jsonify({'error': 'Access denied - not a member of this community'}), 403
         
-        # Get pagination parameters
+        # Cursor pagination (?before=<message_id>) walks the full history and
+        # falls through to the compressed archive once the hot table runs out
+        if 'page' not in request.args:
+            limit = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+            before_id = request.args.get('before', type=int)
+            messages, has_more = read_history(community_id, before_id=before_id, limit=limit)
+            
+            return jsonify({
+                'messages': list(reversed(messages)),
+                'pagination': {
+                    'per_page': limit,
+                    'before': before_id,
+                    'next_before': messages[-1]['id'] if messages and has_more else None,
+                    'has_more': has_more
+                }
+            }), 200
+        
+        # Page-number pagination over recent (non-archived) messages
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 50, type=int)
         
@@ -749,6 +1133,8 @@ def get_messages(community_id):
 
 @message_bp.route('/communities/<int:community_id>/messages', methods=['POST'])
 @jwt_required()
+@idempotent
+@rate_limited('send_message')
 def send_message(community_id):
     try:
         user_id_str = get_jwt_identity()
@@ -768,18 +1154,44 @@ def send_message(community_id):
         if not membership:
             return jsonify({'error': 'Access denied - not a member of this community'}), 403
         
+        values = {
+            'community_id': community_id,
+            'sender_id': user_id,
+            'content': data['content'],
+            'message_type': data.get('message_type', 'text'),
+            'is_emergency': data.get('is_emergency', False)
+        }
+        
+        if group_commit.GROUP_COMMIT_ENABLED:
+            # Committed together with other requests' messages; returns once durable
+            sender = User.query.get(user_id)
+            try:
+                message_data = group_commit.writer.submit(values, sender=sender.to_dict() if sender else None)
+            except group_commit.WriteTimeout as e:
+                # Safe to retry: the message was never written
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+            return jsonify({
+                'message': 'Message sent successfully',
+                'message_data': message_data
+            }), 201
+        
         # Create new message
-        new_message = Message(
-            community_id=community_id,
-            sender_id=user_id,
-            content=data['content'],
-            message_type=data.get('message_type', 'text'),
-            is_emergency=data.get('is_emergency', False)
-        )
+        new_message = Message(**values)
         
         db.session.add(new_message)
+        
+        # Emergency/announcement fan-out is recorded in the same transaction
+        # and delivered by the outbox dispatcher after the response returns
+        broadcast = outbox.OUTBOX_ENABLED and outbox.is_broadcast(new_message)
+        if broadcast:
+            db.session.flush()  # Get the ID
+            outbox.add_broadcast_event(new_message)
+        
         db.session.commit()
         
+        if broadcast:
+            outbox.dispatcher.wake()
+        
         return jsonify({
             'message': 'Message sent successfully',
             'message_data': new_message.to_dict()
@@ -821,18 +1233,55 @@ def pin_message(message_id):
         return jsonify({'error': str(e)}), 500
 
 # Alert routes
+def _alert_audience():
+    """
+    Everything a caller's alert list depends on: state, city, coordinates and
+    active communities. Callers with the same audience share one cached (and
+    coalesced) list, so a whole city opening its alerts costs one computation.
+    """
+    if 'alert_audience' not in g:
+        user = db.session.get(User, int(get_jwt_identity()))
+        if user is None:
+            g.alert_audience = f'user:{get_jwt_identity()}'
+        else:
+            communities = db.session.query(CommunityMember.community_id).filter_by(
+                user_id=user.id, status='active'
+            ).order_by(CommunityMember.community_id)
+            g.alert_audience = '|'.join(map(str, (
+                user.state, user.city, user.latitude, user.longitude,
+                ','.join(str(cid) for cid, in communities)
+            )))
+    return g.alert_audience
+
+def _alert_list_tags():
+    user = db.session.get(User, int(get_jwt_identity()))
+    state = user.state if user else None
+    # A change to the caller's location or memberships changes their audience, not this entry
+    return ['alerts:*', f'alerts:{state}' if state else response_cache.ALERTS_UNFILTERED]
+
 @alert_bp.route('/alerts', methods=['GET'])
 @jwt_required()
+@cached('alerts', tags=_alert_list_tags, vary=_alert_audience)
 def get_alerts():
     try:
         user_id_str = get_jwt_identity()
         user_id = int(user_id_str)
         user = User.query.get(user_id)
         
-        # Get active alerts for user's location
-        query = Alert.query.filter_by(is_active=True)
+        fields = ALERT_FIELDS.parse(request.args.get('fields'))
+        # Polygons are only sent on request (?include=area, or area in ?fields=)
+        include_area = 'area' in request.args.get('include', '').split(',')
+        
+        # Get active, unexpired alerts for user's location
+        now = datetime.utcnow()
+        query = ALERT_FIELDS.apply(Alert.query, fields).filter(active_alert_filter(now))
+        
+        located = user is not None and user.latitude is not None and user.longitude is not None
         
         # Filter by location if user has location set
+        if user and (user.state or located):
+            # Polygon alerts are matched against the user's coordinates below
+            query = query.filter(Alert.area.is_(None))
         if user and user.state:
             location_filter = db.or_(
                 Alert.state.is_(None),  # Global alerts
@@ -849,30 +1298,42 @@ def get_alerts():
         
         # Get user's community alerts
         user_communities = [m.community_id for m in user.community_memberships if m.status == 'active']
+        response_cache.add_tags(f'community:{cid}' for cid in user_communities)
         if user_communities:
-            community_alerts = Alert.query.filter(
+            community_alerts = ALERT_FIELDS.apply(Alert.query, fields).filter(
                 Alert.community_id.in_(user_communities),
-                Alert.is_active == True
+                active_alert_filter(now)
             ).all()
         else:
             community_alerts = []
         
+        # Polygon alerts: bounding-box prefilter in SQL, then point-in-polygon
+        area_alerts = []
+        if located:
+            area_ids = alert_areas.matching_alert_ids(user.latitude, user.longitude, active_alert_filter(now))
+            if area_ids:
+                area_alerts = ALERT_FIELDS.apply(Alert.query, fields).filter(Alert.id.in_(area_ids)).all()
+        
         location_alerts = query.order_by(Alert.issued_at.desc()).all()
         
-        # Combine and sort alerts
-        all_alerts = location_alerts + community_alerts
+        # Combine, drop alerts matched more than one way, and sort
+        all_alerts = list({a.id: a for a in location_alerts + community_alerts + area_alerts}.values())
         all_alerts = sorted(all_alerts, key=lambda x: x.issued_at, reverse=True)
         
         return jsonify({
-            'alerts': [alert.to_dict() for alert in all_alerts],
+            'alerts': ALERT_FIELDS.serialize(all_alerts, fields, include_area=include_area),
             'count': len(all_alerts)
         }), 200
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @alert_bp.route('/alerts', methods=['POST'])
 @jwt_required()
+@idempotent
+@rate_limited('create_alert')
 def create_alert():
     try:
         user_id_str = get_jwt_identity()
@@ -907,18 +1368,77 @@ def create_alert():
             expires_at=datetime.fromisoformat(data['expires_at']) if data.get('expires_at') else None,
             source=data.get('source', 'community')
         )
+        if data.get('area') is not None:
+            try:
+                alert_areas.set_area(new_alert, data['area'])
+            except alert_areas.AreaError as e:
+                return jsonify({'error': str(e)}), 400
         
         db.session.add(new_alert)
+        
+        # Delivery to the alert's audience is staged in the same transaction
+        if outbox.OUTBOX_ENABLED:
+            db.session.flush()  # Get the ID
+            alert_audience.add_delivery_event(new_alert)
+        
         db.session.commit()
         
+        if outbox.OUTBOX_ENABLED:
+            outbox.dispatcher.wake()
+        
         return jsonify({
             'message': 'Alert created successfully',
-            'alert': new_alert.to_dict()
+            'alert': new_alert.to_dict(include_area=True)
         }), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@alert_bp.route('/admin/alert-feeds', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_alert_feeds():
+    """Configured CAP feeds and how far ingestion of each has got"""
+    try:
+        checkpoints = {c.source: c for c in AlertFeedCheckpoint.query.all()}
+        feeds = []
+        for name, location in alert_feeds.configured_feeds():
+            checkpoint = checkpoints.get(name)
+            feeds.append({
+                'name': name,
+                'location': location,
+                'checkpoint': checkpoint.to_dict() if checkpoint else None,
+                'alert_count': Alert.query.filter_by(source=name).count()
+            })
+        return jsonify({'feeds': feeds, 'interval': alert_feeds.ALERT_FEED_INTERVAL}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@alert_bp.route('/admin/alerts/<int:alert_id>/audience', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_alert_audience(alert_id):
+    try:
+        alert = Alert.query.get(alert_id)
+        if not alert:
+            return jsonify({'error': 'Alert not found'}), 404
+        
+        user_ids = alert_audience.resolve(alert)
+        result = {
+            'alert_id': alert.id,
+            'user_count': len(user_ids)
+        }
+        if alert.area and alert.community_id is None:
+            community_ids = alert_areas.resolve_audience(Community, alert.area)
+            result['community_count'] = len(community_ids)
+            result['community_ids'] = community_ids
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @alert_bp.route('/alerts/<int:alert_id>/dismiss', methods=['POST'])
 @jwt_required()
 def dismiss_alert(alert_id):
@@ -948,8 +1468,9 @@ def get_all_users():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '')
+        fields = USER_FIELDS.parse(request.args.get('fields'))
         
-        query = User.query
+        query = USER_FIELDS.apply(User.query, fields)
         
         if search:
             query = query.filter(
@@ -964,7 +1485,7 @@ def get_all_users():
         )
         
         return jsonify({
-            'users': [user.to_dict() for user in users.items],
+            'users': USER_FIELDS.serialize(users.items, fields),
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -975,6 +1496,66 @@ def get_all_users():
             }
         }), 200
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/admin/users/import', methods=['POST'])
+@jwt_required()
+@admin_required
+def import_users():
+    try:
+        fmt = request.args.get('format', 'csv')
+        generate_passwords = request.args.get('generate_passwords', 'false').lower() in ('1', 'true', 'yes')
+        
+        if fmt not in user_provisioning.FORMATS:
+            return jsonify({'error': f"format must be one of {', '.join(user_provisioning.FORMATS)}"}), 400
+        
+        # Accept a multipart upload (field "file") or the raw request body
+        upload = request.files.get('file')
+        try:
+            text = (upload.read() if upload else request.get_data()).decode('utf-8')
+        except UnicodeDecodeError:
+            return jsonify({'error': 'Upload must be UTF-8 text'}), 400
+        if not text.strip():
+            return jsonify({'error': 'No rows to import'}), 400
+        
+        # One import at a time keeps hashing from crowding out live traffic
+        running = user_provisioning.running_job()
+        if running:
+            return jsonify({'error': 'Another import is still running', 'job': running.to_dict()}), 409
+        
+        # Generated passwords are returned here once and never stored
+        passwords = user_provisioning.assign_passwords(text, fmt) if generate_passwords else None
+        job = user_provisioning.start_job(
+            current_app._get_current_object(), text, fmt, passwords, int(get_jwt_identity())
+        )
+        body = {'message': 'Import started', 'job': job.to_dict()}
+        if generate_passwords:
+            body['generated_passwords'] = [
+                {'line': line_number, 'username': username, 'password': password}
+                for line_number, (username, password) in sorted(passwords.items())
+            ]
+        response = jsonify(body)
+        response.headers['Location'] = url_for('user.get_import_job', job_id=job.id)
+        return response, 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/admin/users/import/<int:job_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_import_job(job_id):
+    try:
+        job = db.session.get(ProvisioningJob, job_id)
+        if not job:
+            return jsonify({'error': 'Import job not found'}), 404
+        
+        return jsonify({'job': job.to_dict(include_report=job.status != 'running')}), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1064,43 +1645,38 @@ def get_analytics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Admin quiz management
-@quiz_bp.route('/admin/quizzes', methods=['GET'])
+@resources_bp.route('/admin/analytics/regional', methods=['GET'])
 @jwt_required()
 @admin_required
-def get_all_quizzes():
+def get_regional_analytics():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        resource_id = request.args.get('resource_id', type=int)
+        level = request.args.get('level', 'state')
+        state = request.args.get('state')
+        category = request.args.get('category')
         
-        query = Quiz.query
+        if level not in regional_analytics.LEVELS:
+            return jsonify({'error': f"level must be one of: {', '.join(regional_analytics.LEVELS)}"}), 400
         
-        if resource_id:
-            query = query.filter_by(resource_id=resource_id)
+        result = regional_analytics.regional_stats(level)
+        regions = [
+            r for r in result['regions']
+            if (not state or r['state'] == state) and (not category or r['category'] == category)
+        ]
         
-        quizzes = query.order_by(Quiz.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        # Include resource information
-        quiz_data = []
-        for quiz in quizzes.items:
-            quiz_dict = quiz.to_dict_with_answer()
-            quiz_dict['resource'] = quiz.resource.to_dict() if quiz.resource else None
-            quiz_data.append(quiz_dict)
+        return jsonify({**result, 'regions': regions, 'count': len(regions)}), 200
         
-        return jsonify({
-            'quizzes': quiz_data,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': quizzes.total,
-                'pages': quizzes.pages,
-                'has_next': quizzes.has_next,
-                'has_prev': quizzes.has_prev
-            }
-        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Admin quiz management
+@quiz_bp.route('/admin/quizzes', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_all_quizzes():
+    try:
+        return _admin_quiz_listing()
         
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,83 @@
+"""
+Minimal in-process scheduler for periodic maintenance jobs.
+
+Each registered job runs on its own daemon thread inside every worker that
+serves a request. Threads do not survive fork, so jobs are started lazily
+from a before_request hook rather than at import time under preload_app.
+Jobs run in every worker and must therefore be idempotent.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger('vajra.scheduler')
+
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+
+
+class PeriodicJob:
+    """Call func inside an app context every interval seconds"""
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self, app):
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self.app = app
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f'job-{self.name}', daemon=True)
+            self._thread.start()
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            with self.app.app_context():
+                self.func()
+            metrics.incr(f'jobs.{self.name}.runs')
+        except Exception:
+            metrics.incr(f'jobs.{self.name}.errors')
+            logger.exception('job_failed', extra={'job': self.name})
+        finally:
+            metrics.set_gauge(f'jobs.{self.name}.last_duration_ms',
+                              round((time.monotonic() - started) * 1000, 1))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.run_once()
+
+
+_jobs = {}
+
+
+def register_job(name, func, interval):
+    """Register (or replace) a periodic job; interval <= 0 disables it"""
+    if interval and interval > 0:
+        _jobs[name] = PeriodicJob(name, func, interval)
+    else:
+        _jobs.pop(name, None)
+
+
+def init_scheduler(app):
+    """Start registered jobs in whichever process serves requests"""
+    if not SCHEDULER_ENABLED:
+        return
+
+    @app.before_request
+    def start_periodic_jobs():
+        for job in _jobs.values():
+            job.ensure_started(app)
@@ -1,6 +1,7 @@
 from app import app
 from database import db
 from models import Resource, Quiz, User
+import alert_audience
 import json
 from werkzeug.security import generate_password_hash
 
@@ -208,6 +209,8 @@ if __name__ == '__main__':
         Quiz.query.delete()
         Resource.query.delete()
         User.query.delete()
+        # A bulk delete bypasses the audience index's change tracking: rebuild it
+        alert_audience.record_rebuild(db.session)
         db.session.commit()
         
         # Create new sample data
@@ -0,0 +1,164 @@
+"""
+Single-flight coalescing of identical computations.
+
+When many identical requests arrive at once (a city opening its alert list
+the moment an alert fires), only the first one, the leader, computes the
+result; the others wait for it and reuse it instead of running the same
+queries in parallel. Callers key computations by a normalized description
+of their input (response_cache.cached uses its cache key).
+
+Within a worker, followers wait on the leader's thread; this needs threaded
+workers (WORKER_CLASS=gthread). With SINGLE_FLIGHT_SHARED, the leader also
+takes a host-wide lease on the key in a local SQLite file (see
+local_store.py): a leader in another worker that finds the lease taken polls
+for the result (e.g. the shared cache entry the lease holder is about to
+write) instead of computing it. Waits are bounded by SINGLE_FLIGHT_WAIT;
+after that, or when the leader fails or has nothing to share, the caller
+computes the result itself.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+from local_store import LocalStore
+
+logger = logging.getLogger('vajra.single_flight')
+
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() != 'false'
+SINGLE_FLIGHT_SHARED = os.getenv('SINGLE_FLIGHT_SHARED', 'false').lower() == 'true'
+SINGLE_FLIGHT_DB = os.getenv('SINGLE_FLIGHT_DB', os.path.join(os.path.dirname(__file__), 'instance', 'single_flight.db'))
+# Longest a follower waits for a leader before computing the result itself
+SINGLE_FLIGHT_WAIT = float(os.getenv('SINGLE_FLIGHT_WAIT', '5'))
+# A lease older than this belongs to a worker that died mid-computation
+LEASE_SECONDS = 30
+POLL_INTERVAL = 0.02
+
+
+class LeaseStore(LocalStore):
+    """Host-wide leases: which worker is computing a key right now"""
+
+    def __init__(self, path):
+        super().__init__(path, (
+            'CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL) WITHOUT ROWID',
+        ))
+
+    def acquire(self, key, owner, seconds=LEASE_SECONDS, now=None):
+        """Take the lease on key unless another owner holds an unexpired one"""
+        now = time.time() if now is None else now
+        cursor = self.connection().execute(
+            'INSERT INTO leases (key, owner, until) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, until = excluded.until WHERE until < ?',
+            (key, owner, now + seconds, now)
+        )
+        return cursor.rowcount == 1
+
+    def held(self, key, now=None):
+        now = time.time() if now is None else now
+        row = self.connection().execute('SELECT until FROM leases WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] > now
+
+    def release(self, key, owner):
+        self.connection().execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, owner))
+
+
+store = LeaseStore(SINGLE_FLIGHT_DB)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _await_other_worker(key, poll, wait):
+    """poll() until it returns a result or the lease holder gives up; None on timeout"""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        result = poll()
+        if result is not None:
+            return result
+        if not store.held(key):
+            # Released (or expired) without a result we can see; one last look
+            return poll()
+        time.sleep(POLL_INTERVAL)
+    metrics.incr('single_flight.shared_timeouts')
+    return None
+
+
+def _lead(key, fn, poll, wait):
+    """Run fn() as this worker's leader for key, deferring to another worker's lease when shared"""
+    if not (SINGLE_FLIGHT_SHARED and poll is not None):
+        return fn(), False
+    owner = f'{os.getpid()}:{uuid.uuid4().hex}'
+    try:
+        acquired = store.acquire(key, owner)
+    except sqlite3.Error:
+        metrics.incr('single_flight.errors')
+        logger.exception('lease_store_failed', extra={'rate_key': 'lease_store_failed'})
+        return fn(), False
+    if not acquired:
+        metrics.incr('single_flight.shared_waits')
+        try:
+            result = _await_other_worker(key, poll, wait)
+        except sqlite3.Error:
+            metrics.incr('single_flight.errors')
+            logger.exception('lease_store_failed', extra={'rate_key': 'lease_store_failed'})
+            result = None
+        if result is not None:
+            metrics.incr('single_flight.shared_hits')
+            return result, True
+        return fn(), False
+    try:
+        return fn(), False
+    finally:
+        try:
+            store.release(key, owner)
+        except sqlite3.Error:
+            metrics.incr('single_flight.errors')
+            logger.exception('lease_store_failed', extra={'rate_key': 'lease_store_failed'})
+
+
+def do(key, fn, poll=None, wait=SINGLE_FLIGHT_WAIT):
+    """
+    Run fn() once among the concurrent callers asking for key; returns (result, shared).
+
+    shared is True when the result came from another caller's computation.
+    Results are handed to every waiting caller as-is, so they must be
+    immutable. A None result means there is nothing to share: each follower
+    then runs fn() itself. poll() looks for a result another worker
+    published (only used with SINGLE_FLIGHT_SHARED).
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return fn(), False
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        metrics.incr('single_flight.waits')
+        if not flight.done.wait(wait):
+            metrics.incr('single_flight.timeouts')
+        elif flight.result is not None:
+            metrics.incr('single_flight.coalesced')
+            return flight.result, True
+        return fn(), False
+
+    try:
+        flight.result, shared = _lead(key, fn, poll, wait)
+        return flight.result, shared
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Bulk user provisioning for schools and NGOs onboarding volunteers.
+
+Rows (CSV with a header, or NDJSON) carry username, email, password and the
+optional signup fields state, city, locality, latitude, longitude. They are
+processed in batches: each batch is validated, checked for username/email
+conflicts with two IN queries (plus the names already seen in the file), has
+its passwords hashed in parallel by a pool of low-priority processes, and is
+inserted in one transaction. Every row gets an entry in the report.
+
+The admin endpoint runs the import in a background thread and records
+progress in provisioning_jobs; hashing is the slow part (the KDF is
+deliberately expensive), so 10,000 users take minutes. Hash workers run
+niced and default to half the CPUs so live requests keep their share.
+With generate_passwords, the endpoint's response is the only place the
+generated passwords appear; stored reports only flag the rows that got one.
+
+CLI:
+    python user_provisioning.py import volunteers.csv [--format csv|ndjson] [--generate-passwords] [--dry-run]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+import alert_audience
+import geo
+import metrics
+from database import db
+from models import ProvisioningJob, User
+from password_policy import generate_password, password_problem
+
+logger = logging.getLogger('vajra.user_provisioning')
+
+PROVISION_BATCH_SIZE = int(os.getenv('PROVISION_BATCH_SIZE', '500'))
+PROVISION_HASH_WORKERS = int(os.getenv('PROVISION_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+PROVISION_MAX_ROWS = int(os.getenv('PROVISION_MAX_ROWS', '50000'))
+# A running job not updated for this long belongs to a worker that died
+STALE_JOB_SECONDS = 600
+FORMATS = ('csv', 'ndjson')
+USERNAME_MAX_LENGTH = 80
+EMAIL_MAX_LENGTH = 120
+
+
+class ProvisioningError(ValueError):
+    """Raised for input that cannot be imported at all"""
+
+
+def _lower_priority():
+    # Runs in each hash worker: let request-serving processes win the CPU
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+def _parse(stream, fmt):
+    """Yield (line_number, row dict or parse error) from a text stream"""
+    if fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('expected a JSON object')
+            except ValueError as e:
+                yield line_number, ValueError(f'invalid JSON: {e}')
+                continue
+            yield line_number, row
+    elif fmt == 'csv':
+        # Header is line 1
+        for line_number, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_number, row
+    else:
+        raise ProvisioningError(f"format must be one of {', '.join(FORMATS)}")
+
+
+def _text(row, key):
+    value = row.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _validate(row, generated_password=None):
+    """Column values for a User row plus the plaintext password; raises ValueError"""
+    username, email, password = _text(row, 'username'), _text(row, 'email'), row.get('password') or None
+    if password is not None and not isinstance(password, str):
+        raise ValueError('password must be a string')
+    if not username or not email:
+        raise ValueError('username and email are required')
+    if len(username) > USERNAME_MAX_LENGTH:
+        raise ValueError(f'username must be at most {USERNAME_MAX_LENGTH} characters')
+    if len(email) > EMAIL_MAX_LENGTH or '@' not in email:
+        raise ValueError('email is not a valid address')
+    generated = password is None and generated_password is not None
+    if generated:
+        password = generated_password
+    if password is None:
+        raise ValueError('password is required (or use generate_passwords)')
+    problem = password_problem(password)
+    if problem:
+        raise ValueError(f'password {problem}')
+
+    state, city = _text(row, 'state'), _text(row, 'city')
+    coords = geo.resolve_location({
+        'latitude': _text(row, 'latitude'), 'longitude': _text(row, 'longitude')
+    }, state, city)
+    values = {
+        'username': username, 'email': email, 'state': state, 'city': city,
+        'locality': _text(row, 'locality'),
+        'latitude': coords[0] if coords else None,
+        'longitude': coords[1] if coords else None,
+        'geo_cell': geo.cell_id(*coords) if coords else None,
+    }
+    return values, password, generated
+
+
+class UserProvisioning:
+    """Validate, hash and insert users in batches, collecting a per-row report"""
+
+    def __init__(self, batch_size=PROVISION_BATCH_SIZE, workers=PROVISION_HASH_WORKERS,
+                 generate_passwords=False, passwords=None, dry_run=False, progress=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.generate_passwords = generate_passwords
+        # line number -> password handed out already (see assign_passwords); never reported
+        self.passwords = passwords
+        self.dry_run = dry_run
+        self.progress = progress  # called with (processed_rows, created_count) after each batch
+        self.rows = []  # per-row report, in input order
+        self.created = 0
+        self.rows_seen = 0
+        self._usernames = set()
+        self._emails = set()
+        self._batch = []  # (report entry, values, password)
+        self._pool = None
+
+    def _result(self, line_number, username, status, **extra):
+        entry = {'line': line_number, 'username': username, 'status': status, **extra}
+        self.rows.append(entry)
+        return entry
+
+    def run(self, stream, fmt='csv'):
+        started = time.monotonic()
+        if not self.dry_run:
+            # spawn, not fork: the parent may be a threaded gunicorn worker
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_lower_priority
+            )
+        try:
+            for line_number, row in _parse(stream, fmt):
+                self.rows_seen += 1
+                if self.rows_seen > PROVISION_MAX_ROWS:
+                    raise ProvisioningError(f'at most {PROVISION_MAX_ROWS} rows per import')
+                if isinstance(row, Exception):
+                    self._result(line_number, None, 'invalid', error=str(row))
+                    continue
+                if self.passwords is not None:
+                    generated_password = self.passwords.get(line_number, (None, None))[1]
+                else:
+                    generated_password = generate_password() if self.generate_passwords else None
+                try:
+                    values, password, generated = _validate(row, generated_password)
+                except ValueError as e:
+                    self._result(line_number, _text(row, 'username'), 'invalid', error=str(e))
+                    continue
+                entry = self._result(line_number, values['username'], 'pending')
+                if generated:
+                    entry['generated_password'] = True
+                    if self.passwords is None:
+                        entry['password'] = password  # CLI: printed once, never stored
+                self._batch.append((entry, values, password))
+                if len(self._batch) >= self.batch_size:
+                    self._flush()
+            self._flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+
+        metrics.incr('user_provisioning.rows', self.rows_seen)
+        metrics.incr('user_provisioning.created', self.created)
+        metrics.set_gauge('user_provisioning.last_run_s', round(time.monotonic() - started, 1))
+        return self.report()
+
+    def _conflicts(self, batch):
+        """Mark rows whose username or email exists in the database or earlier in the file"""
+        usernames = {values['username'] for _, values, _ in batch}
+        emails = {values['email'] for _, values, _ in batch}
+        taken_usernames = {u for (u,) in db.session.query(User.username).filter(User.username.in_(usernames))}
+        taken_emails = {e for (e,) in db.session.query(User.email).filter(User.email.in_(emails))}
+
+        accepted = []
+        for entry, values, password in batch:
+            if values['username'] in taken_usernames:
+                entry.update(status='conflict', error='Username already exists')
+            elif values['email'] in taken_emails:
+                entry.update(status='conflict', error='Email already exists')
+            elif values['username'] in self._usernames:
+                entry.update(status='conflict', error='Username appears earlier in the file')
+            elif values['email'] in self._emails:
+                entry.update(status='conflict', error='Email appears earlier in the file')
+            else:
+                accepted.append((entry, values, password))
+            self._usernames.add(values['username'])
+            self._emails.add(values['email'])
+        return accepted
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        accepted = self._conflicts(batch)
+        db.session.rollback()  # end the read transaction before the slow hashing
+
+        if self.dry_run:
+            for entry, _, _ in accepted:
+                entry['status'] = 'valid'
+        elif accepted:
+            chunksize = max(1, len(accepted) // (self.workers * 4))
+            hashes = self._pool.map(generate_password_hash, [p for _, _, p in accepted], chunksize=chunksize)
+            rows = [{**values, 'password_hash': h} for (_, values, _), h in zip(accepted, hashes)]
+            self._insert(accepted, rows)
+
+        if self.progress:
+            self.progress(self.rows_seen, self.created)
+
+    def _insert(self, accepted, rows):
+        try:
+            ids = db.session.scalars(insert(User).returning(User.id), rows).all()
+            # Core inserts skip the flush hook that feeds the audience index
+            alert_audience.record_location_changes(db.session, [
+                (user_id, 'insert', True, None, None, row.get('state'), row.get('city'))
+                for user_id, row in zip(ids, rows)
+            ])
+            db.session.commit()
+        except Exception:
+            # Usually a signup that took a name since the conflict check: isolate it row by row
+            db.session.rollback()
+            metrics.incr('user_provisioning.batch_failures')
+            ids = []
+            for (entry, _, _), row in zip(accepted, rows):
+                try:
+                    user_id = db.session.scalars(insert(User).returning(User.id), [row]).one()
+                    alert_audience.record_location_changes(db.session, [
+                        (user_id, 'insert', True, None, None, row.get('state'), row.get('city'))
+                    ])
+                    db.session.commit()
+                    ids.append(user_id)
+                except Exception as e:
+                    db.session.rollback()
+                    ids.append(None)
+                    entry.update(status='failed', error=f'insert failed: {e.__class__.__name__}')
+        for (entry, _, _), user_id in zip(accepted, ids):
+            if user_id is not None:
+                entry.update(status='created', id=user_id)
+                self.created += 1
+
+    def report(self):
+        counts = {}
+        for entry in self.rows:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows_seen,
+            'created': self.created,
+            'counts': counts,
+            'results': self.rows
+        }
+
+
+def provision_users(stream, fmt='csv', generate_passwords=False, passwords=None, dry_run=False, progress=None):
+    """Import users from a text stream; returns the report dict"""
+    return UserProvisioning(generate_passwords=generate_passwords, passwords=passwords, dry_run=dry_run,
+                            progress=progress).run(stream, fmt=fmt)
+
+
+def assign_passwords(text, fmt):
+    """
+    {line number: (username, password)} with a random password for each row of text that has none.
+
+    The admin endpoint returns these in its response, the only place they
+    ever appear: the job gets them in memory and its stored report only
+    marks which rows received one.
+    """
+    passwords = {}
+    for line_number, row in _parse(io.StringIO(text, newline=''), fmt):
+        if isinstance(row, dict) and not row.get('password'):
+            passwords[line_number] = (_text(row, 'username'), generate_password())
+    return passwords
+
+
+def running_job():
+    """The job still running on some worker, if any"""
+    cutoff = datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS)
+    return ProvisioningJob.query.filter(
+        ProvisioningJob.status == 'running', ProvisioningJob.updated_at >= cutoff
+    ).first()
+
+
+def start_job(app, text, fmt, passwords, created_by):
+    """Record a job and run it on a background thread; returns the job"""
+    total = sum(1 for line in text.splitlines() if line.strip()) - (1 if fmt == 'csv' else 0)
+    job = ProvisioningJob(created_by=created_by, total_rows=max(0, total))
+    db.session.add(job)
+    db.session.commit()
+    thread = threading.Thread(
+        target=_run_job, args=(app, job.id, text, fmt, passwords),
+        name=f'provisioning-{job.id}', daemon=True
+    )
+    thread.start()
+    return job
+
+
+def _run_job(app, job_id, text, fmt, passwords):
+    with app.app_context():
+        def progress(processed, created):
+            db.session.query(ProvisioningJob).filter_by(id=job_id).update({
+                'processed_rows': processed, 'created_count': created, 'updated_at': datetime.utcnow()
+            })
+            db.session.commit()
+
+        job_values = {'finished_at': None}
+        try:
+            report = provision_users(io.StringIO(text, newline=''), fmt=fmt,
+                                     passwords=passwords, progress=progress)
+            job_values.update(status='done', report=json.dumps(report),
+                              processed_rows=report['rows'], created_count=report['created'])
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('provisioning_failed', extra={'job_id': job_id})
+            job_values.update(status='failed', error=str(e))
+        job_values['finished_at'] = datetime.utcnow()
+        db.session.query(ProvisioningJob).filter_by(id=job_id).update(job_values)
+        db.session.commit()
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-provision user accounts')
+    sub = parser.add_subparsers(dest='command', required=True)
+    import_parser = sub.add_parser('import')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    import_parser.add_argument('--generate-passwords', action='store_true',
+                               help='give rows without a password a random one (shown in the report)')
+    import_parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+    # app.py reports startup progress on stdout; keep it out of the report
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import app
+
+    with app.app_context():
+        with open(args.path, encoding='utf-8', newline='') as f:
+            report = provision_users(
+                f, fmt=fmt, generate_passwords=args.generate_passwords, dry_run=args.dry_run,
+                progress=lambda processed, created: print(f'{processed} rows, {created} created', file=sys.stderr)
+            )
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['created'] == report['rows'] or args.dry_run else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Precomputed per-user quiz statistics and badges.
+
+submit_quiz calls record_quiz_result() inside its transaction, so a profile
+or /auth/me request reads one row instead of scanning user_progress. Rows
+for users with progress from before stats existed are seeded at startup
+(backfill_stats); reads never write.
+"""
+
+import json
+
+from sqlalchemy import update
+
+import metrics
+from database import db, insert_or_ignore
+from models import UserStats, UserProgress
+
+PASSING_SCORE = 70
+
+# (completed resources needed, badge name), in award order
+BADGES = (
+    (1, 'First Steps'),
+    (3, 'Safety Aware'),
+    (5, 'Emergency Expert'),
+)
+
+
+def badges_for(completed_count):
+    return [name for needed, name in BADGES if completed_count >= needed]
+
+
+def _passed(score):
+    return score is not None and score >= PASSING_SCORE
+
+
+def _aggregates():
+    """(user_id, attempted, completed, score total) per user, from user_progress"""
+    return db.session.query(
+        UserProgress.user_id,
+        db.func.count(UserProgress.id),
+        db.func.sum(db.case((UserProgress.quiz_score >= PASSING_SCORE, 1), else_=0)),
+        db.func.sum(UserProgress.quiz_score)
+    ).filter(
+        UserProgress.quiz_score.isnot(None)
+    ).group_by(UserProgress.user_id)
+
+
+def _values(user_id, attempted, completed, total):
+    completed = int(completed or 0)
+    return {
+        'user_id': user_id,
+        'attempted_count': attempted or 0,
+        'completed_count': completed,
+        'score_total': total or 0,
+        'badges': json.dumps(badges_for(completed))
+    }
+
+
+def _computed_values(user_id):
+    row = _aggregates().filter(UserProgress.user_id == user_id).first()
+    return _values(*row) if row else _values(user_id, 0, 0, 0)
+
+
+def compute_stats(user_id):
+    """Build a (transient) stats row from user_progress"""
+    return UserStats(**_computed_values(user_id))
+
+
+def get_stats(user_id):
+    """Stats row for a user; computed for the response only when missing, never written here"""
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        # Rows are seeded by submit_quiz and backfill_stats; a GET may be reading a replica
+        stats = compute_stats(user_id)
+        metrics.incr('user_stats.computed')
+    return stats
+
+
+def record_quiz_result(user_id, previous_score, score):
+    """Apply one quiz result to the user's stats row (caller commits)"""
+    # Incremented in SQL so concurrent submits by one user do not overwrite each other
+    increment = update(UserStats).where(UserStats.user_id == user_id).values(
+        attempted_count=UserStats.attempted_count + int(previous_score is None),
+        score_total=UserStats.score_total + (score - (previous_score or 0)),
+        completed_count=UserStats.completed_count + int(_passed(score)) - int(_passed(previous_score))
+    )
+    if db.session.execute(increment).rowcount == 0:
+        # Seeding reads user_progress, which must already include this result
+        db.session.flush()
+        seeded = db.session.execute(
+            insert_or_ignore(UserStats).values(**_computed_values(user_id))
+        ).rowcount
+        if seeded:
+            metrics.incr('user_stats.seeded')
+            return
+        # A concurrent submit seeded the row first, without this result
+        db.session.execute(increment)
+
+    # The update holds the row until commit, so this count is current
+    completed = db.session.query(UserStats.completed_count).filter_by(user_id=user_id).scalar()
+    db.session.execute(update(UserStats).where(UserStats.user_id == user_id).values(
+        badges=json.dumps(badges_for(completed))
+    ))
+    metrics.incr('user_stats.updates')
+
+
+def backfill_stats(batch_size=1000):
+    """Seed rows for users with quiz progress from before stats existed; returns how many"""
+    missing = _aggregates().filter(
+        ~db.session.query(UserStats.user_id).filter(UserStats.user_id == UserProgress.user_id).exists()
+    ).all()
+    values = [_values(*row) for row in missing]
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert_or_ignore(UserStats), values[start:start + batch_size])
+    db.session.commit()
+    return len(values)
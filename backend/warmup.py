@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Worker warm-up, so a fresh gunicorn worker serves its first request hot.
+
+With preload_app the app is imported once in the master and every worker
+(including each recycle after max_requests) is forked from it. The post_fork
+hook in gunicorn.conf.py calls warm_up() in the new worker before it accepts
+connections: database pools inherited from the master are discarded (their
+sockets must not be shared across processes) and refilled with fresh
+connections, then every registered warmer runs (gazetteer, prepared alert
+areas, the catalog response cache, ...). Outside gunicorn the same warm-up
+runs on the first request.
+
+/health stays a pure liveness check; /health/ready answers 503 until this
+worker has warmed up. The first-request penalty is measured per worker as
+the warmup.first_request_ms and warmup.steady_request_ms gauges.
+
+Benchmark: python warmup.py bench   # first-request latency of forked workers, cold vs warm
+"""
+
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from flask import g
+
+import metrics
+from database import db
+
+logger = logging.getLogger('vajra.warmup')
+
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+# Connections opened per engine; defaults to the gunicorn thread count
+WARMUP_POOL_CONNECTIONS = int(os.getenv('WARMUP_POOL_CONNECTIONS', os.getenv('THREADS', '1')))
+# Requests after the first used to measure steady-state latency
+STEADY_SAMPLE_SIZE = 100
+
+_warmers = {}
+_state = {'pid': None, 'ready': False, 'warming': None, 'started_at': None, 'finished_at': None, 'warmers': {}}
+_lock = threading.Lock()
+_latency = {'pid': None, 'first': None, 'samples': []}
+
+
+def register_warmer(name, func):
+    """Register a callable run inside an app context when a worker warms up"""
+    _warmers[name] = func
+
+
+def warm_request(app, path):
+    """Warmer that GETs path once through the app, filling whatever caches serve it"""
+    def warm():
+        with app.test_client() as client:
+            status = client.get(path).status_code
+        if status >= 400:
+            raise RuntimeError(f'GET {path} returned {status}')
+    return warm
+
+
+def connect_pools(connections=None):
+    """Drop pool connections inherited through fork, then open fresh ones on every engine"""
+    connections = connections or max(1, WARMUP_POOL_CONNECTIONS)
+    for engine in db.engines.values():
+        # close=False: the master still owns those sockets; just forget them here
+        engine.dispose(close=False)
+        opened = []
+        try:
+            for _ in range(connections):
+                conn = engine.connect()
+                conn.exec_driver_sql('SELECT 1')
+                opened.append(conn)
+        finally:
+            for conn in opened:
+                conn.close()  # back into the pool, still connected
+
+
+def is_ready():
+    """Whether this worker has finished warming up (always, with warm-up disabled)"""
+    return not WARMUP_ENABLED or (_state['ready'] and _state['pid'] == os.getpid())
+
+
+def status():
+    """Readiness details for this worker"""
+    return {
+        'ready': is_ready(),
+        'pid': os.getpid(),
+        'started_at': _state['started_at'] if _state['pid'] == os.getpid() else None,
+        'finished_at': _state['finished_at'] if _state['pid'] == os.getpid() else None,
+        'warmers': _state['warmers'] if _state['pid'] == os.getpid() else {},
+    }
+
+
+def warm_up(app):
+    """Run every warmer once in this process; a failing warmer is logged and skipped"""
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state.update(pid=os.getpid(), ready=False, warming=threading.get_ident(),
+                      started_at=time.time(), finished_at=None, warmers={})
+        started = time.perf_counter()
+        with app.app_context():
+            for name, func in _warmers.items():
+                warmer_started = time.perf_counter()
+                try:
+                    func()
+                    result = {'ok': True}
+                except Exception as e:
+                    db.session.rollback()
+                    metrics.incr(f'warmup.{name}.errors')
+                    logger.exception('warmer_failed', extra={'warmer': name})
+                    result = {'ok': False, 'error': str(e)}
+                result['ms'] = round((time.perf_counter() - warmer_started) * 1000, 1)
+                metrics.set_gauge(f'warmup.{name}.ms', result['ms'])
+                _state['warmers'][name] = result
+            db.session.remove()
+        metrics.set_gauge('warmup.total_ms', round((time.perf_counter() - started) * 1000, 1))
+        _state.update(ready=True, warming=None, finished_at=time.time())
+
+
+def on_post_fork(app):
+    """gunicorn post_fork hook body (see gunicorn.conf.py)"""
+    if WARMUP_ENABLED:
+        warm_up(app)
+
+
+def _record_latency(elapsed_ms):
+    if _latency['pid'] != os.getpid():
+        _latency.update(pid=os.getpid(), first=None, samples=[])
+    if _latency['first'] is None:
+        _latency['first'] = elapsed_ms
+        metrics.set_gauge('warmup.first_request_ms', round(elapsed_ms, 2))
+    elif len(_latency['samples']) < STEADY_SAMPLE_SIZE:
+        _latency['samples'].append(elapsed_ms)
+        if len(_latency['samples']) == STEADY_SAMPLE_SIZE:
+            steady = statistics.median(_latency['samples'])
+            metrics.set_gauge('warmup.steady_request_ms', round(steady, 2))
+            metrics.set_gauge('warmup.first_request_penalty_ms', round(_latency['first'] - steady, 2))
+
+
+def init_warmup(app):
+    @app.before_request
+    def ensure_warm():
+        if _state['warming'] == threading.get_ident() and _state['pid'] == os.getpid():
+            return  # a warmer's own request
+        # Only reached without the gunicorn hook (flask run, tests); the wait counts as penalty
+        g.request_started = time.perf_counter()
+        if WARMUP_ENABLED and not is_ready():
+            warm_up(app)  # waits for a warm-up already running in another thread
+
+    @app.after_request
+    def measure_latency(response):
+        started = g.get('request_started')
+        if started is not None:
+            _record_latency((time.perf_counter() - started) * 1000)
+        return response
+
+
+def _time_requests(client, paths, headers):
+    timings = []
+    for path in paths:
+        started = time.perf_counter()
+        status_code = client.get(path, headers=headers).status_code
+        timings.append(((time.perf_counter() - started) * 1000, status_code))
+    return timings
+
+
+def benchmark(paths):
+    """Fork workers from the preloaded app like gunicorn does and time their first requests"""
+    # The app registers its warmers on the importable module, not on __main__
+    import warmup as module
+    from app import app
+    from flask_jwt_extended import create_access_token
+    from models import User
+
+    with app.app_context():
+        user = User(username='warmup-bench', email='warmup-bench@example.invalid', password_hash='-',
+                    state='Kerala', city='Kochi')
+        db.session.add(user)
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+    for mode in ('cold', 'warm'):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            module.WARMUP_ENABLED = mode == 'warm'
+            warm_ms = 0.0
+            if mode == 'warm':
+                started = time.perf_counter()
+                module.on_post_fork(app)
+                warm_ms = (time.perf_counter() - started) * 1000
+            client = app.test_client()
+            first = _time_requests(client, paths, headers)
+            again = _time_requests(client, paths, headers)
+            lines = [f'{mode}: warm-up {warm_ms:.1f} ms']
+            for path, (ms, code), (ms2, _) in zip(paths, first, again):
+                lines.append(f'  {path:<28} first {ms:8.2f} ms   next {ms2:8.2f} ms   ({code})')
+            os.write(write_fd, ('\n'.join(lines) + '\n').encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            print(pipe.read(), end='')
+        os.waitpid(pid, 0)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'bench':
+        print('usage: python warmup.py bench [path ...]')
+        sys.exit(2)
+    paths = sys.argv[2:] or ['/api/resources', '/api/communities', '/api/alerts', '/api/auth/me']
+
+    # Never touch the configured database
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    try:
+        benchmark(paths)
+    finally:
+        os.remove(scratch.name)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -55,10 +55,9 @@ export const authAPI = {
     if (!token) return null;
     
     try {
-      const payload = JSON.parse(atob(token.split('.')[1]));
-      // Now, make an actual API call to get the full user profile
-      const response = await api.get(`/user/${payload.sub}`);
-      return response.data.user; // Assuming the backend returns { user: {...} }
+      // Lightweight identity lookup; the progress history is not loaded
+      const response = await api.get('/auth/me');
+      return response.data.user;
     } catch (error) {
       console.error('Error fetching current user profile:', error);
       // If token is invalid or expired, the response interceptor will handle redirect
@@ -110,7 +109,7 @@ export const quizAPI = {
 // User APIs
 export const userAPI = {
   getProfile: async (userId) => {
-    const response = await api.get(`/user/${userId}`);
+    const response = await api.get(`/user/${userId}`, { params: { include: 'progress' } });
     return response.data;
   },
   
@@ -131,6 +130,12 @@ export const adminAPI = {
     return response.data;
   },
   
+  // Per-region quiz performance; params: level (national|state|city), state, category
+  getRegionalAnalytics: async (params = {}) => {
+    const response = await api.get('/admin/analytics/regional', { params });
+    return response.data;
+  },
+  
   // User Management
   getAllUsers: async (params = {}) => {
     const response = await api.get('/admin/users', { params });